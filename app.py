@@ -1,14 +1,50 @@
 import streamlit as st
 import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import copy
 import json
 import os
+import re
 from datetime import datetime, timedelta
 import uuid
 from pathlib import Path
 import base64
+import tempfile
+import time
 from template_structure import USE_CASE_COLUMNS, TEMPLATE_STAGES
-from consolidated_map_template import CONSOLIDATED_MAP_TEMPLATE
+from plan_utils import (
+    STATUS_OPTIONS, DEFAULT_VIEW_COLUMNS, CATEGORICAL_COLUMNS,
+    activity_positions, apply_view_edits, plan_db_rows,
+    build_plan_rows, page_bounds
+)
 from services.lakebase import lakebase
+from services.exports import EXPORT_FORMATS, XLSX_MIME, export_plan, export_portfolio_xlsx
+from services.xlsx_export import XLSX_AVAILABLE
+from services.map_importer import OPENPYXL_AVAILABLE, import_workbooks, summarize_report
+from services.template_compiler import check_template_drift
+from services.template_store import get_template, publish_template, list_template_versions, load_template_version
+from services.template_migration import compute_template_mapping, migrate_use_case_maps, migrate_local_use_cases
+from services.map_clone import clone_map, cloned_requirements, stages_from_cloned_rows
+from services.analytics import portfolio_analytics
+from services.gantt import LOD_LEVELS, DEFAULT_MAX_BARS, build_gantt
+from services.activity_intervals import (
+    LocalActivityIndex, query_lakebase_due, query_lakebase_overdue, query_lakebase_window, week_window
+)
+from services.workload import (
+    UNASSIGNED_OWNER, LocalWorkload, lakebase_workload, split_owners, week_range, week_start, workload_matrix
+)
+from services.levelling import DEFAULT_CAPACITY, apply_levelling, level_resources
+from services.schedule_risk import DISTRIBUTIONS, DEFAULT_TRIALS, activity_estimate, simulate_schedule
+from services.duration_stats import estimate_activity, get_duration_stats, refresh_after_save
+from services.recommender import index_use_case, similar_maps
+from services.deviation import load_deviations, top_deviations
+from services.delta_storage import save_use_case_delta
+from services.document_storage import VERSION_KEY, load_use_case_document, save_use_case_document
+from services.row_storage import save_use_case_rows
+from services.schema_migration import normalised_schema_active
+from services.change_log import change_history, flush_changes, reconstruct_use_case, record_change
+from services.outbox import start_worker
 from config import Config
 
 # Configure Streamlit page
@@ -24,6 +60,30 @@ DATA_DIR = Path("use_case_data")
 DATA_DIR.mkdir(exist_ok=True)
 USERS_FILE = DATA_DIR / "users.json"
 USE_CASES_FILE = DATA_DIR / "use_cases.json"
+EXPORTS_DIR = DATA_DIR / "exports"
+OUTBOX_FILE = DATA_DIR / "outbox.sqlite3"
+
+# Page sizes offered by the Excel-like view
+PLAN_PAGE_SIZES = [25, 50, 100, 250]
+ANALYTICS_TTL_SECONDS = 120
+GANTT_MAX_BARS = [1000, DEFAULT_MAX_BARS, 20000, 50000]
+
+# Save function of each Config.STORAGE_MODE, all returning (success, message)
+STORAGE_BACKENDS = {
+    'rows': save_use_case_rows,
+    'delta': save_use_case_delta,
+    'document': save_use_case_document
+}
+
+# Database sync state of a use case, as shown next to it
+SYNC_LABELS = {
+    'synced': ("✅", "Synced"),
+    'pending': ("⏳", "Syncing"),
+    'retrying': ("⚠️", "Sync failed, retrying"),
+    'conflict': ("⛔", "Changed in the database by someone else"),
+    'failed': ("❌", "Sync failed, stopped retrying"),
+    'local': ("💾", "Local only")
+}
 
 def load_databricks_logo():
     """Load the actual Databricks logo"""
@@ -77,106 +137,262 @@ def generate_readable_use_case_id(customer_name):
     year = now.strftime('%Y')
     month = now.strftime('%m')
 
-    # Generate sequence number (try to get from database, fallback to random)
+    # Next number after the highest one issued for this prefix, locally (saves
+    # may still be queued) and in the database, archived plans included
+    prefix = f"{customer_code}-{year}-{month}-"
+    pattern = f"^{prefix}[0-9]+$"
+    issued = [int(use_case_id[len(prefix):]) for use_case_id in st.session_state.get('use_cases', {})
+              if re.match(pattern, use_case_id)]
     try:
         if Config.validate():
             lakebase.connect()
-            # Get count of use cases for this customer in this month
+            table = "test.use_cases" if normalised_schema_active() else "test.use_case_maps"
+            lakebase.create_use_case_maps_archive_table()
             result = lakebase.query(f"""
-                SELECT COUNT(*) FROM test.use_case_maps
-                WHERE customer_name = %s
-                AND EXTRACT(YEAR FROM created_at) = %s
-                AND EXTRACT(MONTH FROM created_at) = %s
-            """, (customer_name, int(year), int(month)))
-
-            seq = (result[0][0] + 1) if result and result[0] else 1
+                SELECT MAX(substring(use_case_id FROM '[0-9]+$')::int)
+                FROM (SELECT use_case_id FROM {table} WHERE use_case_id ~ %(pattern)s
+                      UNION ALL
+                      SELECT use_case_id FROM test.use_case_maps_archive WHERE use_case_id ~ %(pattern)s) ids
+            """, {'pattern': pattern})
+            if result and result[0][0] is not None:
+                issued.append(result[0][0])
             lakebase.close()
-        else:
-            seq = 1
-    except:
-        # Fallback to random number if query fails
-        seq = 1
+    except Exception as e:
+        print(f"Error reading use case id sequence: {e}")
 
+    seq = max(issued, default=0) + 1
     return f"{customer_code}-{year}-{month}-{seq:03d}"
 
+def storage_mode_error():
+    """Why saves cannot use Config.STORAGE_MODE yet, or None
+
+    Every reader (sidebar, clone, analytics, workload, finder, deviation,
+    recommender, duration stats) queries test.use_case_maps. Delta saves only
+    show up there once it is the view over the normalised tables; document
+    saves never do, so that layout is left to the benchmark.
+    """
+    if Config.STORAGE_MODE == 'document':
+        return ("Document storage is not read by the app yet (benchmark only); "
+                "set LAKEBASE_STORAGE_MODE=rows")
+    if Config.STORAGE_MODE == 'delta':
+        lakebase.connect()
+        if not normalised_schema_active():
+            return ("Delta storage needs test.use_case_maps switched to the normalised view first: "
+                    "python -m services.schema_migration switch")
+    return None
+
 def save_use_case_to_lakebase(use_case_data, user_name):
-    """Save use case to Lakebase database in test.use_case_maps table"""
+    """Save use case to Lakebase in the layout selected by Config.STORAGE_MODE
+
+    'rows' writes one test.use_case_maps row per activity, 'delta' the
+    template-delta tables and 'document' one JSONB document per use case.
+    """
+    if not Config.validate():
+        return False, "Database configuration not valid"
+
+    refused = storage_mode_error()
+    if refused:
+        return False, refused
+
+    save = STORAGE_BACKENDS.get(Config.STORAGE_MODE, save_use_case_rows)
+    success, message = save(use_case_data, user_name)
+    if success:
+        index_use_case(use_case_data)
+        refresh_after_save()
+    return success, message
+
+def update_use_case_activities_in_lakebase(use_case_data, changes, start_shift_days, user_name):
+    """Apply targeted activity updates to test.use_case_maps
+
+    Only the columns that changed are written, matching rows by their
+    stored position in the plan. A duration change moves the dates of
+    every later activity, so each row is compared in full against the plan
+    before the edit. Rows with the same set of changed columns are sent as
+    one batch. When the stored rows no longer line up with the plan (a
+    position missing, or a different stage or outcome at it), or in delta
+    and document storage mode, the use case is simply saved again.
+    """
     try:
         if not Config.validate():
             return False, "Database configuration not valid"
 
+        if Config.STORAGE_MODE in ('delta', 'document'):
+            return save_use_case_to_lakebase(use_case_data, user_name)
+
         lakebase.connect()
+        now = datetime.now()
+        updated = 0
+
+        # The plan before the edit, to compare the stored rows and each edited row against
+        before_plan = copy.deepcopy(use_case_data)
+        positions = activity_positions(before_plan)
+        for change in changes:
+            stage_idx, activity_idx = positions[change['position']]
+            before_plan['stages'][stage_idx]['activities'][activity_idx] = change['before']
+
+        # (its dates are at the new start date, like the rows after the shift below)
+        before_rows = plan_db_rows(before_plan)
+        after_rows = plan_db_rows(use_case_data)
+        stored = lakebase.query("""
+            SELECT p_id, position, "Stage", COALESCE("Outcome", "Action")
+            FROM test.use_case_maps
+            WHERE use_case_id = %(use_case_id)s
+            ORDER BY position NULLS LAST, p_id
+        """, {'use_case_id': use_case_data['use_case_id']}) or []
+        expected = [(position, stage_code, fields['Outcome'])
+                    for position, (stage_code, _, fields) in enumerate(before_rows)]
+        if [tuple(row[1:]) for row in stored] != expected:
+            lakebase.close()
+            return save_use_case_to_lakebase(use_case_data, user_name)
+        p_ids = [row[0] for row in stored]
+
+        # Plan start moved: shift every activity of the use case in one statement
+        if start_shift_days:
+            updated += lakebase.query("""
+                UPDATE test.use_case_maps
+                SET "Start_Date" = "Start_Date" + %(days)s,
+                    "End_Date" = "End_Date" + %(days)s,
+                    updated_by = %(updated_by)s,
+                    updated_at = %(updated_at)s
+                WHERE use_case_id = %(use_case_id)s
+            """, {
+                'days': start_shift_days,
+                'updated_by': user_name,
+                'updated_at': now,
+                'use_case_id': use_case_data['use_case_id']
+            }) or 0
+
+        # Group row updates by the set of columns they change
+        batches = {}
+        for p_id, (_, _, before), (_, _, after) in zip(p_ids, before_rows, after_rows):
+            columns = tuple(column for column in after if after[column] != before[column])
+            if not columns:
+                continue
+
+            params = {column: after[column] for column in columns}
+            params.update({
+                'use_case_id': use_case_data['use_case_id'],
+                'p_id': p_id,
+                'updated_by': user_name,
+                'updated_at': now
+            })
+            batches.setdefault(columns, []).append(params)
+
+        for columns, params_list in batches.items():
+            set_clause = ', '.join(f'"{column}" = %({column})s' for column in columns)
+            update_sql = f"""
+                UPDATE test.use_case_maps
+                SET {set_clause}, updated_by = %(updated_by)s, updated_at = %(updated_at)s
+                WHERE use_case_id = %(use_case_id)s
+                AND p_id = %(p_id)s
+            """
+            if len(params_list) == 1:
+                updated += lakebase.query(update_sql, params_list[0]) or 0
+            else:
+                updated += lakebase.execute_many(update_sql, params_list) or 0
 
-        # First ensure the table exists
-        lakebase.create_use_case_maps_table()
+        lakebase.close()
+        index_use_case(use_case_data)
+        refresh_after_save()
+        return True, f"Updated {updated} rows in database"
 
-        # Prepare rows for insertion - one row per activity
-        rows = []
-        for stage in use_case_data['stages']:
-            stage_name = stage['stage_name']
+    except Exception as e:
+        return False, f"Failed to update database: {str(e)}"
+
+def sync_outbox_entry(kind, payload, user_name):
+    """Apply one outbox entry to Lakebase (runs on the outbox worker thread)"""
+    if kind == 'save':
+        return save_use_case_to_lakebase(payload['use_case'], user_name)
+    return update_use_case_activities_in_lakebase(
+        payload['use_case'], payload['changes'], payload['start_shift_days'], user_name
+    )
 
-            # Extract stage code (U2-U6)
-            import re
-            u_stage_match = re.search(r'(U[2-6])', stage_name)
-            if u_stage_match:
-                stage_code = u_stage_match.group(1)
+def get_outbox():
+    """The durable save outbox, with its background worker started once per process"""
+    return start_worker(OUTBOX_FILE, sync_outbox_entry)
+
+def queue_use_case_save(use_case_data, user_name):
+    """Queue a full save of the use case for the background worker; returns at once"""
+    if not Config.validate():
+        return False, "Database configuration not valid"
+    get_outbox().enqueue('save', use_case_data['use_case_id'], {'use_case': use_case_data}, user_name)
+    return True, "Saved locally; syncing to database in background"
+
+def queue_use_case_update(use_case_data, changes, start_shift_days, user_name):
+    """Queue targeted activity updates for the background worker; returns at once"""
+    if not Config.validate():
+        return False, "Database configuration not valid"
+    get_outbox().enqueue('update', use_case_data['use_case_id'], {
+        'use_case': use_case_data, 'changes': changes, 'start_shift_days': start_shift_days
+    }, user_name)
+    return True, "syncing to database in background"
+
+def use_case_sync_statuses():
+    """{use_case_id: sync status} from the outbox; empty without a database"""
+    if not Config.validate():
+        return {}
+    try:
+        return get_outbox().statuses()
+    except Exception:
+        return {}
+
+def get_local_activity_index():
+    """Interval index over the local store, rebuilt only when a use case changes"""
+    stamp = tuple((uc_id, uc.get('updated_at')) for uc_id, uc in st.session_state.use_cases.items())
+    cached = st.session_state.get('local_activity_index')
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, LocalActivityIndex(uc for uc in st.session_state.use_cases.values() if uc.get('stages')))
+        st.session_state.local_activity_index = cached
+    return cached[1]
+
+def find_activities(query, start=None, end=None, owner=None, statuses=None, customers=None):
+    """Run a 'due', 'window' or 'overdue' activity query against Lakebase, or the local store offline"""
+    if Config.validate():
+        try:
+            lakebase.connect()
+            if query == 'overdue':
+                results = query_lakebase_overdue(owner=owner, customers=customers)
+            elif query == 'due':
+                results = query_lakebase_due(start, end, owner, statuses, customers)
             else:
-                stage_code = stage_name
-
-            for activity in stage['activities']:
-                # Calculate dates
-                start_date = datetime.fromisoformat(use_case_data['start_date'])
-                end_date = start_date + timedelta(days=activity.get('duration_days', 5))
-
-                row = {
-                    'use_case_id': use_case_data['use_case_id'],
-                    'use_case_name': use_case_data['name'],
-                    'customer_name': use_case_data['customer'],
-                    'Stage': stage_code,
-                    'Outcome': activity['activity'],
-                    'Embedded_Questions': activity.get('description', ''),
-                    'Owner_Name': activity.get('owner', ''),
-                    'Start_Date': start_date.date(),
-                    'End_Date': end_date.date(),
-                    'Progress': 0.0 if activity.get('status', 'Not Started') == 'Not Started' else 50.0,
-                    'Notes': '',
-                    'Action': activity['activity'],
-                    'solution_architect': use_case_data.get('solution_architect', ''),
-                    'account_executive': use_case_data.get('account_executive', ''),
-                    'ssa_required': use_case_data.get('ssa_required', False),
-                    'poc_required': use_case_data.get('poc_happening', False),
-                    'created_by': user_name,
-                    'created_at': datetime.now(),
-                    'updated_by': user_name,
-                    'updated_at': datetime.now()
-                }
-                rows.append(row)
-
-        # Insert rows using executemany for efficiency
-        insert_sql = """
-            INSERT INTO test.use_case_maps (
-                use_case_id, use_case_name, customer_name, "Stage", "Outcome",
-                "Embedded_Questions", "Owner_Name", "Start_Date", "End_Date",
-                "Progress", "Notes", "Action", solution_architect, account_executive,
-                ssa_required, poc_required, created_by, created_at, updated_by, updated_at
-            ) VALUES (
-                %(use_case_id)s, %(use_case_name)s, %(customer_name)s, %(Stage)s, %(Outcome)s,
-                %(Embedded_Questions)s, %(Owner_Name)s, %(Start_Date)s, %(End_Date)s,
-                %(Progress)s, %(Notes)s, %(Action)s, %(solution_architect)s, %(account_executive)s,
-                %(ssa_required)s, %(poc_required)s, %(created_by)s, %(created_at)s, %(updated_by)s, %(updated_at)s
-            )
-        """
+                results = query_lakebase_window(start, end, owner, statuses, customers)
+            lakebase.close()
+            return results, "Lakebase"
+        except Exception as e:
+            print(f"Error querying activity dates, using local store: {e}")
+
+    index = get_local_activity_index()
+    if query == 'overdue':
+        return index.overdue(owner=owner, customers=customers), "local store"
+    if query == 'due':
+        return index.due(start, end, owner, statuses, customers), "local store"
+    return index.window(start, end, owner, statuses, customers), "local store"
+
+def import_uploaded_workbooks(uploads, customer, user_name):
+    """Import uploaded MAP workbooks into Lakebase, returning (report, summary)"""
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for idx, upload in enumerate(uploads):
+            # One folder per upload: files with the same name must not overwrite each other
+            path = Path(tmp_dir) / str(idx) / Path(upload.name).name
+            path.parent.mkdir()
+            path.write_bytes(upload.getbuffer())
+            paths.append(path)
 
-        lakebase.execute_many(insert_sql, rows)
-        lakebase.close()
+        try:
+            report = import_workbooks(paths, user_name, customer=customer, workers=min(len(paths), 4))
+        except Exception as e:
+            report = [{'file': path.name, 'use_case_id': '', 'status': 'failed', 'rows': 0, 'errors': 1,
+                       'seconds': 0.0, 'rows_per_second': 0.0, 'error_details': [str(e)]} for path in paths]
 
-        return True, f"Successfully saved {len(rows)} activities to database"
+    return report, summarize_report(report, time.perf_counter() - started)
 
-    except Exception as e:
-        return False, f"Failed to save to database: {str(e)}"
+def load_maps_from_database(include_archived=False):
+    """Load existing maps from Lakebase database (both test.maps and test.use_case_maps)
 
-def load_maps_from_database():
-    """Load existing maps from Lakebase database (both test.maps and test.use_case_maps)"""
+    With include_archived the most recently archived plans are listed too.
+    """
     try:
         if not Config.validate():
             return []
@@ -213,17 +429,32 @@ def load_maps_from_database():
 
         # Load from test.use_case_maps (app-created use cases)
         try:
-            use_case_maps_query = lakebase.query("""
-                SELECT DISTINCT use_case_id, use_case_name, customer_name,
-                       COUNT(*) as activity_count,
-                       MIN("Start_Date") as start_date,
-                       MAX("End_Date") as end_date
-                FROM test.use_case_maps
-                WHERE use_case_id IS NOT NULL AND use_case_id != ''
-                GROUP BY use_case_id, use_case_name, customer_name
-                ORDER BY created_at DESC
-                LIMIT 25
-            """)
+            if normalised_schema_active():
+                # Header scan; only the listed use cases' activities are counted
+                use_case_maps_query = lakebase.query("""
+                    SELECT h.use_case_id, h.use_case_name, h.customer_name,
+                           a.activity_count, a.start_date, a.end_date
+                    FROM test.use_cases h
+                    CROSS JOIN LATERAL (
+                        SELECT COUNT(*), MIN("Start_Date"), MAX("End_Date")
+                        FROM test.use_case_activities
+                        WHERE use_case_id = h.use_case_id
+                    ) a(activity_count, start_date, end_date)
+                    ORDER BY h.created_at DESC
+                    LIMIT 25
+                """)
+            else:
+                use_case_maps_query = lakebase.query("""
+                    SELECT DISTINCT use_case_id, use_case_name, customer_name,
+                           COUNT(*) as activity_count,
+                           MIN("Start_Date") as start_date,
+                           MAX("End_Date") as end_date
+                    FROM test.use_case_maps
+                    WHERE use_case_id IS NOT NULL AND use_case_id != ''
+                    GROUP BY use_case_id, use_case_name, customer_name
+                    ORDER BY created_at DESC
+                    LIMIT 25
+                """)
 
             if use_case_maps_query:
                 for map_data in use_case_maps_query:
@@ -241,6 +472,37 @@ def load_maps_from_database():
             # Table might not exist yet
             print(f"Note: test.use_case_maps table not found or empty: {e}")
 
+        # Load from test.use_case_maps_archive (closed plans, latest archived batch of each)
+        if include_archived:
+            try:
+                lakebase.create_use_case_maps_archive_table()
+                archived_query = lakebase.query("""
+                    SELECT use_case_id, MAX(use_case_name), MAX(customer_name),
+                           COUNT(*) as activity_count,
+                           MIN("Start_Date") as start_date,
+                           MAX("End_Date") as end_date
+                    FROM (SELECT *, archived_at = MAX(archived_at) OVER (PARTITION BY use_case_id) AS latest
+                          FROM test.use_case_maps_archive) a
+                    WHERE latest
+                    GROUP BY use_case_id
+                    ORDER BY MAX(archived_at) DESC
+                    LIMIT 25
+                """)
+
+                for map_data in archived_query or []:
+                    maps_list.append({
+                        'id': map_data[0],
+                        'name': map_data[1],
+                        'customer': map_data[2],
+                        'activity_count': map_data[3],
+                        'start_date': map_data[4],
+                        'end_date': map_data[5],
+                        'source': 'use_case_maps_archive',
+                        'editable': False
+                    })
+            except Exception as e:
+                print(f"Error loading from test.use_case_maps_archive: {e}")
+
         lakebase.close()
         return maps_list
     except Exception as e:
@@ -281,38 +543,54 @@ def load_map_details(map_id):
         print(f"Error loading map details: {e}")
         return []
 
-def load_template_from_database():
-    """Load template from Lakebase database"""
-    try:
-        if not Config.validate():
-            return None
+def clone_map_to_lakebase(map_data, details, user_name):
+    """Clone a database map into a new use case
 
+    The source activities (owner substitution, date shifting and duration
+    estimates included) are read in one SELECT and become the local copy of
+    the use case, which is then saved like a form save so its rows have the
+    order and dates the view shows. Returns (success, use_case_data or error
+    message).
+    """
+    try:
+        use_case_id = generate_readable_use_case_id(details['customer'])
         lakebase.connect()
-
-        template_query = lakebase.query("""
-            SELECT stage, outcome, asset_podcast, owner_name
-            FROM test.template
-            ORDER BY id
-        """)
-
-        template_data = {}
-        if template_query:
-            for row in template_query:
-                stage = row[0]
-                if stage not in template_data:
-                    template_data[stage] = []
-
-                template_data[stage].append({
-                    'outcome': row[1],
-                    'questions': row[2],
-                    'owner': row[3] or ''
-                })
-
+        # Taken before the rows are written, so the plan is never newer than its rows
+        now = datetime.now().isoformat()
+        rows = clone_map(
+            map_data['id'], map_data['source'], details['customer'],
+            details['solution_architect'], details['account_executive'], details['start_date']
+        )
         lakebase.close()
-        return template_data
+
+        if not rows:
+            return False, f"Map {map_data['id']} has no activities to clone"
+
+        stages = stages_from_cloned_rows(rows)
+        ssa_required, poc_happening = cloned_requirements(rows)
+        use_case_data = {
+            'use_case_id': use_case_id,
+            'user_id': user_name,
+            'name': details['name'],
+            'customer': details['customer'],
+            'solution_architect': details['solution_architect'],
+            'account_executive': details['account_executive'],
+            'start_date': details['start_date'].isoformat(),
+            'duration_months': details['duration_months'],
+            'ssa_required': ssa_required,
+            'poc_happening': poc_happening,
+            'status': 'Planning',
+            'stages': stages,
+            'created_at': now,
+            'updated_at': now
+        }
+        success, message = save_use_case_to_lakebase(use_case_data, user_name)
+        if not success:
+            return False, message
+        return True, use_case_data
     except Exception as e:
-        print(f"Error loading template from database: {e}")
-        return None
+        print(f"Error cloning map: {e}")
+        return False, str(e)
 
 def initialize_session_state():
     """Initialize session state variables"""
@@ -330,6 +608,16 @@ def initialize_session_state():
         st.session_state.create_from_map = None
     if 'create_from_db_template' not in st.session_state:
         st.session_state.create_from_db_template = False
+    if 'show_template_manager' not in st.session_state:
+        st.session_state.show_template_manager = False
+    if 'show_analytics' not in st.session_state:
+        st.session_state.show_analytics = False
+    if 'show_portfolio_timeline' not in st.session_state:
+        st.session_state.show_portfolio_timeline = False
+    if 'show_workload' not in st.session_state:
+        st.session_state.show_workload = False
+    if 'clone_source' not in st.session_state:
+        st.session_state.clone_source = None
 
 def inject_custom_css():
     """Inject improved Databricks-style CSS with better proportions"""
@@ -728,6 +1016,37 @@ def inject_custom_css():
     </style>
     """, unsafe_allow_html=True)
 
+def render_activity_finder(user_name):
+    """Sidebar lookup of due, overdue and in-window activities"""
+    query = st.radio("Show", ["Due this week", "Overdue", "Date range"], key="finder_query")
+    owner = st.text_input("Owner contains", value=user_name, key="finder_owner")
+    customers = st.multiselect("Customers", sorted({uc['customer'] for uc in st.session_state.use_cases.values()}),
+                               key="finder_customers")
+
+    start, end = week_window()
+    if query == "Date range":
+        window = st.date_input("Window", value=(start, end), key="finder_window")
+        if len(window) != 2:
+            return
+        start, end = window
+
+    statuses = None
+    if query != "Overdue":
+        statuses = st.multiselect("Status", STATUS_OPTIONS, key="finder_statuses")
+
+    finder_queries = {"Due this week": 'due', "Overdue": 'overdue', "Date range": 'window'}
+    results, source = find_activities(
+        finder_queries[query],
+        start, end, owner or None, statuses, customers
+    )
+    st.caption(f"{len(results)} activities from the {source}")
+    if results:
+        st.dataframe(
+            pd.DataFrame(results)[['end', 'use_case_id', 'activity', 'status']],
+            use_container_width=True,
+            hide_index=True
+        )
+
 def render_header():
     """Render the main header with Databricks logo"""
     logo_url = load_databricks_logo()
@@ -837,6 +1156,11 @@ def render_sidebar():
                         # Always use database template
                         st.session_state.create_from_db_template = True
                         st.session_state.create_from_map = None
+                        st.session_state.clone_source = None
+                        st.session_state.show_template_manager = False
+                        st.session_state.show_analytics = False
+                        st.session_state.show_portfolio_timeline = False
+                        st.session_state.show_workload = False
                         st.rerun()
 
                     # List user's use cases
@@ -845,8 +1169,10 @@ def render_sidebar():
 
                     if user_use_cases:
                         st.markdown("##### Your Use Cases")
+                        sync_statuses = use_case_sync_statuses()
                         for uc_id, uc in user_use_cases.items():
-                            with st.expander(f"{uc['use_case_id'][:15]}"):
+                            sync_icon = SYNC_LABELS[sync_statuses.get(uc_id, {'state': 'local'})['state']][0]
+                            with st.expander(f"{sync_icon} {uc['use_case_id'][:15]}"):
                                 st.write(f"**{uc['name']}**")
                                 st.write(f"Customer: {uc['customer']}")
                                 st.write(f"Status: {uc.get('status', 'Planning')}")
@@ -856,14 +1182,69 @@ def render_sidebar():
                                     if st.button("View", key=f"view_{uc_id}", use_container_width=True):
                                         st.session_state.editing_use_case = uc_id
                                         st.session_state.show_new_use_case_form = False
+                                        st.session_state.show_template_manager = False
+                                        st.session_state.show_analytics = False
+                                        st.session_state.show_portfolio_timeline = False
+                                        st.session_state.show_workload = False
+                                        st.session_state.clone_source = None
                                 with col2:
                                     if st.button("Delete", key=f"del_{uc_id}", use_container_width=True):
+                                        record_change(st.session_state.use_cases[uc_id], None,
+                                                      st.session_state.current_user, 'delete')
                                         del st.session_state.use_cases[uc_id]
                                         save_use_cases(st.session_state.use_cases)
                                         st.rerun()
                     else:
                         st.info("No use cases yet")
 
+                    if st.button("👥 Team Workload", key="workload_btn", use_container_width=True):
+                        st.session_state.show_workload = True
+                        st.session_state.show_portfolio_timeline = False
+                        st.session_state.show_analytics = False
+                        st.session_state.show_template_manager = False
+                        st.session_state.clone_source = None
+                        st.rerun()
+
+                    # Due / overdue / in-window lookups, pushed down to Lakebase when configured
+                    if st.session_state.use_cases or Config.validate():
+                        with st.expander("📅 Due & Overdue", expanded=False):
+                            render_activity_finder(user['name'])
+
+                    if user_use_cases and st.button("🗓️ Portfolio Timeline", key="portfolio_timeline_btn",
+                                                    use_container_width=True):
+                        st.session_state.show_portfolio_timeline = True
+                        st.session_state.show_workload = False
+                        st.session_state.show_analytics = False
+                        st.session_state.show_template_manager = False
+                        st.session_state.clone_source = None
+                        st.rerun()
+
+                    # Portfolio export - one workbook with a MAP sheet per plan
+                    if user_use_cases and XLSX_AVAILABLE:
+                        with st.expander("📦 Portfolio Export", expanded=False):
+                            customers = sorted({uc['customer'] for uc in user_use_cases.values()})
+                            portfolio = st.selectbox("Customer", ["All customers"] + customers,
+                                                     key="portfolio_customer")
+                            plans = [uc for uc in user_use_cases.values()
+                                     if portfolio == "All customers" or uc['customer'] == portfolio]
+                            portfolio_stamp = (portfolio, tuple((uc['use_case_id'], uc.get('updated_at')) for uc in plans))
+
+                            if st.button("Build Workbook", key="portfolio_export_btn", use_container_width=True):
+                                export_path = export_portfolio_xlsx(plans, portfolio, EXPORTS_DIR)
+                                st.session_state.portfolio_export = {'stamp': portfolio_stamp, 'path': str(export_path)}
+
+                            prepared = st.session_state.get('portfolio_export')
+                            if prepared and prepared['stamp'] == portfolio_stamp and Path(prepared['path']).exists():
+                                with open(prepared['path'], 'rb') as f:
+                                    st.download_button(
+                                        label=f"📥 Download ({len(plans)} plans)",
+                                        data=f,
+                                        file_name=f"{portfolio.replace(' ', '_')}_MAP.xlsx",
+                                        mime=XLSX_MIME,
+                                        key="portfolio_download_btn",
+                                        use_container_width=True
+                                    )
+
                     # Database Maps Section
                     if Config.validate():
                         st.markdown("---")
@@ -871,11 +1252,14 @@ def render_sidebar():
 
                         # Existing Maps section
                         with st.expander("🗺️ Existing Maps", expanded=False):
-                            maps = load_maps_from_database()
+                            show_archived = st.toggle("Show archived", key="show_archived_maps",
+                                                      help="Include closed plans moved to the archive")
+                            maps = load_maps_from_database(include_archived=show_archived)
                             if maps:
                                 # Separate maps by source
                                 app_created = [m for m in maps if m['source'] == 'use_case_maps']
                                 original_maps = [m for m in maps if m['source'] == 'maps']
+                                archived_maps = [m for m in maps if m['source'] == 'use_case_maps_archive']
 
                                 # Show app-created use cases first
                                 if app_created:
@@ -887,9 +1271,34 @@ def render_sidebar():
                                             st.caption(f"{map_data.get('customer', 'N/A')} • {map_data['activity_count']} activities")
                                         with col2:
                                             if st.button("Use", key=f"use_map_{map_data['id']}", use_container_width=True):
-                                                st.session_state.create_from_map = map_data['id']
-                                                st.session_state.create_from_db_template = False
-                                                st.session_state.show_new_use_case_form = True
+                                                st.session_state.clone_source = map_data
+                                                st.session_state.create_from_map = None
+                                                st.session_state.show_new_use_case_form = False
+                                                st.session_state.show_template_manager = False
+                                                st.session_state.show_analytics = False
+                                                st.session_state.show_portfolio_timeline = False
+                                                st.session_state.show_workload = False
+                                                st.session_state.editing_use_case = None
+                                                st.rerun()
+
+                                # Show archived use cases (cloning only)
+                                if archived_maps:
+                                    st.markdown("---")
+                                    st.markdown("**🗃️ Archived Use Cases**")
+                                    for map_data in archived_maps[:10]:
+                                        col1, col2 = st.columns([3, 1])
+                                        with col1:
+                                            st.write(f"**{map_data['id']}**")
+                                            st.caption(f"{map_data.get('customer', 'N/A')} • {map_data['activity_count']} activities • archived")
+                                        with col2:
+                                            if st.button("Use", key=f"use_archived_{map_data['id']}", use_container_width=True):
+                                                st.session_state.clone_source = map_data
+                                                st.session_state.create_from_map = None
+                                                st.session_state.show_new_use_case_form = False
+                                                st.session_state.show_template_manager = False
+                                                st.session_state.show_analytics = False
+                                                st.session_state.show_portfolio_timeline = False
+                                                st.session_state.show_workload = False
                                                 st.session_state.editing_use_case = None
                                                 st.rerun()
 
@@ -904,16 +1313,121 @@ def render_sidebar():
                                             st.caption(f"{map_data['activity_count']} activities")
                                         with col2:
                                             if st.button("Use", key=f"use_map_{map_data['id']}", use_container_width=True):
-                                                st.session_state.create_from_map = map_data['id']
-                                                st.session_state.create_from_db_template = False
-                                                st.session_state.show_new_use_case_form = True
+                                                st.session_state.clone_source = map_data
+                                                st.session_state.create_from_map = None
+                                                st.session_state.show_new_use_case_form = False
+                                                st.session_state.show_template_manager = False
+                                                st.session_state.show_analytics = False
+                                                st.session_state.show_portfolio_timeline = False
+                                                st.session_state.show_workload = False
                                                 st.session_state.editing_use_case = None
                                                 st.rerun()
                             else:
                                 st.info("No maps found in database")
+
+                        if st.button("🧩 Manage MAP Template", key="template_manager_btn", use_container_width=True):
+                            st.session_state.show_template_manager = True
+                            st.session_state.show_analytics = False
+                            st.session_state.show_portfolio_timeline = False
+                            st.session_state.show_workload = False
+                            st.session_state.clone_source = None
+                            st.rerun()
+
+                        if st.button("📊 Portfolio Analytics", key="analytics_btn", use_container_width=True):
+                            st.session_state.show_analytics = True
+                            st.session_state.show_portfolio_timeline = False
+                            st.session_state.show_workload = False
+                            st.session_state.show_template_manager = False
+                            st.session_state.clone_source = None
+                            st.rerun()
+
+                        # Bulk import of filled-in MAP workbooks
+                        if OPENPYXL_AVAILABLE:
+                            with st.expander("📥 Import MAP Workbooks", expanded=False):
+                                uploads = st.file_uploader("MAP workbooks (.xlsx)", type=["xlsx"],
+                                                           accept_multiple_files=True, key="map_uploads")
+                                import_customer = st.text_input("Customer (if not in workbook)", key="import_customer")
+                                if uploads and st.button("Import", key="import_maps_btn", use_container_width=True):
+                                    with st.spinner(f"Importing {len(uploads)} workbooks..."):
+                                        st.session_state.import_result = import_uploaded_workbooks(
+                                            uploads, import_customer, st.session_state.current_user
+                                        )
+
+                                import_result = st.session_state.get('import_result')
+                                if import_result:
+                                    report, summary = import_result
+                                    st.caption(f"{summary['imported']} imported • {summary['skipped']} skipped • "
+                                               f"{summary['failed']} failed • {summary['rows']} rows in "
+                                               f"{summary['seconds']}s ({summary['rows_per_second']} rows/s)")
+                                    st.dataframe(
+                                        pd.DataFrame(report).drop(columns=['error_details']),
+                                        use_container_width=True,
+                                        hide_index=True
+                                    )
+                                    for entry in report:
+                                        for error in entry['error_details']:
+                                            st.error(f"{entry['file']}: {error}")
         else:
             st.info("Add a user to start")
 
+def build_stages_from_template(template, ssa_required, poc_happening, solution_architect, account_executive,
+                               customer=None):
+    """Build the form's stages from a template, honouring SSA/POC requirements
+
+    Durations are prefilled from the historical statistics of each outcome.
+    """
+    stats = get_duration_stats()
+    stages_data = []
+    for stage_code, stage_template in template.items():
+        stage_activities = []
+
+        for activity in stage_template['activities']:
+            # Check if activity should be included based on conditional requirements
+            conditional = activity.get('conditional', None)
+
+            should_include = True
+            if conditional == 'ssa' and not ssa_required:
+                should_include = False
+            elif conditional == 'poc' and not poc_happening:
+                should_include = False
+
+            if should_include:
+                # Auto-populate SA and AE names
+                owner = activity.get('owner', '')
+                if 'SA' in owner and solution_architect:
+                    owner = owner.replace('SA', solution_architect)
+                if 'AE' in owner and account_executive:
+                    owner = owner.replace('AE', account_executive)
+
+                stage_activities.append({
+                    'activity': activity['outcome'],
+                    'description': activity['questions'],
+                    'owner': owner,
+                    **estimate_activity(stats, stage_code, activity['outcome'], customer),
+                    'status': 'Not Started'
+                })
+
+        stages_data.append({
+            'stage_name': f"{stage_code} - {stage_template['name']}",
+            'activities': stage_activities
+        })
+    return stages_data
+
+def get_stage_drafts(inputs=None):
+    """Get the stage edits kept for the form currently open
+
+    Drafts are keyed by stage index and reset whenever a different
+    use case (or a new one) is opened in the form, or when the inputs the
+    stages were built from (template version, requirements, team,
+    customer) change.
+    """
+    form_key = (st.session_state.editing_use_case or 'new', inputs)
+    drafts = st.session_state.get('stage_drafts')
+    if not drafts or drafts['form_key'] != form_key:
+        drafts = {'form_key': form_key, 'stages': {}}
+        st.session_state.stage_drafts = drafts
+    return drafts['stages']
+
 def render_use_case_form():
     """Render the use case creation/editing form with proper template structure"""
     st.markdown("## 📝 Use Case Configuration")
@@ -952,6 +1466,9 @@ def render_use_case_form():
 
     st.markdown('</div>', unsafe_allow_html=True)
 
+    if not use_case and not st.session_state.create_from_map and Config.validate():
+        render_similar_plans(name)
+
     st.markdown("---")
 
     # Conditional Questions Section
@@ -981,12 +1498,14 @@ def render_use_case_form():
     st.markdown("Based on Databricks Consolidated MAP Template")
 
     # Initialize stages from template
+    stage_inputs = None
     if use_case and 'stages' in use_case:
         stages_data = use_case['stages']
     elif st.session_state.create_from_map:
         # Load from existing database map
         st.info(f"📋 Loading from Map #{st.session_state.create_from_map}")
         map_activities = load_map_details(st.session_state.create_from_map)
+        stats = get_duration_stats()
 
         # Group activities by stage
         stages_dict = {}
@@ -1002,11 +1521,17 @@ def render_use_case_form():
             if 'AE' in owner and account_executive:
                 owner = owner.replace('AE', account_executive)
 
+            # Keep the map's own duration when it has one, else estimate it
+            if activity['start_date'] and activity['end_date'] and activity['end_date'] > activity['start_date']:
+                duration = {'duration_days': (activity['end_date'] - activity['start_date']).days}
+            else:
+                duration = estimate_activity(stats, stage, activity['outcome'], customer)
+
             stages_dict[stage].append({
                 'activity': activity['outcome'],
                 'description': activity['questions'],
                 'owner': owner,
-                'duration_days': 5,
+                **duration,
                 'status': 'Not Started'
             })
 
@@ -1021,144 +1546,73 @@ def render_use_case_form():
         # Clear the flag after loading
         if stages_data:
             st.session_state.create_from_map = None
-    elif st.session_state.create_from_db_template:
-        # Load from database template
-        st.info("📋 Loading from Database Template")
-        db_template = load_template_from_database()
-
-        if db_template:
-            stages_data = []
-            for stage_code in ['U2', 'U3', 'U4', 'U5']:
-                if stage_code in db_template:
-                    stage_activities = []
-                    for activity in db_template[stage_code]:
-                        # Check conditional requirements
-                        should_include = True
-                        if 'SSA' in activity['outcome'] and not ssa_required:
-                            should_include = False
-                        elif 'POC' in activity['outcome'] and not poc_happening:
-                            should_include = False
-
-                        if should_include:
-                            # Auto-populate SA and AE names
-                            owner = activity['owner']
-                            if 'SA' in owner and solution_architect:
-                                owner = owner.replace('SA', solution_architect)
-                            if 'AE' in owner and account_executive:
-                                owner = owner.replace('AE', account_executive)
-
-                            stage_activities.append({
-                                'activity': activity['outcome'],
-                                'description': activity['questions'],
-                                'owner': owner,
-                                'duration_days': 5,
-                                'status': 'Not Started'
-                            })
-
-                    if stage_activities:
-                        stages_data.append({
-                            'stage_name': f"{stage_code}",
-                            'activities': stage_activities
-                        })
-
-            # Clear the flag after loading
-            if stages_data:
-                st.session_state.create_from_db_template = False
-        else:
-            st.warning("Could not load database template, using default template")
-            stages_data = []
-            for stage_code in ['U2', 'U3', 'U4', 'U5']:
-                stage_template = CONSOLIDATED_MAP_TEMPLATE[stage_code]
-                stage_activities = []
-                for activity in stage_template['activities']:
-                    conditional = activity.get('conditional', None)
-                    should_include = True
-                    if conditional == 'ssa' and not ssa_required:
-                        should_include = False
-                    elif conditional == 'poc' and not poc_happening:
-                        should_include = False
-                    if should_include:
-                        stage_activities.append({
-                            'activity': activity['outcome'],
-                            'description': activity['questions'],
-                            'owner': activity.get('owner', ''),
-                            'duration_days': 5,
-                            'status': 'Not Started'
-                        })
-                stages_data.append({
-                    'stage_name': f"{stage_code} - {stage_template['name']}",
-                    'activities': stage_activities
-                })
     else:
-        # Load from consolidated MAP template (default)
-        stages_data = []
-        for stage_code in ['U2', 'U3', 'U4', 'U5']:
-            stage_template = CONSOLIDATED_MAP_TEMPLATE[stage_code]
-            stage_activities = []
-
-            for activity in stage_template['activities']:
-                # Check if activity should be included based on conditional requirements
-                conditional = activity.get('conditional', None)
-
-                should_include = True
-                if conditional == 'ssa' and not ssa_required:
-                    should_include = False
-                elif conditional == 'poc' and not poc_happening:
-                    should_include = False
-
-                if should_include:
-                    # Auto-populate SA and AE names
-                    owner = activity.get('owner', '')
-                    if 'SA' in owner and solution_architect:
-                        owner = owner.replace('SA', solution_architect)
-                    if 'AE' in owner and account_executive:
-                        owner = owner.replace('AE', account_executive)
-
-                    stage_activities.append({
-                        'activity': activity['outcome'],
-                        'description': activity['questions'],
-                        'owner': owner,
-                        'duration_days': 5,
-                        'status': 'Not Started'
-                    })
-
-            stages_data.append({
-                'stage_name': f"{stage_code} - {stage_template['name']}",
-                'activities': stage_activities
-            })
+        # Load from the template store (cached, revalidated by version/checksum)
+        template_version, template = get_template()
+        if st.session_state.create_from_db_template:
+            st.info(f"📋 Loading from MAP Template v{template_version or 'built-in'}")
+            st.session_state.create_from_db_template = False
+
+        template_drift = check_template_drift()
+        if template_drift:
+            st.warning(f"⚠️ Template drift: {template_drift}")
+
+        stages_data = build_stages_from_template(
+            template, ssa_required, poc_happening, solution_architect, account_executive, customer
+        )
+        stage_inputs = (template_version, ssa_required, poc_happening, solution_architect, account_executive,
+                        customer)
 
-    # Display stages
+    # Display stages - activity editors are only materialized for opened stages,
+    # the others pass their (possibly previously edited) activities through untouched
+    drafts = get_stage_drafts(stage_inputs)
     updated_stages = []
     for idx, stage in enumerate(stages_data):
+        stage = drafts.get(idx, stage)
         with st.expander(f"**{stage['stage_name']}**", expanded=(idx == 0)):
 
             # Stage name editing
             stage_name = st.text_input("Stage Name", value=stage['stage_name'], key=f"stage_{idx}")
 
-            # Activities table
-            activities_df = pd.DataFrame(stage['activities'])
-
-            edited_activities = st.data_editor(
-                activities_df,
-                use_container_width=True,
-                num_rows="dynamic",
-                column_config={
-                    "activity": st.column_config.TextColumn("Activity", width=200),
-                    "description": st.column_config.TextColumn("Description", width=300),
-                    "owner": st.column_config.TextColumn("Owner", width=150),
-                    "duration_days": st.column_config.NumberColumn("Days", width=80, min_value=1),
-                    "status": st.column_config.SelectboxColumn(
-                        "Status",
-                        options=["Not Started", "In Progress", "Completed", "Blocked"],
-                        width=120
-                    )
-                },
-                key=f"activities_{idx}"
+            edit_activities = st.toggle(
+                "✏️ Edit activities",
+                value=(idx == 0),
+                key=f"stage_open_{idx}"
             )
 
+            if edit_activities:
+                # Activities table
+                activities_df = pd.DataFrame(stage['activities'])
+
+                edited_activities = st.data_editor(
+                    activities_df,
+                    use_container_width=True,
+                    num_rows="dynamic",
+                    column_config={
+                        "activity": st.column_config.TextColumn("Activity", width=200),
+                        "description": st.column_config.TextColumn("Description", width=300),
+                        "owner": st.column_config.TextColumn("Owner", width=150),
+                        "duration_days": st.column_config.NumberColumn("Days", width=80, min_value=1),
+                        "status": st.column_config.SelectboxColumn(
+                            "Status",
+                            options=["Not Started", "In Progress", "Completed", "Blocked"],
+                            width=120
+                        )
+                    },
+                    key=f"activities_{idx}"
+                )
+                activities = edited_activities.to_dict('records')
+                # Keep actual edits once the editor is closed again; an untouched
+                # stage keeps following the form's inputs
+                if stage_name != stage['stage_name'] or not edited_activities.equals(activities_df):
+                    drafts[idx] = {'stage_name': stage_name, 'activities': activities}
+            else:
+                activities = stage['activities']
+                st.caption(f"{len(activities)} activities")
+
             updated_stages.append({
                 'stage_name': stage_name,
-                'activities': edited_activities.to_dict('records')
+                'activities': activities
             })
 
     # Add new stage button
@@ -1197,24 +1651,29 @@ def render_use_case_form():
                     'created_at': use_case['created_at'] if use_case else datetime.now().isoformat(),
                     'updated_at': datetime.now().isoformat()
                 }
+                # Document storage rejects the save if the plan changed since this copy
+                if use_case and use_case.get(VERSION_KEY) is not None:
+                    use_case_data[VERSION_KEY] = use_case[VERSION_KEY]
 
+                before = st.session_state.use_cases.get(use_case_data['use_case_id'])
                 if st.session_state.editing_use_case:
                     st.session_state.use_cases[st.session_state.editing_use_case] = use_case_data
                 else:
                     st.session_state.use_cases[use_case_data['use_case_id']] = use_case_data
 
                 save_use_cases(st.session_state.use_cases)
+                record_change(before, use_case_data, st.session_state.current_user, 'form')
 
-                # Save to Lakebase database
-                success, message = save_use_case_to_lakebase(use_case_data, st.session_state.current_user)
+                # Queue the Lakebase save; the outbox worker syncs it in the background
+                success, message = queue_use_case_save(use_case_data, st.session_state.current_user)
                 if success:
-                    st.success(f"✅ {message}")
-                    st.success(f"💾 Saved locally: {use_case_data['use_case_id']}")
+                    st.success(f"💾 {message}: {use_case_data['use_case_id']}")
                 else:
-                    st.warning(f"⚠️ Saved locally but database save failed: {message}")
+                    st.warning(f"⚠️ Saved locally but not queued for database sync: {message}")
 
                 st.session_state.show_new_use_case_form = False
                 st.session_state.editing_use_case = use_case_data['use_case_id']
+                st.session_state.pop('stage_drafts', None)
                 st.rerun()
             else:
                 st.error("Please fill in all required fields")
@@ -1223,7 +1682,336 @@ def render_use_case_form():
         if st.button("Cancel"):
             st.session_state.show_new_use_case_form = False
             st.session_state.editing_use_case = None
+            st.session_state.pop('stage_drafts', None)
+            st.rerun()
+
+def render_similar_plans(name):
+    """Suggest past plans similar to the new use case as starting points"""
+    with st.expander("🔎 Similar Past Plans", expanded=bool(name)):
+        description = st.text_input("Describe the workload", key="similar_plans_text",
+                                    placeholder="e.g. streaming ingestion, churn model, warehouse migration")
+        text = f"{name} {description}".strip()
+        if not text:
+            st.caption("Enter a use case name or description to find similar plans")
+            return
+
+        results = similar_maps(text)
+        if not results:
+            st.info("No similar plans found")
+            return
+
+        for map_data, score in results:
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                label = map_data['id'] if map_data['source'] != 'maps' else f"Map #{map_data['id']}"
+                st.write(f"**{label}** {map_data.get('name') or ''}")
+                st.caption(f"{map_data.get('customer') or 'Template map'} • "
+                           f"{map_data['activity_count']} activities • {score:.0%} similar")
+            with col2:
+                if st.button("Use", key=f"similar_{map_data['source']}_{map_data['id']}", use_container_width=True):
+                    st.session_state.clone_source = map_data
+                    st.session_state.create_from_map = None
+                    st.session_state.show_new_use_case_form = False
+                    st.session_state.pop('stage_drafts', None)
+                    st.rerun()
+
+def render_clone_form():
+    """Render the form for cloning an existing database map into a new use case"""
+    map_data = st.session_state.clone_source
+    label = map_data['id'] if map_data['source'] != 'maps' else f"Map #{map_data['id']}"
+    st.markdown(f"## 📋 New Use Case from {label}")
+    st.caption(f"{map_data['activity_count']} activities are copied inside the database; "
+               "owners are filled in and dates shifted to the new start date")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        name = st.text_input("Use Case Name", value=map_data.get('name') or "", key="clone_name")
+        customer = st.text_input("Customer/Organization", value=map_data.get('customer') or "", key="clone_customer")
+    with col2:
+        solution_architect = st.text_input("Solution Architect", key="clone_sa")
+        account_executive = st.text_input("Account Executive", key="clone_ae")
+    with col3:
+        start_date = st.date_input("Start Date", value=datetime.now(), key="clone_start")
+        duration_months = st.number_input("Duration (Months)", min_value=1, max_value=24, value=6, key="clone_months")
+
+    col1, col2, col3 = st.columns([1, 1, 3])
+    with col1:
+        if st.button("⚡ Clone Map", type="primary"):
+            if name and customer and solution_architect and account_executive:
+                with st.spinner("Cloning map..."):
+                    success, result = clone_map_to_lakebase(map_data, {
+                        'name': name,
+                        'customer': customer,
+                        'solution_architect': solution_architect,
+                        'account_executive': account_executive,
+                        'start_date': start_date,
+                        'duration_months': duration_months
+                    }, st.session_state.current_user)
+
+                if success:
+                    st.session_state.use_cases[result['use_case_id']] = result
+                    save_use_cases(st.session_state.use_cases)
+                    record_change(None, result, st.session_state.current_user, 'clone')
+                    st.session_state.clone_source = None
+                    st.session_state.editing_use_case = result['use_case_id']
+                    st.rerun()
+                else:
+                    st.error(f"Clone failed: {result}")
+            else:
+                st.error("Please fill in all required fields")
+
+    with col2:
+        # Template maps can still be opened in the full form to adjust activities before saving
+        if map_data['source'] == 'maps' and st.button("✏️ Customize First"):
+            st.session_state.create_from_map = map_data['id']
+            st.session_state.create_from_db_template = False
+            st.session_state.show_new_use_case_form = True
+            st.session_state.clone_source = None
+            st.rerun()
+
+    with col3:
+        if st.button("Cancel", key="clone_cancel"):
+            st.session_state.clone_source = None
+            st.rerun()
+
+def build_view_frame(rows, page_start, page_end, visible_columns):
+    """Build the DataFrame for one page of the Excel-like view
+
+    Only visible columns are included; Stage, Status and Owner use categorical
+    dtypes with categories taken from the whole plan so every page offers the
+    same choices.
+    """
+    df = pd.DataFrame(rows[page_start:page_end], columns=visible_columns)
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.Categorical(df[column], categories=view_categories(rows, column))
+    return df
+
+def view_categories(rows, column):
+    """Categories for a categorical view column"""
+    if column == 'Status':
+        values = list(STATUS_OPTIONS)
+        values += [row['Status'] for row in rows if row['Status'] not in STATUS_OPTIONS]
+    else:
+        values = [row[column] for row in rows]
+    return list(dict.fromkeys(values))
+
+def view_column_config(rows, visible_columns):
+    """Column configuration for the visible columns of the Excel-like view"""
+    column_config = {
+        "ID": st.column_config.TextColumn("ID", width=60, disabled=True),
+        "Stage": st.column_config.SelectboxColumn(
+            "Stage",
+            options=view_categories(rows, 'Stage'),
+            width=200,
+            disabled=True
+        ),
+        "Activity": st.column_config.TextColumn("Activity", width=180),
+        "Description": st.column_config.TextColumn("Description", width=250),
+        "Owner": st.column_config.SelectboxColumn(
+            "Owner",
+            options=view_categories(rows, 'Owner'),
+            width=120
+        ),
+        "Start Date": st.column_config.TextColumn("Start Date", width=100),
+        "End Date": st.column_config.TextColumn("End Date", width=100),
+        "Duration (Days)": st.column_config.NumberColumn("Days", width=60),
+        "Status": st.column_config.SelectboxColumn(
+            "Status",
+            options=view_categories(rows, 'Status'),
+            width=110
+        ),
+        "Dependencies": st.column_config.TextColumn("Dependencies", width=120),
+        "Deliverables": st.column_config.TextColumn("Deliverables", width=150),
+        "Notes": st.column_config.TextColumn("Notes", width=200)
+    }
+    return {column: column_config[column] for column in visible_columns}
+
+def persist_view_edits(editor_key, page_start):
+    """Save the cell edits of the Excel-like view (data editor on_change callback)"""
+    editor_state = st.session_state.get(editor_key) or {}
+    use_case = st.session_state.use_cases[st.session_state.editing_use_case]
+    before = copy.deepcopy(use_case)
+
+    changes, start_shift_days = apply_view_edits(
+        use_case, editor_state.get('edited_rows', {}), page_start
+    )
+    if not changes and not start_shift_days:
+        return
+
+    use_case['updated_at'] = datetime.now().isoformat()
+    save_use_cases(st.session_state.use_cases)
+    record_change(before, use_case, st.session_state.current_user, 'view')
+
+    success, message = queue_use_case_update(
+        use_case, changes, start_shift_days, st.session_state.current_user
+    )
+    st.session_state.view_edit_status = (success, message)
+
+def persist_estimate_edits(editor_key):
+    """Save edited duration estimates of the schedule risk table (data editor on_change callback)"""
+    editor_state = st.session_state.get(editor_key) or {}
+    use_case = st.session_state.use_cases[st.session_state.editing_use_case]
+    before = copy.deepcopy(use_case)
+    activities = [activity for stage in use_case['stages'] for activity in stage['activities']]
+
+    changed = False
+    for row_key, cells in editor_state.get('edited_rows', {}).items():
+        row_idx = int(row_key)
+        if row_idx >= len(activities):
+            continue
+        activity = activities[row_idx]
+        distribution, optimistic, pessimistic = activity_estimate(activity)
+        estimate = {'distribution': distribution, 'optimistic_days': optimistic, 'pessimistic_days': pessimistic}
+        for column, field in (("Distribution", 'distribution'), ("Optimistic", 'optimistic_days'),
+                              ("Pessimistic", 'pessimistic_days')):
+            if column in cells and cells[column] is not None:
+                estimate[field] = cells[column]
+        if activity.get('estimate') != estimate:
+            activity['estimate'] = estimate
+            changed = True
+
+    if changed:
+        use_case['updated_at'] = datetime.now().isoformat()
+        save_use_cases(st.session_state.use_cases)
+        record_change(before, use_case, st.session_state.current_user, 'estimates')
+
+def render_change_history(use_case):
+    """Render the logged field changes of a plan and the plan as it was at a chosen time"""
+    try:
+        flush_changes()
+        history = change_history(use_case['use_case_id'])
+    except Exception as e:
+        st.warning(f"Change history unavailable: {e}")
+        return
+
+    if not history:
+        st.info("No changes logged for this plan yet")
+        return
+
+    history_df = pd.DataFrame(history).astype({'old_value': str, 'new_value': str})
+    st.dataframe(history_df, use_container_width=True, hide_index=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        as_of_date = st.date_input("Plan as of", value=datetime.now().date(), key="history_as_of_date")
+    with col2:
+        as_of_time = st.time_input("Time", value=datetime.now().time().replace(microsecond=0), key="history_as_of_time")
+
+    past = reconstruct_use_case(use_case['use_case_id'], datetime.combine(as_of_date, as_of_time))
+    if past is None:
+        st.caption("The plan did not exist at that time")
+        return
+    st.caption(f"{past.get('name')} • start {past.get('start_date')} • "
+               f"{sum(len(stage['activities']) for stage in past.get('stages', []))} activities")
+    st.dataframe(pd.DataFrame(build_plan_rows(past)), use_container_width=True, hide_index=True)
+
+def render_schedule_risk(use_case):
+    """Render the Monte Carlo go-live risk panel for a plan"""
+    activities = [activity for stage in use_case['stages'] for activity in stage['activities']]
+    if not activities:
+        st.info("No activities to simulate")
+        return
+
+    trials = st.selectbox("Trials", [1000, DEFAULT_TRIALS, 50000], index=1, key="risk_trials")
+    result = simulate_schedule(use_case, trials)
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Planned finish", result['planned_finish'].isoformat(),
+                f"{result['on_time_probability']:.0%} on time", delta_color="off")
+    col2.metric("P50", result['p50'].isoformat())
+    col3.metric("P80", result['p80'].isoformat())
+    col4.metric("P95", result['p95'].isoformat())
+
+    finish_dates = pd.to_datetime(use_case['start_date']) + pd.to_timedelta(result['finish_offsets'], unit='D')
+    fig = px.histogram(x=finish_dates, nbins=50, labels={'x': 'Finish date'})
+    fig.add_vline(x=pd.Timestamp(result['planned_finish']).timestamp() * 1000, line_dash="dash",
+                  annotation_text="Planned")
+    fig.update_layout(height=280, margin={'l': 10, 'r': 10, 't': 30, 'b': 10}, yaxis_title="Trials")
+    st.plotly_chart(fig, use_container_width=True)
+
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        st.markdown("##### Duration Estimates")
+        estimates = pd.DataFrame([
+            dict(zip(["Activity", "Days", "Distribution", "Optimistic", "Pessimistic"],
+                     (activity['activity'], activity.get('duration_days', 5)) + activity_estimate(activity)))
+            for activity in activities
+        ])
+        st.data_editor(
+            estimates,
+            use_container_width=True,
+            hide_index=True,
+            height=min(400, 38 + 35 * len(estimates)),
+            disabled=["Activity", "Days"],
+            column_config={
+                "Distribution": st.column_config.SelectboxColumn("Distribution", options=DISTRIBUTIONS),
+                "Optimistic": st.column_config.NumberColumn("Optimistic", min_value=1, step=1),
+                "Pessimistic": st.column_config.NumberColumn("Pessimistic", min_value=1, step=1)
+            },
+            key="risk_estimates",
+            on_change=persist_estimate_edits,
+            args=("risk_estimates",)
+        )
+    with col2:
+        st.markdown("##### Most Frequent Delay Drivers")
+        drivers = pd.DataFrame(result['drivers'][:10])
+        if drivers.empty:
+            st.success("No trial finished late")
+        else:
+            drivers['driver_share'] = (drivers['driver_share'] * 100).round(1)
+            st.dataframe(drivers.rename(columns={'driver_share': '% of trials'}),
+                         use_container_width=True, hide_index=True)
+
+def render_sync_status(use_case_id):
+    """Caption with the database sync state of a use case, and a retry button after failures
+
+    A version conflict instead offers reloading the stored plan or
+    overwriting it with the local one.
+    """
+    status = use_case_sync_statuses().get(use_case_id, {'state': 'local'})
+    icon, label = SYNC_LABELS[status['state']]
+    if status['state'] == 'synced':
+        st.caption(f"{icon} {label} {status['synced_at']:%Y-%m-%d %H:%M:%S}")
+    elif status['state'] == 'pending':
+        st.caption(f"{icon} {label} ({status['pending']} queued)")
+    elif status['state'] in ('retrying', 'failed'):
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            if status['state'] == 'retrying':
+                st.caption(f"{icon} {label} (attempt {status['attempts']}, next at "
+                           f"{status['next_attempt_at']:%H:%M:%S}): {status['last_error']}")
+            else:
+                st.caption(f"{icon} {label} after {status['attempts']} attempts: {status['last_error']}")
+        with col2:
+            if st.button("Retry now", key=f"retry_sync_{use_case_id}"):
+                get_outbox().retry_now(use_case_id)
+                st.rerun()
+    elif status['state'] == 'conflict':
+        st.warning(f"{icon} {label} since you loaded it: reload their version (your unsynced "
+                   f"changes are dropped) or overwrite it with yours")
+        col1, col2, _ = st.columns([1, 1, 3])
+        with col1:
+            reload_clicked = st.button("Reload from database", key=f"reload_conflict_{use_case_id}")
+        with col2:
+            overwrite_clicked = st.button("Overwrite with mine", key=f"overwrite_conflict_{use_case_id}")
+        if reload_clicked or overwrite_clicked:
+            lakebase.connect()
+            stored = load_use_case_document(use_case_id)
+            lakebase.close()
+            if stored is None:
+                st.error(f"{use_case_id} is no longer in the database")
+                return
+            if reload_clicked:
+                st.session_state.use_cases[use_case_id] = stored
+                save_use_cases(st.session_state.use_cases)
+            else:
+                st.session_state.use_cases[use_case_id][VERSION_KEY] = stored[VERSION_KEY]
+                save_use_cases(st.session_state.use_cases)
+            get_outbox().resolve_conflict(use_case_id, stored[VERSION_KEY], overwrite=overwrite_clicked)
             st.rerun()
+    else:
+        st.caption(f"{icon} {label}")
 
 def render_use_case_view():
     """Render the Excel-like view of a use case with proper column structure"""
@@ -1231,6 +2019,7 @@ def render_use_case_view():
 
     st.markdown(f"## 📊 {use_case['name']}")
     st.markdown(f"**Use Case ID:** {use_case['use_case_id']}")
+    render_sync_status(use_case['use_case_id'])
 
     # Display key metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -1249,83 +2038,59 @@ def render_use_case_view():
     st.markdown("### 📋 Implementation Plan")
     st.markdown("*Excel-like view based on Consolidated MAP Template*")
 
-    # Prepare data for DataFrame with proper columns
-    data = []
-
-    for stage_idx, stage in enumerate(use_case['stages']):
-        stage_name = stage['stage_name']
+    # Compute the schedule once, then only ship the current page to the browser
+    rows = build_plan_rows(use_case)
 
-        # Extract stage code from stage name
-        # Look for patterns like "U2 -", "U3 -", "Stage 1:", etc.
-        import re
-        # First try to match U2-U6 format
-        u_stage_match = re.search(r'(U[2-6])', stage_name)
-        if u_stage_match:
-            stage_code = u_stage_match.group(1)
-        else:
-            # Try to match "Stage N" format
-            stage_match = re.search(r'Stage\s+(\d+)', stage_name)
-            if stage_match:
-                stage_num = int(stage_match.group(1))
-                stage_code = f"U{stage_num + 1}"  # Stage 1 -> U2, Stage 2 -> U3, etc.
-            else:
-                # Fallback: use index-based mapping
-                stage_code = f"U{stage_idx + 2}" if stage_idx < 5 else "U6"
-
-        for activity in stage['activities']:
-            # Calculate dates based on duration
-            if data:
-                prev_end = datetime.fromisoformat(data[-1]['End Date'])
-                start = prev_end + timedelta(days=1)
-            else:
-                start = datetime.fromisoformat(use_case['start_date'])
-
-            end = start + timedelta(days=activity.get('duration_days', 5))
-
-            data.append({
-                'ID': stage_code,
-                'Stage': stage_name,
-                'Activity': activity['activity'],
-                'Description': activity['description'],
-                'Owner': activity.get('owner', ''),
-                'Start Date': start.strftime('%Y-%m-%d'),
-                'End Date': end.strftime('%Y-%m-%d'),
-                'Duration (Days)': activity.get('duration_days', 5),
-                'Status': activity.get('status', 'Not Started'),
-                'Dependencies': '',
-                'Deliverables': '',
-                'Notes': ''
-            })
+    col1, col2, col3 = st.columns([4, 1, 1])
+    with col1:
+        visible_columns = st.multiselect(
+            "Columns",
+            USE_CASE_COLUMNS,
+            default=DEFAULT_VIEW_COLUMNS,
+            key="view_columns"
+        ) or DEFAULT_VIEW_COLUMNS
+    with col2:
+        page_size = st.selectbox("Rows per page", PLAN_PAGE_SIZES, index=1, key="view_page_size")
+    total_pages = max(1, -(-len(rows) // page_size))
+    if st.session_state.get('view_page', 1) > total_pages:
+        st.session_state.view_page = total_pages
+    with col3:
+        page = st.number_input("Page", min_value=1, max_value=total_pages, step=1, key="view_page")
 
-    # Create DataFrame
-    df = pd.DataFrame(data)
+    page_start, page_end = page_bounds(len(rows), page_size, page)
+    df = build_view_frame(rows, page_start, page_end, visible_columns)
+    st.caption(f"Showing activities {page_start + 1 if rows else 0}-{page_end} of {len(rows)}")
 
     # Display as editable table
-    edited_df = st.data_editor(
+    st.data_editor(
         df,
         use_container_width=True,
-        height=600,
-        column_config={
-            "ID": st.column_config.TextColumn("ID", width=60, disabled=True),
-            "Stage": st.column_config.TextColumn("Stage", width=200),
-            "Activity": st.column_config.TextColumn("Activity", width=180),
-            "Description": st.column_config.TextColumn("Description", width=250),
-            "Owner": st.column_config.TextColumn("Owner", width=120),
-            "Start Date": st.column_config.TextColumn("Start Date", width=100),
-            "End Date": st.column_config.TextColumn("End Date", width=100),
-            "Duration (Days)": st.column_config.NumberColumn("Days", width=60),
-            "Status": st.column_config.SelectboxColumn(
-                "Status",
-                options=["Not Started", "In Progress", "Completed", "Blocked", "On Hold"],
-                width=110
-            ),
-            "Dependencies": st.column_config.TextColumn("Dependencies", width=120),
-            "Deliverables": st.column_config.TextColumn("Deliverables", width=150),
-            "Notes": st.column_config.TextColumn("Notes", width=200)
-        },
-        key="use_case_table"
+        height=min(600, 38 + 35 * max(len(df), 1)),
+        column_config=view_column_config(rows, visible_columns),
+        key=f"use_case_table_{page}",
+        on_change=persist_view_edits,
+        args=(f"use_case_table_{page}", page_start)
     )
 
+    # Report the last edit sync
+    edit_status = st.session_state.pop('view_edit_status', None)
+    if edit_status:
+        success, message = edit_status
+        if success:
+            st.caption(f"💾 Changes saved • {message}")
+        else:
+            st.warning(f"⚠️ Changes saved locally but not queued for database sync: {message}")
+
+    # Timeline is only computed while it is switched on
+    if st.toggle("🗓️ Show timeline", key="view_timeline"):
+        render_gantt([use_case], portfolio=False, key_prefix="plan_gantt")
+
+    if st.toggle("🎲 Schedule risk", key="view_risk"):
+        render_schedule_risk(use_case)
+
+    if Config.validate() and st.toggle("🕒 Change history", key="view_history"):
+        render_change_history(use_case)
+
     # Action buttons
     st.markdown("---")
     col1, col2, col3, col4 = st.columns(4)
@@ -1336,14 +2101,25 @@ def render_use_case_view():
             st.rerun()
 
     with col2:
-        # Export to CSV
-        csv = edited_df.to_csv(index=False)
-        st.download_button(
-            label="📥 Export CSV",
-            data=csv,
-            file_name=f"{use_case['use_case_id']}_plan.csv",
-            mime="text/csv"
-        )
+        # Exports are only generated on request and reused while the plan is unchanged
+        export_format = st.selectbox("Export format", list(EXPORT_FORMATS), key="export_format",
+                                     label_visibility="collapsed")
+        export_spec = EXPORT_FORMATS[export_format]
+        export_stamp = (use_case['use_case_id'], use_case.get('updated_at'), export_format)
+        prepared = st.session_state.get('prepared_export')
+
+        if prepared and prepared['stamp'] == export_stamp and Path(prepared['path']).exists():
+            with open(prepared['path'], 'rb') as f:
+                st.download_button(
+                    label=f"📥 Download {export_format}",
+                    data=f,
+                    file_name=f"{use_case['use_case_id']}_plan.{export_spec['extension']}",
+                    mime=export_spec['mime']
+                )
+        elif st.button(f"📥 Export {export_format}"):
+            export_path = export_plan(use_case, export_format, EXPORTS_DIR)
+            st.session_state.prepared_export = {'stamp': export_stamp, 'path': str(export_path)}
+            st.rerun()
 
     with col3:
         if st.button("📊 Create New"):
@@ -1356,6 +2132,440 @@ def render_use_case_view():
             st.session_state.editing_use_case = None
             st.rerun()
 
+def render_gantt(use_cases, portfolio, key_prefix):
+    """Render a Gantt timeline with date window and level-of-detail controls"""
+    # Activities run back to back with a one day gap, so a plan spans sum(lag + duration + 1) days
+    starts = [datetime.fromisoformat(uc['start_date']).date() for uc in use_cases]
+    ends = [
+        start + timedelta(days=sum(activity.get('lag_days', 0) + activity.get('duration_days', 5) + 1
+                                   for stage in uc['stages'] for activity in stage['activities']))
+        for start, uc in zip(starts, use_cases)
+    ]
+    first_date = min(starts)
+    plan_end = max(max(ends), first_date + timedelta(days=1))
+
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        window = st.slider("Date window", min_value=first_date, max_value=plan_end,
+                           value=(first_date, plan_end), format="YYYY-MM-DD", key=f"{key_prefix}_window")
+    with col2:
+        level = st.selectbox("Detail", ["auto"] + LOD_LEVELS, key=f"{key_prefix}_level",
+                             format_func=lambda value: value.replace('_', ' ').title())
+    with col3:
+        max_bars = st.selectbox("Max bars", GANTT_MAX_BARS, index=1, key=f"{key_prefix}_max_bars")
+
+    fig, shown_level, bar_count = build_gantt(use_cases, portfolio, window, level, max_bars)
+    st.caption(f"{bar_count} bars at {shown_level.replace('_', ' ')} level")
+    st.plotly_chart(fig, use_container_width=True)
+
+def render_portfolio_timeline():
+    """Render the portfolio Gantt timeline over many use cases"""
+    st.markdown("## 🗓️ Portfolio Timeline")
+
+    col1, col2, col3 = st.columns([1, 3, 1])
+    with col1:
+        scope = st.radio("Use cases", ["Mine", "Everyone's"], horizontal=True, key="timeline_scope")
+    use_cases = [
+        uc for uc in st.session_state.use_cases.values()
+        if scope == "Everyone's" or uc.get('user_id') == st.session_state.current_user
+    ]
+    with col2:
+        customers = st.multiselect("Customers", sorted({uc['customer'] for uc in use_cases}),
+                                   key="timeline_customers")
+    with col3:
+        if st.button("🔙 Back"):
+            st.session_state.show_portfolio_timeline = False
+            st.rerun()
+
+    if customers:
+        use_cases = [uc for uc in use_cases if uc['customer'] in customers]
+    use_cases = [uc for uc in use_cases if uc.get('stages')]
+    if not use_cases:
+        st.info("No use cases to show")
+        return
+
+    render_gantt(use_cases, portfolio=True, key_prefix="portfolio_gantt")
+
+@st.cache_data(ttl=ANALYTICS_TTL_SECONDS, show_spinner=False)
+def load_lakebase_workload(weeks, exclude_ids):
+    """Owner/week workload of the database-only use cases, cached briefly"""
+    lakebase.connect()
+    try:
+        return lakebase_workload(list(weeks), exclude_ids)
+    finally:
+        lakebase.close()
+
+def get_local_workload():
+    """Local store workload, recomputed only for use cases saved since the last call"""
+    if 'local_workload' not in st.session_state:
+        st.session_state.local_workload = LocalWorkload()
+    st.session_state.local_workload.sync(st.session_state.use_cases)
+    return st.session_state.local_workload
+
+def render_workload_heatmap():
+    """Render concurrent activities per owner per week across all use cases"""
+    st.markdown("## 👥 Team Workload")
+    st.caption("Concurrent activities per owner per week, across the local store and the database")
+
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
+    with col1:
+        first_week = st.date_input("From week", value=week_start(datetime.now().date()), key="workload_from")
+    with col2:
+        week_count = st.number_input("Weeks", min_value=4, max_value=104, value=52, step=4, key="workload_weeks")
+    with col3:
+        top_owners = st.number_input("Busiest owners", min_value=5, max_value=500, value=40, step=5,
+                                     key="workload_top")
+    with col4:
+        if st.button("🔙 Back"):
+            st.session_state.show_workload = False
+            st.rerun()
+
+    weeks = week_range(first_week, int(week_count))
+    counts = dict(get_local_workload().window(weeks))
+
+    if Config.validate():
+        try:
+            database_counts = load_lakebase_workload(tuple(weeks), tuple(sorted(st.session_state.use_cases)))
+            for key, count in database_counts.items():
+                counts[key] = counts.get(key, 0) + count
+        except Exception as e:
+            st.warning(f"⚠️ Showing local use cases only, database workload failed: {e}")
+
+    owners, matrix = workload_matrix(counts, weeks, int(top_owners))
+    if not owners:
+        st.info("No activities in this window")
+        return
+
+    fig = go.Figure(go.Heatmap(
+        z=matrix,
+        x=[week.isoformat() for week in weeks],
+        y=owners,
+        colorscale="YlOrRd",
+        colorbar={'title': 'Activities'},
+        hovertemplate="%{y}<br>Week of %{x}<br>%{z} activities<extra></extra>"
+    ))
+    fig.update_layout(
+        height=min(max(300, 22 * len(owners) + 120), 1400),
+        margin={'l': 10, 'r': 10, 't': 10, 'b': 10},
+        yaxis={'autorange': 'reversed'}
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    with st.expander("⚖️ Level Workload", expanded=False):
+        render_levelling(owners)
+
+def render_levelling(busiest_owners):
+    """Propose and bulk-apply activity delays that bring owners under capacity"""
+    local_owners = sorted({
+        owner
+        for uc in st.session_state.use_cases.values()
+        for stage in uc.get('stages', []) for activity in stage['activities']
+        for owner in split_owners(activity.get('owner'))
+    } - {UNASSIGNED_OWNER})
+    st.caption("Delays non-critical activities of local plans, within each plan's slack before its "
+               "target end (start + duration), to keep owners under their weekly capacity")
+
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        team = st.multiselect("Owners", local_owners,
+                              default=[owner for owner in busiest_owners if owner in local_owners][:10],
+                              key="levelling_owners")
+    with col2:
+        capacity = st.number_input("Activities / week", min_value=1, max_value=20, value=DEFAULT_CAPACITY,
+                                   key="levelling_capacity")
+    with col3:
+        time_budget = st.number_input("Time budget (s)", min_value=0.5, max_value=30.0, value=2.0, step=0.5,
+                                      key="levelling_budget")
+
+    if st.button("🔍 Propose Changes", disabled=not team):
+        with st.spinner("Levelling..."):
+            st.session_state.levelling_result = level_resources(
+                st.session_state.use_cases.values(), team, int(capacity), time_budget=time_budget
+            )
+
+    result = st.session_state.get('levelling_result')
+    if not result:
+        return
+
+    proposals, summary = result
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Overloaded owner-weeks", summary['after'][0], summary['after'][0] - summary['before'][0],
+                delta_color="inverse")
+    col2.metric("Peak load / capacity", summary['after'][1], round(summary['after'][1] - summary['before'][1], 2),
+                delta_color="inverse")
+    col3.metric("Proposed changes", len(proposals))
+    st.caption(f"{summary['plans']} plans • {summary['activities']} activities • "
+               f"{summary['passes']} passes in {summary['seconds']}s")
+
+    if not proposals:
+        st.success("No changes needed")
+        return
+
+    # Each change also moves the rest of its plan by the same amount
+    review = pd.DataFrame(proposals).drop(columns=['position'])
+    review.insert(0, 'apply', True)
+    reviewed = st.data_editor(
+        review,
+        use_container_width=True,
+        hide_index=True,
+        disabled=[column for column in review.columns if column != 'apply'],
+        key="levelling_review"
+    )
+
+    if st.button("✅ Apply Selected", type="primary"):
+        accepted = [proposal for proposal, apply in zip(proposals, reviewed['apply']) if apply]
+        before = {proposal['use_case_id']: copy.deepcopy(st.session_state.use_cases[proposal['use_case_id']])
+                  for proposal in accepted if proposal['use_case_id'] in st.session_state.use_cases}
+        changed = apply_levelling(st.session_state.use_cases, accepted)
+        save_use_cases(st.session_state.use_cases)
+        for use_case_id in changed:
+            record_change(before[use_case_id], st.session_state.use_cases[use_case_id],
+                          st.session_state.current_user, 'levelling')
+            queue_use_case_save(st.session_state.use_cases[use_case_id], st.session_state.current_user)
+        st.session_state.levelling_result = None
+        st.toast(f"✅ Rescheduled {len(accepted)} activities across {len(changed)} use cases")
+        st.rerun()
+
+def render_template_manager():
+    """Render the central MAP template editor backed by the versioned template store"""
+    template_version, template = get_template()
+
+    st.markdown("## 🧩 MAP Template")
+    st.markdown(f"**Current version:** v{template_version or 'built-in'}")
+    st.caption("Publishing creates a new template version; new use cases pick it up on their next form load.")
+
+    updated_template = {}
+    for stage_code, stage in template.items():
+        with st.expander(f"**{stage_code} - {stage['name']}**", expanded=False):
+            activities_df = pd.DataFrame(
+                stage['activities'],
+                columns=['outcome', 'questions', 'owner', 'conditional']
+            )
+            edited_activities = st.data_editor(
+                activities_df,
+                use_container_width=True,
+                num_rows="dynamic",
+                column_config={
+                    "outcome": st.column_config.TextColumn("Outcome", width=250, required=True),
+                    "questions": st.column_config.TextColumn("Embedded Questions", width=350),
+                    "owner": st.column_config.TextColumn("Owner", width=120),
+                    "conditional": st.column_config.SelectboxColumn(
+                        "Only When",
+                        options=["ssa", "poc"],
+                        width=100
+                    )
+                },
+                key=f"template_{stage_code}"
+            )
+
+            activities = []
+            for activity in edited_activities.to_dict('records'):
+                if not activity.get('outcome'):
+                    continue
+                activities.append({
+                    'outcome': activity['outcome'],
+                    'questions': activity.get('questions') or '',
+                    'owner': activity.get('owner') or '',
+                    'conditional': activity.get('conditional') if activity.get('conditional') in ('ssa', 'poc') else None
+                })
+            updated_template[stage_code] = {**stage, 'activities': activities}
+
+    st.markdown("---")
+    col1, col2, col3 = st.columns([1, 1, 3])
+    with col1:
+        if st.button("🚀 Publish Version", type="primary", disabled=not Config.validate()):
+            try:
+                version, created = publish_template(updated_template, st.session_state.current_user)
+                if created:
+                    st.success(f"✅ Published template v{version}")
+                else:
+                    st.info(f"No changes - template is still v{version}")
+            except Exception as e:
+                st.error(f"Failed to publish template: {e}")
+    with col2:
+        if st.button("🔙 Back"):
+            st.session_state.show_template_manager = False
+            st.rerun()
+
+    # Bring existing use cases onto the current template version
+    if Config.validate():
+        older_versions = [v['version'] for v in list_template_versions() if v['version'] != template_version]
+        if older_versions:
+            with st.expander("🔁 Migrate Existing Use Cases", expanded=False):
+                from_version = st.selectbox("From version", older_versions, key="migration_from_version")
+                col1, col2, col3 = st.columns([1, 1, 3])
+                with col1:
+                    dry_run = st.button("🔍 Dry Run")
+                with col2:
+                    apply_migration = st.button("✅ Migrate")
+
+                if dry_run or apply_migration:
+                    try:
+                        old_template = load_template_version(from_version)
+                        mapping = compute_template_mapping(old_template, template)
+                        report = migrate_use_case_maps(old_template, template, st.session_state.current_user,
+                                                       dry_run=dry_run, mapping=mapping)
+                        changed = migrate_local_use_cases(st.session_state.use_cases, mapping)
+                        report['local_use_cases'] = len(changed)
+                        if apply_migration:
+                            save_use_cases(st.session_state.use_cases)
+                            # Rebuild their rows from the documents (order and dates as in the view)
+                            for use_case_id in changed:
+                                queue_use_case_save(st.session_state.use_cases[use_case_id],
+                                                    st.session_state.current_user)
+                        else:
+                            # Dry run: discard the local changes too
+                            st.session_state.use_cases = load_use_cases()
+                        st.session_state.migration_report = (mapping, report)
+                    except Exception as e:
+                        st.error(f"Migration failed: {e}")
+
+                migration_report = st.session_state.get('migration_report')
+                if migration_report:
+                    mapping, report = migration_report
+                    st.markdown(f"**{'Dry run' if report['dry_run'] else 'Migrated'}:** "
+                                f"{report['use_cases']} use cases in {report['batches']} batches • "
+                                f"{report['rows_rewritten']} rewritten • {report['rows_added']} added • "
+                                f"{report['rows_removed']} removed • {report['rows_kept']} kept (user data) • "
+                                f"{report['local_use_cases']} local use cases")
+                    for category, entries in mapping.items():
+                        for entry in entries:
+                            st.caption(f"{category}: {entry[0]} • {entry[1]}"
+                                       + (f" → {entry[2]}" if category == 'renamed' else ""))
+
+@st.cache_data(ttl=ANALYTICS_TTL_SECONDS, show_spinner=False)
+def load_portfolio_analytics():
+    """Portfolio aggregates from Lakebase, cached briefly and shared across sessions"""
+    lakebase.connect()
+    try:
+        return portfolio_analytics()
+    finally:
+        lakebase.close()
+
+@st.cache_data(ttl=ANALYTICS_TTL_SECONDS, show_spinner=False)
+def load_template_deviations():
+    """Latest nightly plan-vs-template deviation report, cached briefly"""
+    lakebase.connect()
+    try:
+        lakebase.create_plan_deviations_table()
+        return {
+            'plans': load_deviations(),
+            **{kind: top_deviations(kind) for kind in ('missing', 'added', 'reordered')}
+        }
+    finally:
+        lakebase.close()
+
+def render_template_deviation():
+    """Render the stored plan-vs-template deviation report"""
+    st.markdown("#### Template Deviation")
+    try:
+        report = load_template_deviations()
+    except Exception as e:
+        st.error(f"Failed to load deviation report: {e}")
+        return
+
+    plans = pd.DataFrame(report['plans'])
+    if plans.empty:
+        st.info("No deviation report yet; run python -m services.deviation")
+        return
+
+    conforming = int(((plans['missing'] == 0) & (plans['added'] == 0) & (plans['reordered'] == 0)).sum())
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Plans Analysed", len(plans))
+    col2.metric("Fully Conforming", conforming)
+    col3.metric("Avg Conformance", f"{plans['conformance'].mean():.0%}")
+    col4.metric("With Custom Activities", int((plans['added'] > 0).sum()))
+    st.caption(f"Analysed {plans['analysed_at'].max():%Y-%m-%d %H:%M} against template "
+               f"v{plans['template_version'].max()}")
+
+    col1, col2, col3 = st.columns(3)
+    for column, kind, title in ((col1, 'missing', "Most Often Missing"), (col2, 'added', "Most Often Added"),
+                                (col3, 'reordered', "Most Often Reordered")):
+        with column:
+            st.markdown(f"**{title}**")
+            if report[kind]:
+                st.dataframe(pd.DataFrame(report[kind]), hide_index=True, use_container_width=True)
+            else:
+                st.caption("None")
+
+    st.markdown("**Least Conforming Plans**")
+    st.dataframe(plans.head(50).drop(columns=['template_version', 'analysed_at']),
+                 hide_index=True, use_container_width=True)
+
+def render_portfolio_dashboard():
+    """Render the portfolio analytics dashboard"""
+    st.markdown("## 📊 Portfolio Analytics")
+
+    col1, col2 = st.columns([1, 4])
+    with col1:
+        if st.button("🔄 Refresh"):
+            load_portfolio_analytics.clear()
+            load_template_deviations.clear()
+    with col2:
+        if st.button("🔙 Back"):
+            st.session_state.show_analytics = False
+            st.rerun()
+
+    try:
+        analytics = load_portfolio_analytics()
+    except Exception as e:
+        st.error(f"Failed to load analytics: {e}")
+        return
+
+    totals = analytics['totals']
+    if not totals['activities']:
+        st.info("No use cases in the database yet")
+        return
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Use Cases", totals['use_cases'])
+    col2.metric("Activities", totals['activities'])
+    col3.metric("Completed", f"{totals['completion_pct']}%")
+    col4.metric("Overdue", totals['overdue'])
+    st.caption(f"Refreshed at most every {ANALYTICS_TTL_SECONDS // 60} minutes")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("#### Activities by Stage and Status")
+        stage_status = pd.DataFrame(analytics['stage_status'])
+        fig = px.bar(stage_status, x='stage', y='activities', color='status',
+                     category_orders={'status': STATUS_OPTIONS},
+                     labels={'stage': 'Stage', 'activities': 'Activities', 'status': 'Status'})
+        st.plotly_chart(fig, use_container_width=True)
+
+    with col2:
+        st.markdown("#### Stage Dwell Time")
+        dwell = pd.DataFrame(analytics['dwell'])
+        if dwell.empty:
+            st.info("No dated activities")
+        else:
+            fig = px.bar(dwell, x='stage', y=['median_days', 'avg_days'], barmode='group',
+                         labels={'stage': 'Stage', 'value': 'Days', 'variable': ''})
+            st.plotly_chart(fig, use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("#### Completion by Customer")
+        customers = pd.DataFrame(analytics['customers']).sort_values('completion_pct')
+        fig = px.bar(customers.tail(25), x='completion_pct', y='customer', orientation='h',
+                     hover_data=['use_cases', 'activities', 'completed'],
+                     labels={'completion_pct': 'Completed (%)', 'customer': 'Customer'})
+        st.plotly_chart(fig, use_container_width=True)
+
+    with col2:
+        st.markdown("#### Overdue Activities by Owner")
+        owners = pd.DataFrame(analytics['owners'])
+        owners = owners[owners['overdue'] > 0].sort_values('overdue')
+        if owners.empty:
+            st.success("Nothing overdue")
+        else:
+            fig = px.bar(owners.tail(25), x='overdue', y='owner', orientation='h',
+                         hover_data=['activities', 'use_cases'],
+                         labels={'overdue': 'Overdue', 'owner': 'Owner'})
+            st.plotly_chart(fig, use_container_width=True)
+
+    render_template_deviation()
+
 def render_welcome():
     """Render welcome screen"""
     st.markdown("""
@@ -1383,12 +2593,26 @@ def main():
     inject_custom_css()
     initialize_session_state()
 
+    # Drain saves queued by earlier sessions (the worker starts once per process)
+    if Config.validate():
+        get_outbox()
+
     render_sidebar()
     render_header()
 
     # Main content area
     if st.session_state.current_user:
-        if st.session_state.show_new_use_case_form:
+        if st.session_state.show_template_manager:
+            render_template_manager()
+        elif st.session_state.show_analytics:
+            render_portfolio_dashboard()
+        elif st.session_state.show_portfolio_timeline:
+            render_portfolio_timeline()
+        elif st.session_state.show_workload:
+            render_workload_heatmap()
+        elif st.session_state.clone_source:
+            render_clone_form()
+        elif st.session_state.show_new_use_case_form:
             render_use_case_form()
         elif st.session_state.editing_use_case and not st.session_state.show_new_use_case_form:
             render_use_case_view()
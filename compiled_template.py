@@ -0,0 +1,68 @@
+"""
+Precompiled Consolidated MAP Template
+Generated by services/template_compiler.py - do not edit by hand, recompile instead
+"""
+
+TEMPLATE_VERSION = 1
+TEMPLATE_SOURCE = 'Consolidated MAP Template [Make A Copy] (1).xlsx'
+SOURCE_FILE_HASH = 'b89e5b24751c7f6b505bf7b0e08d69443b21c1ad2af15246b33a1601eabb5d18'
+TEMPLATE_HASH = '7ce9a0fd1a0f42a3837878c22a1a657e9429c892ffae903cf7838cc839edaa37'
+
+# (stage_code, name, description, ((outcome, questions, owner, conditional), ...))
+COMPILED_TEMPLATE = (
+    ('U2', 'Uncover', 'Initial discovery and scoping', (
+        ('Confirm U1 Exit Criteria Met', 'Is this a valid use case that is ready to enter U2? Should we push this back to U1 or de-prioritise?', 'SA/SA Manager', None),
+        ('Build and share this plan', 'How will you communicate the plan to all parties and ensure continous agreement?', 'SA', None),
+        ('Confirm Business Strategy Alignment', "How does use case align with  the customer's strategy and objectives?", 'AE', None),
+        ('Confirm budget and sign off process', 'Who will sign off the additional consumption and implementation costs?', 'AE', None),
+        ('Identify & develop a champion', "Do we have a true Champion who can sell internally? What's their influence level?", 'AE/SA', None),
+        ('Confirm and document business case', 'What’s the measurable business value (ROI, efficiency, risk)? I - Is there executive-level urgency?', 'AE', None),
+        ('Discover and document as is architecture', 'What is the current state? What are its challenges or limitations?', 'SA', None),
+        ('Document and validate to be architecture', 'What will the solution look like? How feasible is it?', 'SA', None),
+        ('Perform initial sizing', 'How much data? How many users? How complex is the workload? What mix of workload types is it?', 'SA', None),
+        ('Identify possible help needed from SSA, Product or third parties', 'Will we be able to access the expertise when we need it in later stages?', 'SA', 'ssa'),
+        ('Identify technical/product blockers and dependencies', 'What is likely to slow things down? How can we mitigate this?', 'SA', None),
+        ('Agree current view of onboarding and live dates', 'Is the customer bought into these dates? How would you assess their sense of urgency and priority?', 'AE/SA', None),
+        ('Agree a cadence with the customer for ongoing review and tracking', 'How often will you check in to ensure all parties are on track? Will this be part of a wider account cadence or does it merit a separate activity?', 'AE/SA', None),
+        ('Identify possible implementation strategies and participants', 'Will this be delivered by PS, Partner, Customer?', 'AE/SA', None),
+        ('Identify and agree evaluation strategy', 'What will happen in U3? Can we use an alternative to a POC?', 'SA', 'poc'),
+        ('Confirm U2 Exit Criteria Met and move to U3', 'Are you ready to enter U3?', 'AE/SA/SA Manager', None),
+    )),
+    ('U3', 'Understand', 'Requirements gathering and MVP planning', (
+        ('Define Evaluation Plan & Success Criteria', 'What are the agreed success metrics? What will trigger a "go/no-go" decision? Will there be a POC?', 'SA/AE', 'poc'),
+        ('Document POC (if POC Needed)', 'Does the POC document include success criteria, a plan that shows who is responsible for what and target timescales', 'SA', 'poc'),
+        ('Document alternative approach if no POC needed', 'Do all parties understand and agree to the alternative approach and the success criteria?', 'SA', None),
+        ('Evaluation Milestones Aligned', 'What are the exact steps required to hit success criteria? What could accelerate the timeline?', 'SA/SA Manager/AE', None),
+        ('Recheck product blockers and sign up for previews where needed', 'How will you ensure that the customer has access to all the required functionality?', 'SA', None),
+        ('Revalidate sizing based on evaluation', 'What has the evaluation process shown that will impact our assumptions about sizing? What are the cot implications?', 'SA', None),
+        ('Identify additional risks found in evaluation and mitigation strategies', 'Has the POC or other evaluation approach brought any new technical risks to light?', 'SA', None),
+        ('Learning needs assessment', 'What addiotnal skills and knowledge does the customer need ot ensure success?', 'AE/SA', None),
+        ('Validate Exec Alignment', 'Who is the exec decision maker? What’s the strength of the relationship? (Promoter/Neutral/Detractor)', 'AE/SA', None),
+        ('Confirm Post-Eval Path', 'If successful, what will the customer do next? Is onboarding resourced and approved? Are we wtill on track to meet our target dates? What can we do to accelerate them?', 'AE/SA', None),
+        ('Technical Evaluation Complete 🔍', 'Were success criteria met? What’s blocking a decision or deployment?', 'SA', None),
+        ('Engage all parties', 'Are all those who will be involved in onboarding the use case engaged?', 'AE/SA', None),
+        ('This Mutual Action Plan is shared and agreed', 'Does the customer agree that the evaluaton is complete and understand that the high level sequence of events outlined in this plan?', 'AE/SA', None),
+        ('Confirm U3 Exit Criteria Met and move to U4 ⭐ Technical Win ⭐', 'is this a quailty technical win that has a clear path through U4 to U5? What could go wrong or slow things down?', 'AE/SA/SA Manager', None),
+    )),
+    ('U4', 'Pilot', 'Pilot implementation and testing', (
+        ('Confirm Eval Exit Criteria Were Met', 'Have success metrics been validated and signed off? Who confirmed success on the customer side?', 'AE', None),
+        ('Confirm Executive Go Decision', 'Is the economic buyer aligned and committing to proceed? What’s the signed path forward?', 'AE', None),
+        ('Workspace & Project Provisioning', 'Have workspaces been provisioned? Is the technical deployment path (e.g. DSA vs. self-serve) locked in?', 'AE/SA/DSA', None),
+        ('Delivery Planning: Who, What, When', 'Who is delivering (DSA/partner)? What are the timelines, and who owns delivery internally?', 'AE/Delivery Team', None),
+        ('Final Delivery Logistics Sign-Off', 'Have all operational elements been reviewed — data access, PS/CS handoff, success tracking?', 'AE/PS/SA/DSA', None),
+        ('Customer Communication on Kickoff', 'Is the customer’s team briefed on onboarding plan, success milestones, and delivery roles?', 'AE', None),
+    )),
+    ('U5', 'Scale', 'Production deployment and scaling', (
+        ('Onboarding Kickoff Completed', 'Has onboarding occurred with technical leads, project owners, and exec sponsors aligned?', 'Delivery Team', None),
+        ('Success Plan Finalized', 'Is the success plan tailored to the agreed use case(s) with KPIs, owners, and timelines defined?', 'SA/AE', None),
+        ('Workspace Operational', 'Are required workspaces deployed with access, Unity Catalog, and governance configured?', 'SA', None),
+        ('Data Onboarding Complete', 'Has the necessary data been ingested, cleaned, and cataloged for the target use case?', 'SA', None),
+        ('Use Case Build Phase', 'Are ETL pipelines, SQL queries, dashboards, or ML models being built against real data?', 'Customer/Partner', None),
+        ('Milestone Review: First Value Delivered', 'Has the customer run production-like workflows (e.g., first pipeline, query, or model run)?', 'SA', None),
+        ('Enablement & Handoff to Users', 'Are end users enabled on tools like DBSQL, notebooks, dashboards, or ML interfaces?', 'SA', None),
+        ('User Onboarding Plan', 'Is there a big bang cutover of users or staged user onboarding? How many in each stage? Are the first tranche of users enabled/trained on Databricks? Are the first users expected to train/evangelise to the next groups of users? How does the stages impact consumption?', 'SA/AE', None),
+        ('Value Confirmation Milestone', 'Has the business sponsor confirmed the use case delivered expected results or insights?', 'AE', None),
+        ('Final Project Wrap-Up', 'Is there a documented outcomes review, with a clear roadmap for next use cases or expansion?', 'AE/SA', None),
+        ('Transition to CS/Scale Team', 'Has ownership formally shifted to the CS/Scale team with context and future growth plan?', 'AE', None),
+    )),
+)
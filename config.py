@@ -28,6 +28,12 @@ class Config:
     # Database Connection Settings
     DB_SSL_MODE = os.getenv('DB_SSL_MODE', 'require')
 
+    # Use case storage layout: 'rows' (one wide row per activity) or 'delta'
+    # (header + activities storing only what differs from the template, once
+    # test.use_case_maps is the normalised view). 'document' (one JSONB
+    # document per use case) is benchmark only; the app refuses to save in it
+    STORAGE_MODE = os.getenv('LAKEBASE_STORAGE_MODE', 'rows')
+
     # Application Settings
     APP_NAME = "Databricks Use Case Plans"
     APP_VERSION = "1.0.0"
@@ -95,6 +101,7 @@ class Config:
         print(f"LAKEBASE_DB_NAME: {cls.LAKEBASE_DB_NAME}")
         print(f"LAKEBASE_DB_USER: {cls.LAKEBASE_DB_USER}")
         print(f"DB_SSL_MODE: {cls.DB_SSL_MODE}")
+        print(f"STORAGE_MODE: {cls.STORAGE_MODE}")
         print(f"LAKEBASE_DB_PASSWORD: {'*' * 20 if cls.LAKEBASE_DB_PASSWORD else 'Not Set'}")
         print(f"DATABASE_VALIDATED: {cls.validate()}")
         print("=" * 50)
@@ -0,0 +1,258 @@
+"""
+Plan helpers shared by the Streamlit views and the background services
+Turns the nested use case document (stages -> activities) into flat schedule rows
+"""
+
+import re
+from datetime import datetime, timedelta
+
+# Status values offered by the plan editors
+STATUS_OPTIONS = ["Not Started", "In Progress", "Completed", "Blocked", "On Hold"]
+
+# Columns of the Excel-like view shown by default (the rest can be toggled on)
+DEFAULT_VIEW_COLUMNS = [
+    "ID",
+    "Stage",
+    "Activity",
+    "Owner",
+    "Start Date",
+    "End Date",
+    "Duration (Days)",
+    "Status",
+    "Notes"
+]
+
+# Columns sent to the browser as pandas categoricals
+CATEGORICAL_COLUMNS = ["Stage", "Status", "Owner"]
+
+# Editable view columns and the activity field they write to
+VIEW_EDIT_FIELDS = {
+    "Activity": "activity",
+    "Description": "description",
+    "Owner": "owner",
+    "Status": "status",
+    "Duration (Days)": "duration_days",
+    "Dependencies": "dependencies",
+    "Deliverables": "deliverables",
+    "Notes": "notes"
+}
+
+
+def normalize_stage_code(stage_name):
+    """Extract the U2-U6 stage code stored in test.use_case_maps"""
+    u_stage_match = re.search(r'(U[2-6])', stage_name)
+    if u_stage_match:
+        return u_stage_match.group(1)
+    return stage_name
+
+
+def status_progress(status):
+    """Progress percentage stored for an activity status"""
+    if status == 'Not Started':
+        return 0.0
+    if status == 'Completed':
+        return 100.0
+    return 50.0
+
+
+def progress_status(progress):
+    """Activity status for a stored progress percentage (inverse of status_progress)"""
+    if not progress:
+        return 'Not Started'
+    if progress >= 100:
+        return 'Completed'
+    return 'In Progress'
+
+
+def activity_db_fields(activity, plan_row):
+    """Activity columns written to test.use_case_maps for one activity
+
+    Dates are the activity's slot in the sequential schedule (plan_row is its
+    build_plan_rows row), so the database holds the dates the view shows.
+    """
+    return {
+        'Outcome': activity['activity'],
+        'Embedded_Questions': activity.get('description', ''),
+        'Owner_Name': activity.get('owner', ''),
+        'Start_Date': datetime.strptime(plan_row['Start Date'], '%Y-%m-%d').date(),
+        'End_Date': datetime.strptime(plan_row['End Date'], '%Y-%m-%d').date(),
+        'Progress': status_progress(activity.get('status', 'Not Started')),
+        'Notes': activity.get('notes', ''),
+        'Action': activity['activity']
+    }
+
+
+def view_stage_code(stage_name, stage_idx):
+    """Map a stage name to its U-stage code for the Excel-like view"""
+    # First try to match U2-U6 format
+    u_stage_match = re.search(r'(U[2-6])', stage_name)
+    if u_stage_match:
+        return u_stage_match.group(1)
+
+    # Try to match "Stage N" format
+    stage_match = re.search(r'Stage\s+(\d+)', stage_name)
+    if stage_match:
+        stage_num = int(stage_match.group(1))
+        return f"U{stage_num + 1}"  # Stage 1 -> U2, Stage 2 -> U3, etc.
+
+    # Fallback: use index-based mapping
+    return f"U{stage_idx + 2}" if stage_idx < 5 else "U6"
+
+
+def build_plan_rows(use_case):
+    """Compute the sequential schedule rows for a use case
+
+    Each activity starts the day after the previous one ends (plus its optional
+    lag_days), beginning at the use case start date. Returns a list of dicts
+    keyed by USE_CASE_COLUMNS.
+    """
+    rows = []
+    prev_end = None
+
+    for stage_idx, stage in enumerate(use_case['stages']):
+        stage_name = stage['stage_name']
+        stage_code = view_stage_code(stage_name, stage_idx)
+
+        for activity in stage['activities']:
+            if prev_end is not None:
+                start = prev_end + timedelta(days=1)
+            else:
+                start = datetime.fromisoformat(use_case['start_date'])
+            # Resource levelling can hold an activity back without changing its duration
+            start += timedelta(days=activity.get('lag_days', 0))
+
+            duration = activity.get('duration_days', 5)
+            end = start + timedelta(days=duration)
+            prev_end = end
+
+            rows.append({
+                'ID': stage_code,
+                'Stage': stage_name,
+                'Activity': activity['activity'],
+                'Description': activity.get('description', ''),
+                'Owner': activity.get('owner', ''),
+                'Start Date': start.strftime('%Y-%m-%d'),
+                'End Date': end.strftime('%Y-%m-%d'),
+                'Duration (Days)': duration,
+                'Status': activity.get('status', 'Not Started'),
+                'Dependencies': activity.get('dependencies', ''),
+                'Deliverables': activity.get('deliverables', ''),
+                'Notes': activity.get('notes', '')
+            })
+
+    return rows
+
+
+def plan_db_rows(use_case):
+    """(stage code, activity, activity_db_fields) of every activity, in view row order"""
+    rows = build_plan_rows(use_case)
+    activities = [
+        (normalize_stage_code(stage['stage_name']), activity)
+        for stage in use_case['stages']
+        for activity in stage['activities']
+    ]
+    return [
+        (stage_code, activity, activity_db_fields(activity, row))
+        for (stage_code, activity), row in zip(activities, rows)
+    ]
+
+
+def activity_positions(use_case):
+    """(stage index, activity index) of every activity, in view row order"""
+    return [
+        (stage_idx, activity_idx)
+        for stage_idx, stage in enumerate(use_case['stages'])
+        for activity_idx in range(len(stage['activities']))
+    ]
+
+
+def _parse_view_date(value):
+    """Parse a YYYY-MM-DD cell value, returning None if it is not a date"""
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+def apply_view_edits(use_case, edited_rows, row_offset=0):
+    """Apply Excel-like view cell edits to a use case document in place
+
+    edited_rows is the data editor's {row: {column: value}} delta for a page
+    starting at row_offset. Dates are stored as durations, so an End Date edit
+    changes the activity duration and a Start Date edit changes the previous
+    activity's duration (or the plan start date for the first row).
+
+    Returns (changes, start_shift_days) where changes is a list of dicts with
+    the view row position, the stage code and the activity before and after
+    the edit. Cells that already hold the edited value produce no change.
+    """
+    positions = activity_positions(use_case)
+    rows = build_plan_rows(use_case)
+    originals = {}
+    start_shift_days = 0
+
+    def edit_activity(position):
+        stage_idx, activity_idx = position
+        activity = use_case['stages'][stage_idx]['activities'][activity_idx]
+        originals.setdefault(position, dict(activity))
+        return activity
+
+    for row_key, cells in edited_rows.items():
+        row_idx = row_offset + int(row_key)
+        if row_idx >= len(positions):
+            continue
+        position = positions[row_idx]
+        row_start = _parse_view_date(rows[row_idx]['Start Date'])
+
+        for column, value in cells.items():
+            if column in VIEW_EDIT_FIELDS:
+                field = VIEW_EDIT_FIELDS[column]
+                if field == 'duration_days':
+                    try:
+                        value = max(int(value), 1)
+                    except (TypeError, ValueError):
+                        continue
+                elif value is None:
+                    value = ''
+                edit_activity(position)[field] = value
+
+            elif column == 'End Date':
+                new_end = _parse_view_date(value)
+                if new_end is not None:
+                    edit_activity(position)['duration_days'] = max((new_end - row_start).days, 1)
+
+            elif column == 'Start Date':
+                new_start = _parse_view_date(value)
+                if new_start is None:
+                    continue
+                delta = (new_start - row_start).days
+                if delta == 0:
+                    continue
+                if row_idx == 0:
+                    plan_start = datetime.fromisoformat(use_case['start_date']) + timedelta(days=delta)
+                    use_case['start_date'] = plan_start.date().isoformat()
+                    start_shift_days += delta
+                else:
+                    previous = edit_activity(positions[row_idx - 1])
+                    previous['duration_days'] = max(previous.get('duration_days', 5) + delta, 1)
+
+    row_of = {position: row_idx for row_idx, position in enumerate(positions)}
+    changes = []
+    for (stage_idx, activity_idx), before in originals.items():
+        stage = use_case['stages'][stage_idx]
+        after = stage['activities'][activity_idx]
+        if after != before:
+            changes.append({
+                'position': row_of[(stage_idx, activity_idx)],
+                'stage_code': normalize_stage_code(stage['stage_name']),
+                'before': before,
+                'after': dict(after)
+            })
+
+    return changes, start_shift_days
+
+
+def page_bounds(total_rows, page_size, page):
+    """Return (start, end) slice bounds for a 1-based page number"""
+    start = max(page - 1, 0) * page_size
+    return start, min(start + page_size, total_rows)
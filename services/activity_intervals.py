@@ -0,0 +1,242 @@
+"""
+Date-range queries over activities: due (ending in a window), overdue and in-window
+Lakebase answers them from a GiST index on daterange("Start_Date", "End_Date");
+offline, an interval tree over the local JSON store gives the same answers
+
+Usage:
+    python -m services.activity_intervals [--from 2025-01-06] [--to 2025-01-12] [--due | --overdue]
+        [--owner NAME] [--status "In Progress"] [--customer NAME] [--local use_case_data/use_cases.json]
+"""
+
+import argparse
+import bisect
+import json
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+from plan_utils import build_plan_rows
+from services.analytics import STATUS_SQL
+from services.lakebase import lakebase
+
+RESULT_COLUMNS = ['use_case_id', 'use_case_name', 'customer', 'stage', 'activity', 'owner', 'status', 'start', 'end']
+
+DEFAULT_LIMIT = 1000
+
+# Must match the idx_use_case_maps_date_range expression exactly for the planner to use it
+ACTIVITY_RANGE_SQL = """daterange(LEAST("Start_Date", "End_Date"), GREATEST("Start_Date", "End_Date"), '[]')"""
+
+SELECT_SQL = f"""
+    SELECT use_case_id, use_case_name, customer_name, "Stage", "Outcome", "Owner_Name",
+           {STATUS_SQL} AS status, "Start_Date", "End_Date"
+    FROM test.use_case_maps
+    WHERE "Start_Date" IS NOT NULL AND "End_Date" IS NOT NULL
+"""
+
+
+def _parse_date(value):
+    """Accept date objects or YYYY-MM-DD strings"""
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def week_window(today=None):
+    """(Monday, Sunday) of the week containing today"""
+    today = today or date.today()
+    monday = today - timedelta(days=today.weekday())
+    return monday, monday + timedelta(days=6)
+
+
+def _filter_sql(owner, statuses, customers):
+    """WHERE fragments and params for the owner/status/customer filters"""
+    clauses, params = [], []
+    if owner:
+        clauses.append('"Owner_Name" ILIKE %s')
+        params.append(f"%{owner}%")
+    if statuses:
+        clauses.append(f"{STATUS_SQL} = ANY(%s)")
+        params.append(list(statuses))
+    if customers:
+        clauses.append("customer_name = ANY(%s)")
+        params.append(list(customers))
+    return clauses, params
+
+
+def _run_query(clauses, params, limit):
+    """Run SELECT_SQL with the extra clauses and return result dicts"""
+    sql = SELECT_SQL + ''.join(f"\n    AND {clause}" for clause in clauses)
+    sql += '\n    ORDER BY "End_Date", use_case_id\n    LIMIT %s'
+    rows = lakebase.query(sql, tuple(params) + (limit,)) or []
+    return [dict(zip(RESULT_COLUMNS, row)) for row in rows]
+
+
+def query_lakebase_window(start=None, end=None, owner=None, statuses=None, customers=None, limit=DEFAULT_LIMIT):
+    """Activities in test.use_case_maps whose dates overlap [start, end] (either bound may be open)"""
+    clauses, params = [f"{ACTIVITY_RANGE_SQL} && daterange(%s, %s, '[]')"], [_parse_date(start), _parse_date(end)]
+    filters, filter_params = _filter_sql(owner, statuses, customers)
+    return _run_query(clauses + filters, params + filter_params, limit)
+
+
+def query_lakebase_due(start, end, owner=None, statuses=None, customers=None, limit=DEFAULT_LIMIT):
+    """Activities in test.use_case_maps whose end date falls in [start, end]"""
+    start, end = _parse_date(start), _parse_date(end)
+    # The overlap test lets the planner use the range index; the end date test is exact
+    clauses = [f"{ACTIVITY_RANGE_SQL} && daterange(%s, %s, '[]')", '"End_Date" BETWEEN %s AND %s']
+    filters, filter_params = _filter_sql(owner, statuses, customers)
+    return _run_query(clauses + filters, [start, end, start, end] + filter_params, limit)
+
+
+def query_lakebase_overdue(as_of=None, owner=None, customers=None, limit=DEFAULT_LIMIT):
+    """Unfinished activities in test.use_case_maps that ended before as_of (default today)"""
+    as_of = _parse_date(as_of) or date.today()
+    clauses, params = [f"{ACTIVITY_RANGE_SQL} << daterange(%s, NULL, '[)')"], [as_of]
+    filters, filter_params = _filter_sql(owner, None, customers)
+    clauses.append(f"{STATUS_SQL} <> 'Completed'")
+    return _run_query(clauses + filters, params + filter_params, limit)
+
+
+class IntervalTree:
+    """Static interval tree over (start, end, item) triples
+
+    Intervals are sorted by start and laid out as an implicit balanced binary
+    tree (each node is the middle of its slice) augmented with the maximum end
+    in its subtree, so overlap queries cost O(log n + k).
+    """
+
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals, key=lambda interval: interval[0])
+        self.max_end = [None] * len(self.intervals)
+        self._build(0, len(self.intervals))
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self.intervals[mid][1]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > max_end:
+                max_end = child
+        self.max_end[mid] = max_end
+        return max_end
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def overlap(self, start, end):
+        """Items whose [start, end] overlaps the query range (None = unbounded)"""
+        found = []
+        stack = [(0, len(self.intervals))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            # Nothing in this subtree ends late enough
+            if start is not None and self.max_end[mid] < start:
+                continue
+            stack.append((lo, mid))
+            interval_start, interval_end, item = self.intervals[mid]
+            # Everything right of mid starts even later
+            if end is not None and interval_start > end:
+                continue
+            if start is None or interval_end >= start:
+                found.append(item)
+            stack.append((mid + 1, hi))
+        return found
+
+
+class LocalActivityIndex:
+    """Interval index over the schedule of every use case in the local store"""
+
+    def __init__(self, use_cases):
+        intervals = []
+        for use_case in use_cases:
+            for row in build_plan_rows(use_case):
+                item = dict(zip(RESULT_COLUMNS, (
+                    use_case['use_case_id'], use_case.get('name', ''), use_case.get('customer', ''),
+                    row['ID'], row['Activity'], row['Owner'], row['Status'],
+                    _parse_date(row['Start Date']), _parse_date(row['End Date'])
+                )))
+                intervals.append((item['start'], item['end'], item))
+
+        self.tree = IntervalTree(intervals)
+        # Ends sorted separately answer "ended before" queries with one bisect
+        self.by_end = sorted(intervals, key=lambda interval: interval[1])
+        self._ends = [interval[1] for interval in self.by_end]
+
+    @staticmethod
+    def _matches(item, owner, statuses, customers):
+        return ((not owner or owner.lower() in (item['owner'] or '').lower())
+                and (not statuses or item['status'] in statuses)
+                and (not customers or item['customer'] in customers))
+
+    def window(self, start=None, end=None, owner=None, statuses=None, customers=None):
+        """Activities whose dates overlap [start, end]"""
+        items = self.tree.overlap(_parse_date(start), _parse_date(end))
+        items = [item for item in items if self._matches(item, owner, statuses, customers)]
+        return sorted(items, key=lambda item: (item['end'], item['use_case_id']))
+
+    def due(self, start, end, owner=None, statuses=None, customers=None):
+        """Activities whose end date falls in [start, end]"""
+        lo = bisect.bisect_left(self._ends, _parse_date(start))
+        hi = bisect.bisect_right(self._ends, _parse_date(end))
+        items = [item for _, _, item in self.by_end[lo:hi] if self._matches(item, owner, statuses, customers)]
+        return sorted(items, key=lambda item: (item['end'], item['use_case_id']))
+
+    def overdue(self, as_of=None, owner=None, customers=None):
+        """Unfinished activities that ended before as_of (default today)"""
+        as_of = _parse_date(as_of) or date.today()
+        ended = self.by_end[:bisect.bisect_left(self._ends, as_of)]
+        return [
+            item for _, _, item in ended
+            if item['status'] != 'Completed' and self._matches(item, owner, None, customers)
+        ]
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Query activities by date range")
+    parser.add_argument('--from', dest='start', help="Window start (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end', help="Window end (YYYY-MM-DD)")
+    parser.add_argument('--due', action='store_true', help="Activities ending in the window, not overlapping it")
+    parser.add_argument('--overdue', action='store_true', help="Unfinished activities past their end date")
+    parser.add_argument('--owner')
+    parser.add_argument('--status', action='append', dest='statuses')
+    parser.add_argument('--customer', action='append', dest='customers')
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    parser.add_argument('--local', help="Query a local use_cases.json store instead of Lakebase")
+    args = parser.parse_args(argv)
+
+    if not args.overdue and not (args.start or args.end):
+        args.start, args.end = week_window()
+
+    if args.local:
+        index = LocalActivityIndex(json.loads(Path(args.local).read_text()).values())
+        if args.overdue:
+            results = index.overdue(owner=args.owner, customers=args.customers)
+        elif args.due:
+            results = index.due(args.start, args.end, args.owner, args.statuses, args.customers)
+        else:
+            results = index.window(args.start, args.end, args.owner, args.statuses, args.customers)
+        results = results[:args.limit]
+    else:
+        if args.overdue:
+            results = query_lakebase_overdue(owner=args.owner, customers=args.customers, limit=args.limit)
+        elif args.due:
+            results = query_lakebase_due(args.start, args.end, args.owner, args.statuses,
+                                         args.customers, args.limit)
+        else:
+            results = query_lakebase_window(args.start, args.end, args.owner, args.statuses,
+                                            args.customers, args.limit)
+        lakebase.close()
+
+    for item in results:
+        print(f"{item['end']}  {item['use_case_id']:<16} {item['stage']:<4} {item['status']:<12} "
+              f"{(item['owner'] or '-'):<20} {item['activity']}")
+    print(f"{len(results)} activities")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
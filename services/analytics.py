@@ -0,0 +1,101 @@
+"""
+Portfolio analytics over test.use_case_maps
+All aggregation runs in Lakebase (GROUPING SETS / FILTER), so only a few
+summary rows per stage, customer and owner ever reach the app
+"""
+
+from services.lakebase import lakebase
+
+# Mirrors plan_utils.status_progress: 0 = Not Started, 100 = Completed
+STATUS_SQL = """
+    CASE WHEN COALESCE("Progress", 0) >= 100 THEN 'Completed'
+         WHEN COALESCE("Progress", 0) <= 0 THEN 'Not Started'
+         ELSE 'In Progress' END
+"""
+
+# One scan of the table produces every breakdown; GROUPING() tells them apart
+SUMMARY_SQL = f"""
+    SELECT GROUPING("Stage", status, customer_name, owner) AS grouping_id,
+           "Stage", status, customer_name, owner,
+           COUNT(*) AS activities,
+           COUNT(*) FILTER (WHERE status = 'Completed') AS completed,
+           COUNT(*) FILTER (WHERE status <> 'Completed' AND "End_Date" < CURRENT_DATE) AS overdue,
+           COUNT(DISTINCT use_case_id) AS use_cases
+    FROM (
+        SELECT use_case_id, "Stage", customer_name, "End_Date",
+               COALESCE(NULLIF("Owner_Name", ''), 'Unassigned') AS owner,
+               {STATUS_SQL} AS status
+        FROM test.use_case_maps
+    ) a
+    GROUP BY GROUPING SETS (("Stage", status), (customer_name), (owner), ())
+"""
+
+# Dwell = planned days spent in a stage (activities run back to back), per use case
+DWELL_SQL = """
+    SELECT "Stage",
+           COUNT(*) AS use_cases,
+           AVG(days) AS avg_days,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY days) AS median_days,
+           MAX(days) AS max_days
+    FROM (
+        SELECT use_case_id, "Stage", SUM(GREATEST("End_Date" - "Start_Date", 0)) AS days
+        FROM test.use_case_maps
+        WHERE "Start_Date" IS NOT NULL AND "End_Date" IS NOT NULL
+        GROUP BY use_case_id, "Stage"
+    ) d
+    GROUP BY "Stage"
+    ORDER BY "Stage"
+"""
+
+# GROUPING() bit masks for the grouping sets above (1 = column rolled up)
+GROUPING_STAGE_STATUS = 0b0011
+GROUPING_CUSTOMER = 0b1101
+GROUPING_OWNER = 0b1110
+GROUPING_TOTAL = 0b1111
+
+
+def _counts(row):
+    """Aggregate columns of a SUMMARY_SQL row"""
+    activities, completed, overdue, use_cases = row[5:9]
+    return {
+        'activities': activities,
+        'completed': completed,
+        'overdue': overdue,
+        'use_cases': use_cases,
+        'completion_pct': round(100.0 * completed / activities, 1) if activities else 0.0
+    }
+
+
+def portfolio_analytics():
+    """Compute the portfolio dashboard aggregates
+
+    Returns a dict of small lists: stage_status, customers, owners, dwell,
+    plus a totals dict. Two queries, each a single pass over the table.
+    """
+    lakebase.create_use_case_maps_table()
+    summary = lakebase.query(SUMMARY_SQL) or []
+    dwell = lakebase.query(DWELL_SQL) or []
+
+    analytics = {'stage_status': [], 'customers': [], 'owners': [], 'dwell': [], 'totals': _counts((None,) * 5 + (0, 0, 0, 0))}
+    for row in summary:
+        grouping_id, stage, status, customer, owner = row[:5]
+        if grouping_id == GROUPING_STAGE_STATUS:
+            analytics['stage_status'].append({'stage': stage or 'Unstaged', 'status': status, **_counts(row)})
+        elif grouping_id == GROUPING_CUSTOMER:
+            analytics['customers'].append({'customer': customer or 'Unknown', **_counts(row)})
+        elif grouping_id == GROUPING_OWNER:
+            analytics['owners'].append({'owner': owner, **_counts(row)})
+        elif grouping_id == GROUPING_TOTAL:
+            analytics['totals'] = _counts(row)
+
+    analytics['dwell'] = [
+        {
+            'stage': stage or 'Unstaged',
+            'use_cases': use_cases,
+            'avg_days': round(float(avg_days), 1),
+            'median_days': round(float(median_days), 1),
+            'max_days': max_days
+        }
+        for stage, use_cases, avg_days, median_days, max_days in dwell
+    ]
+    return analytics
@@ -0,0 +1,131 @@
+"""
+Archive tier for closed plans
+Moves the activity rows of closed plans from test.use_case_maps into test.use_case_maps_archive
+in batched transactions, so the hot table only holds plans still being worked on
+
+A plan is closed when every activity is completed, or when it was abandoned: not
+updated for --stale-days and past its last end date.
+
+Usage:
+    python -m services.archive [--stale-days 180] [--batch-size 50] [--pause 0.1] [--dry-run]
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+from services.lakebase import lakebase
+
+DEFAULT_STALE_DAYS = 180
+DEFAULT_BATCH_SIZE = 50
+
+ARCHIVE_COLUMNS = """
+    p_id, use_case_id, use_case_name, customer_name, "Stage", "Outcome",
+    "Embedded_Questions", "Owner_Name", "Start_Date", "End_Date",
+    "Progress", "Notes", "Action", solution_architect, account_executive,
+    ssa_required, poc_required, created_by, created_at, updated_by, updated_at, position
+"""
+
+CLOSED_HAVING_SQL = """
+    HAVING bool_and(COALESCE("Progress", 0) >= 100)
+        OR (MAX(updated_at) < %(stale_before)s AND MAX("End_Date") < CURRENT_DATE)
+"""
+
+CLOSED_SQL = """
+    SELECT use_case_id, COUNT(*)
+    FROM test.use_case_maps
+    WHERE use_case_id IS NOT NULL AND use_case_id != ''
+    GROUP BY use_case_id
+""" + CLOSED_HAVING_SQL + """
+    ORDER BY use_case_id
+"""
+
+# Closed status is checked again inside the move so a plan reopened since the
+# scan stays; works on the table and on the normalised compatibility view. A plan
+# saved again after it was archived is back in the hot table: its new rows
+# replace the earlier archived ones rather than being added to them
+MOVE_SQL = f"""
+    WITH moved AS (
+        DELETE FROM test.use_case_maps
+        WHERE use_case_id IN (
+            SELECT use_case_id
+            FROM test.use_case_maps
+            WHERE use_case_id = ANY(%(use_case_ids)s)
+            GROUP BY use_case_id
+            {CLOSED_HAVING_SQL}
+        )
+        RETURNING {ARCHIVE_COLUMNS}
+    ), replaced AS (
+        DELETE FROM test.use_case_maps_archive
+        WHERE use_case_id IN (SELECT DISTINCT use_case_id FROM moved)
+    )
+    INSERT INTO test.use_case_maps_archive ({ARCHIVE_COLUMNS}, archived_at)
+    SELECT {ARCHIVE_COLUMNS}, %(now)s
+    FROM moved
+"""
+
+
+def closed_use_cases(stale_days=DEFAULT_STALE_DAYS):
+    """[(use_case_id, activity rows)] of the plans that are closed now"""
+    stale_before = datetime.now() - timedelta(days=stale_days)
+    return [tuple(row) for row in lakebase.query(CLOSED_SQL, {'stale_before': stale_before}) or []]
+
+
+def archive_closed(stale_days=DEFAULT_STALE_DAYS, batch_size=DEFAULT_BATCH_SIZE, pause=0.0,
+                   dry_run=False, progress=None):
+    """Move closed plans to the archive, batch_size plans per transaction
+
+    pause sleeps between batches to leave room for interactive traffic.
+    Returns a report dict.
+    """
+    lakebase.create_use_case_maps_table()
+    lakebase.create_use_case_maps_archive_table()
+
+    closed = closed_use_cases(stale_days)
+    report = {'use_cases': len(closed), 'rows': sum(count for _, count in closed), 'batches': 0, 'moved': 0}
+    if dry_run:
+        return report
+
+    stale_before = datetime.now() - timedelta(days=stale_days)
+    use_case_ids = [use_case_id for use_case_id, _ in closed]
+    for start in range(0, len(use_case_ids), batch_size):
+        with lakebase.transaction() as cursor:
+            cursor.execute(MOVE_SQL, {
+                'use_case_ids': use_case_ids[start:start + batch_size],
+                'stale_before': stale_before,
+                'now': datetime.now()
+            })
+            report['moved'] += cursor.rowcount
+        report['batches'] += 1
+        if progress:
+            progress(report)
+        if pause:
+            time.sleep(pause)
+    return report
+
+
+def main(argv=None):
+    """Command line entry point (scheduled maintenance job)"""
+    parser = argparse.ArgumentParser(description="Move closed plans to test.use_case_maps_archive")
+    parser.add_argument('--stale-days', type=int, default=DEFAULT_STALE_DAYS,
+                        help="Days without updates after which an ended plan counts as abandoned")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Plans per transaction")
+    parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would be archived")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    report = archive_closed(args.stale_days, args.batch_size, args.pause, args.dry_run, progress=lambda r: print(
+        f"  batch {r['batches']}: {r['moved']} rows archived", flush=True))
+    if args.dry_run:
+        print(f"{report['use_cases']} closed plans ({report['rows']} rows) would be archived")
+    else:
+        print(f"Archived {report['use_cases']} closed plans ({report['moved']} rows) in "
+              f"{report['batches']} batches, {time.perf_counter() - started:.1f}s")
+    lakebase.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+"""
+Append-only change history for use cases
+Records a field-level diff of every save or edit, buffered in memory and flushed in batches
+with COPY on a background thread, and rebuilds any plan as of a timestamp from the latest
+snapshot before it plus the changes after that snapshot
+
+Usage:
+    python -m services.change_log EJ-2025-09-001 [--as-of 2025-10-01T12:00] [--history 20]
+"""
+
+import argparse
+import atexit
+import json
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from config import Config
+from services.lakebase import LakebaseService, lakebase
+
+# Buffered rows are flushed when this many are waiting, or after FLUSH_SECONDS
+FLUSH_ROWS = 500
+FLUSH_SECONDS = 5.0
+
+# Rows kept for retry while the database is unreachable; the oldest are dropped beyond this
+MAX_BUFFERED_ROWS = 50000
+
+# A snapshot is written once a use case has this many changes since its last one,
+# so reconstruction never replays more than about this many rows
+SNAPSHOT_EVERY = 50
+
+# Document fields that change on every save and are not tracked
+UNTRACKED_FIELDS = {'updated_at', 'document_version'}
+
+CHANGE_COLUMNS = ['use_case_id', 'changed_at', 'changed_by', 'source', 'op', 'path', 'label', 'old_value', 'new_value']
+
+INSERT_SNAPSHOTS_SQL = """
+    INSERT INTO test.use_case_snapshots (use_case_id, taken_at, document)
+    VALUES %s
+    ON CONFLICT (use_case_id, taken_at) DO NOTHING
+"""
+
+SNAPSHOT_VALUES = "(%(use_case_id)s, %(taken_at)s, %(document)s::jsonb)"
+
+# Use cases of a flush without any snapshot, and the changes each has since its latest one
+SNAPSHOT_STATE_SQL = """
+    SELECT ids.use_case_id, s.taken_at,
+           (SELECT COUNT(*) FROM test.use_case_changes c
+            WHERE c.use_case_id = ids.use_case_id AND c.changed_at > COALESCE(s.taken_at, '-infinity'))
+    FROM unnest(%(use_case_ids)s::text[]) AS ids(use_case_id)
+    LEFT JOIN LATERAL (
+        SELECT MAX(taken_at) AS taken_at FROM test.use_case_snapshots WHERE use_case_id = ids.use_case_id
+    ) s ON TRUE
+"""
+
+LATEST_SNAPSHOT_SQL = """
+    SELECT taken_at, document
+    FROM test.use_case_snapshots
+    WHERE use_case_id = %(use_case_id)s AND taken_at <= %(as_of)s
+    ORDER BY taken_at DESC
+    LIMIT 1
+"""
+
+CHANGES_SINCE_SQL = """
+    SELECT changed_at, op, path, new_value
+    FROM test.use_case_changes
+    WHERE use_case_id = %(use_case_id)s
+    AND changed_at > %(since)s AND changed_at <= %(as_of)s
+    ORDER BY changed_at, change_id
+"""
+
+HISTORY_SQL = """
+    SELECT changed_at, changed_by, source, op, label, old_value, new_value
+    FROM test.use_case_changes
+    WHERE use_case_id = %(use_case_id)s
+    ORDER BY changed_at DESC, change_id DESC
+    LIMIT %(limit)s
+"""
+
+
+def _escape(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(segment):
+    return segment.replace('~1', '/').replace('~0', '~')
+
+
+def flatten_document(value, prefix=''):
+    """{path: leaf} of a use case document; paths are JSON pointers, empty containers are leaves"""
+    if isinstance(value, dict) and value:
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten_document(item, f"{prefix}/{_escape(key)}"))
+        return flat
+    if isinstance(value, list) and value:
+        flat = {}
+        for idx, item in enumerate(value):
+            flat.update(flatten_document(item, f"{prefix}/{idx}"))
+        return flat
+    return {prefix: value}
+
+
+def unflatten_document(flat):
+    """Inverse of flatten_document"""
+    root = {}
+    for path in sorted(flat, key=lambda p: [(0, int(s), '') if s.isdigit() else (1, 0, s) for s in p.split('/')]):
+        segments = [_unescape(segment) for segment in path.split('/')[1:]]
+        container = root
+        for idx, segment in enumerate(segments):
+            key = int(segment) if isinstance(container, list) else segment
+            if idx == len(segments) - 1:
+                value = flat[path]
+                value = type(value)() if isinstance(value, (list, dict)) else value
+                if isinstance(container, list):
+                    container.extend([None] * (key + 1 - len(container)))
+                container[key] = value
+                break
+            child = [] if segments[idx + 1].isdigit() else {}
+            if isinstance(container, list):
+                container.extend([None] * (key + 1 - len(container)))
+                if container[key] is None:
+                    container[key] = child
+            else:
+                container.setdefault(key, child)
+            container = container[key]
+    return root
+
+
+def diff_documents(before, after):
+    """[(op, path, old, new)] turning one use case document into the other ('set' or 'remove')"""
+    old = {path: value for path, value in flatten_document(before).items() if path[1:] not in UNTRACKED_FIELDS}
+    new = {path: value for path, value in flatten_document(after).items() if path[1:] not in UNTRACKED_FIELDS}
+    changes = [('set', path, old.get(path), value) for path, value in new.items()
+               if path not in old or old[path] != value]
+    changes += [('remove', path, value, None) for path, value in old.items() if path not in new]
+    return changes
+
+
+def describe_path(document, path):
+    """Readable label of a change path, e.g. 'U4 - Build › Run POC › status'"""
+    segments = [_unescape(segment) for segment in path.split('/')[1:]]
+    try:
+        if len(segments) >= 2 and segments[0] == 'stages':
+            stage = document['stages'][int(segments[1])]
+            parts = [stage.get('stage_name', f"Stage {segments[1]}")]
+            if len(segments) >= 4 and segments[2] == 'activities':
+                parts.append(stage['activities'][int(segments[3])].get('activity', f"Activity {segments[3]}"))
+                parts.append('/'.join(segments[4:]) or 'activity')
+            else:
+                parts.append('/'.join(segments[2:]) or 'stage')
+            return ' › '.join(parts)
+    except (IndexError, KeyError, ValueError, TypeError):
+        pass
+    return '/'.join(segments)
+
+
+class ChangeBuffer:
+    """Change groups waiting to be written, flushed by a daemon thread
+
+    The writer uses its own connection so flushes never interleave with the
+    app's transactions. Failed flushes keep their rows for the next attempt.
+    """
+
+    def __init__(self):
+        self.groups = []
+        self.rows = 0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.service = LakebaseService()
+        self.tables_ready = False
+
+    def add(self, group):
+        """Queue one change group; wakes the writer once FLUSH_ROWS rows are waiting"""
+        with self.lock:
+            self.groups.append(group)
+            self.rows += len(group['changes'])
+            while self.rows > MAX_BUFFERED_ROWS and len(self.groups) > 1:
+                dropped = self.groups.pop(0)
+                self.rows -= len(dropped['changes'])
+                print(f"Change log buffer full, dropped changes of {dropped['use_case_id']}")
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="change-log-writer", daemon=True)
+                self.thread.start()
+            if self.rows >= FLUSH_ROWS:
+                self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait(FLUSH_SECONDS)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered; returns the number of change rows written"""
+        with self.flush_lock:
+            with self.lock:
+                groups, self.groups, self.rows = self.groups, [], 0
+            if not groups:
+                return 0
+            try:
+                return self._write(groups)
+            except Exception as e:
+                print(f"Error flushing change log: {e}")
+                with self.lock:
+                    self.groups = groups + self.groups
+                    self.rows += sum(len(group['changes']) for group in groups)
+                return 0
+
+    def _write(self, groups):
+        if not self.tables_ready:
+            self.tables_ready = self.service.create_change_log_tables()
+
+        rows = [
+            (group['use_case_id'], group['changed_at'], group['changed_by'], group['source'], op, path,
+             describe_path(group['after'] if op == 'set' else group['before'], path) if path else None,
+             None if old is None else json.dumps(old, default=str),
+             None if new is None else json.dumps(new, default=str))
+            for group in groups for op, path, old, new in group['changes']
+        ]
+        use_case_ids = sorted({group['use_case_id'] for group in groups})
+
+        with self.service.transaction() as cursor:
+            # Plans without a snapshot start from their state before the first change logged
+            cursor.execute(SNAPSHOT_STATE_SQL, {'use_case_ids': use_case_ids})
+            unsnapshotted = {row[0] for row in cursor.fetchall() if row[1] is None}
+            snapshots = {}
+            for group in groups:
+                use_case_id = group['use_case_id']
+                if use_case_id in unsnapshotted and use_case_id not in snapshots and group['before'] is not None:
+                    snapshots[use_case_id] = {
+                        'use_case_id': use_case_id,
+                        'taken_at': group['baseline_at'],
+                        'document': json.dumps(group['before'], default=str)
+                    }
+                if group['snapshot']:
+                    snapshots[(use_case_id, 'created')] = {
+                        'use_case_id': use_case_id,
+                        'taken_at': group['changed_at'],
+                        'document': json.dumps(group['after'], default=str)
+                    }
+            self.service.insert_rows(cursor, INSERT_SNAPSHOTS_SQL, SNAPSHOT_VALUES, list(snapshots.values()))
+            self.service.copy_rows(cursor, 'test.use_case_changes', CHANGE_COLUMNS, rows)
+
+            # Periodic snapshots bound how many changes a reconstruction replays
+            cursor.execute(SNAPSHOT_STATE_SQL, {'use_case_ids': use_case_ids})
+            due = {row[0] for row in cursor.fetchall() if row[2] >= SNAPSHOT_EVERY}
+            latest = {}
+            for group in groups:
+                if group['use_case_id'] in due and group['after'] is not None:
+                    latest[group['use_case_id']] = group
+            self.service.insert_rows(cursor, INSERT_SNAPSHOTS_SQL, SNAPSHOT_VALUES, [{
+                'use_case_id': use_case_id,
+                'taken_at': group['changed_at'],
+                'document': json.dumps(group['after'], default=str)
+            } for use_case_id, group in latest.items()])
+        return len(rows)
+
+
+_buffer = ChangeBuffer()
+atexit.register(_buffer.flush)
+
+
+def record_change(before, after, user_name, source):
+    """Log the difference between two versions of a use case document (either may be None)
+
+    Returns immediately; the rows are written by the background flush. A new
+    use case is logged as a 'create' row plus a snapshot, a deleted one as a
+    'delete' row.
+    """
+    if not Config.validate() or (before is None and after is None):
+        return 0
+
+    now = datetime.now()
+    use_case_id = (after or before)['use_case_id']
+    if before is None:
+        changes, snapshot = [('create', '', None, None)], True
+    elif after is None:
+        changes, snapshot = [('delete', '', None, None)], False
+    else:
+        changes, snapshot = diff_documents(before, after), False
+    if not changes:
+        return 0
+
+    _buffer.add({
+        'use_case_id': use_case_id,
+        'changed_at': now,
+        # Baseline snapshot (for plans older than the log) sits just before the change
+        'baseline_at': now - timedelta(microseconds=1),
+        'changed_by': user_name,
+        'source': source,
+        'changes': changes,
+        'snapshot': snapshot,
+        'before': json.loads(json.dumps(before, default=str)) if before is not None else None,
+        'after': json.loads(json.dumps(after, default=str)) if after is not None else None
+    })
+    return len(changes)
+
+
+def flush_changes():
+    """Write the buffered changes now; returns the number of rows written"""
+    return _buffer.flush()
+
+
+def _json_value(value):
+    """JSONB column value (drivers without a jsonb adapter return text)"""
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def reconstruct_use_case(use_case_id, as_of):
+    """The use case document as it was at as_of; None if it did not exist then
+
+    Starts from the latest snapshot at or before as_of and replays the
+    changes logged after it, at most about SNAPSHOT_EVERY rows.
+    """
+    snapshot = lakebase.query(LATEST_SNAPSHOT_SQL, {'use_case_id': use_case_id, 'as_of': as_of})
+    if not snapshot:
+        return None
+    taken_at, document = snapshot[0]
+    flat = flatten_document(_json_value(document))
+
+    changed_at = taken_at
+    for changed_at, op, path, new_value in lakebase.query(CHANGES_SINCE_SQL, {
+        'use_case_id': use_case_id, 'since': taken_at, 'as_of': as_of
+    }) or []:
+        if op == 'delete':
+            flat = None
+        elif op == 'set' and flat is not None:
+            flat[path] = _json_value(new_value)
+        elif op == 'remove' and flat is not None:
+            flat.pop(path, None)
+
+    if flat is None:
+        return None
+    document = unflatten_document(flat)
+    document['updated_at'] = changed_at.isoformat() if hasattr(changed_at, 'isoformat') else changed_at
+    return document
+
+
+def change_history(use_case_id, limit=200):
+    """The latest logged changes of a use case, newest first"""
+    rows = lakebase.query(HISTORY_SQL, {'use_case_id': use_case_id, 'limit': limit}) or []
+    columns = ['changed_at', 'changed_by', 'source', 'op', 'field', 'old_value', 'new_value']
+    return [dict(zip(columns, row[:5] + (_json_value(row[5]), _json_value(row[6])))) for row in rows]
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Use case change history")
+    parser.add_argument('use_case_id')
+    parser.add_argument('--as-of', type=datetime.fromisoformat, help="Print the plan as it was at this time")
+    parser.add_argument('--history', type=int, default=20, help="Number of latest changes to list")
+    args = parser.parse_args(argv)
+
+    lakebase.create_change_log_tables()
+    if args.as_of:
+        print(json.dumps(reconstruct_use_case(args.use_case_id, args.as_of), indent=2, default=str))
+    else:
+        for change in change_history(args.use_case_id, args.history):
+            print(f"{change['changed_at']:%Y-%m-%d %H:%M}  {change['changed_by'] or '':<16} "
+                  f"{change['op']:<6} {change['field'] or ''}: {change['old_value']!r} -> {change['new_value']!r}")
+    lakebase.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
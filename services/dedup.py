@@ -0,0 +1,167 @@
+"""
+Removal of duplicate activity rows left behind by repeated saves
+Walks test.use_case_maps a few use cases at a time along the use_case_id index, and within each
+use case keeps only the latest row (by updated_at) of every group of rows with the same content hash
+
+Usage:
+    python -m services.dedup [--dry-run] [--use-cases 100] [--max-rows 5000] [--pause 0.2]
+"""
+
+import argparse
+import sys
+import time
+
+from services.lakebase import lakebase
+from services.schema_migration import normalised_schema_active
+
+DEFAULT_USE_CASES_PER_BATCH = 100
+DEFAULT_MAX_ROWS = 5000
+
+# What makes two rows of a use case copies of each other: every activity field
+# matches (activities that legitimately repeat in a plan differ in their dates).
+# A row value's text form quotes empty strings and leaves NULLs empty, so NULL
+# and '' (and fields shifted between columns) hash differently
+CONTENT_HASH = """md5(ROW("Stage", COALESCE("Outcome", "Action"), "Embedded_Questions",
+                          "Owner_Name", "Start_Date", "End_Date", "Progress", "Notes")::text)"""
+
+# Next use case ids after a given one: a loose index scan (one index probe per id)
+# instead of a DISTINCT over the whole table; {table} is the wide table or the headers
+NEXT_USE_CASES_SQL = """
+    SELECT use_case_id
+    FROM (
+        WITH RECURSIVE ids AS (
+            (SELECT use_case_id FROM {table}
+             WHERE use_case_id > %(after)s
+             ORDER BY use_case_id LIMIT 1)
+            UNION ALL
+            SELECT (SELECT t.use_case_id FROM {table} t
+                    WHERE t.use_case_id > ids.use_case_id
+                    ORDER BY t.use_case_id LIMIT 1)
+            FROM ids
+            WHERE ids.use_case_id IS NOT NULL
+        )
+        SELECT use_case_id FROM ids
+    ) ids
+    WHERE use_case_id IS NOT NULL
+    LIMIT %(limit)s
+"""
+
+# Every row but the latest of each (use case, hash) group
+DUPLICATES_SQL = """
+    SELECT p_id, use_case_id
+    FROM (
+        SELECT p_id, use_case_id,
+               row_number() OVER (PARTITION BY use_case_id, {hash_key}
+                                  ORDER BY updated_at DESC NULLS LAST, p_id DESC) AS copy
+        FROM test.use_case_maps
+        WHERE use_case_id = ANY(%(use_case_ids)s)
+    ) d
+    WHERE copy > 1
+"""
+
+DRY_RUN_SQL = """
+    SELECT COUNT(*), COUNT(DISTINCT d.use_case_id), COALESCE(SUM(pg_column_size(m.*)), 0)
+    FROM ({duplicates}) d
+    JOIN test.use_case_maps m ON m.p_id = d.p_id AND m.use_case_id = d.use_case_id
+"""
+
+DELETE_SQL = """
+    DELETE FROM test.use_case_maps m
+    USING ({duplicates} LIMIT %(max_rows)s) d
+    WHERE m.p_id = d.p_id AND m.use_case_id = d.use_case_id
+"""
+
+# Heap plus index and TOAST bytes per heap byte, over all partitions
+SIZE_SQL = """
+    SELECT COALESCE(SUM(pg_total_relation_size(relid)), 0), COALESCE(SUM(pg_relation_size(relid)), 0)
+    FROM pg_partition_tree(%(table)s::regclass)
+"""
+
+
+def use_case_batches(batch_size):
+    """Yield lists of use case ids in index order"""
+    table = "test.use_cases" if normalised_schema_active() else "test.use_case_maps"
+    sql = NEXT_USE_CASES_SQL.format(table=table)
+    after = ''
+    while True:
+        use_case_ids = [row[0] for row in lakebase.query(sql, {'after': after, 'limit': batch_size}) or []]
+        if not use_case_ids:
+            return
+        yield use_case_ids
+        after = use_case_ids[-1]
+
+
+def storage_overhead():
+    """Bytes on disk (indexes and TOAST included) per byte of row data of the activity table"""
+    table = "test.use_case_activities" if normalised_schema_active() else "test.use_case_maps"
+    total, heap = lakebase.query(SIZE_SQL, {'table': table})[0]
+    return total / heap if heap else 1.0
+
+
+def deduplicate(dry_run=False, batch_size=DEFAULT_USE_CASES_PER_BATCH,
+                max_rows=DEFAULT_MAX_ROWS, pause=0.0, progress=None):
+    """Delete (or with dry_run, measure) the duplicate activity rows of every use case
+
+    Each transaction covers batch_size use cases and deletes at most max_rows
+    rows; pause sleeps after every transaction so the job can run next to
+    interactive traffic. Returns a report dict; row_bytes is the size of the
+    duplicate rows, estimated_bytes scales it by the table's index and TOAST
+    overhead.
+    """
+    lakebase.create_use_case_maps_table()
+    duplicates = DUPLICATES_SQL.format(hash_key=CONTENT_HASH)
+    report = {'use_cases_scanned': 0, 'use_cases': 0, 'rows': 0, 'row_bytes': 0, 'batches': 0}
+
+    for use_case_ids in use_case_batches(batch_size):
+        params = {'use_case_ids': use_case_ids, 'max_rows': max_rows}
+        report['use_cases_scanned'] += len(use_case_ids)
+        if dry_run:
+            rows, use_cases, row_bytes = lakebase.query(DRY_RUN_SQL.format(duplicates=duplicates), params)[0]
+            report['rows'] += rows
+            report['use_cases'] += use_cases
+            report['row_bytes'] += row_bytes
+        else:
+            deleted = max_rows
+            while deleted == max_rows:
+                with lakebase.transaction() as cursor:
+                    cursor.execute(DELETE_SQL.format(duplicates=duplicates), params)
+                    deleted = cursor.rowcount
+                report['rows'] += deleted
+                report['batches'] += 1
+                if pause:
+                    time.sleep(pause)
+        if progress:
+            progress(report)
+
+    report['estimated_bytes'] = int(report['row_bytes'] * storage_overhead()) if dry_run else None
+    return report
+
+
+def main(argv=None):
+    """Command line entry point (maintenance job, safe against a live database)"""
+    parser = argparse.ArgumentParser(description="Delete duplicate activity rows of test.use_case_maps")
+    parser.add_argument('--dry-run', action='store_true', help="Report the rows and bytes that would be reclaimed")
+    parser.add_argument('--use-cases', type=int, default=DEFAULT_USE_CASES_PER_BATCH,
+                        help="Use cases per batch")
+    parser.add_argument('--max-rows', type=int, default=DEFAULT_MAX_ROWS, help="Rows deleted per transaction")
+    parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between transactions")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    report = deduplicate(args.dry_run, args.use_cases, args.max_rows, args.pause,
+                         progress=lambda r: print(f"  {r['use_cases_scanned']} use cases scanned, "
+                                                  f"{r['rows']} duplicate rows", flush=True))
+    elapsed = time.perf_counter() - started
+    if args.dry_run:
+        print(f"{report['rows']} duplicate rows in {report['use_cases']} of {report['use_cases_scanned']} use cases "
+              f"would be deleted: {report['row_bytes'] / 1024 / 1024:.1f} MB of row data, about "
+              f"{report['estimated_bytes'] / 1024 / 1024:.1f} MB with indexes ({elapsed:.1f}s)")
+    else:
+        print(f"Deleted {report['rows']} duplicate rows from {report['use_cases_scanned']} use cases in "
+              f"{report['batches']} transactions ({elapsed:.1f}s); run VACUUM to make the space reusable")
+    lakebase.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
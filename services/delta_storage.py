@@ -0,0 +1,244 @@
+"""
+Template-delta storage for use cases
+A header row per use case plus one narrow row per activity that references the template
+activity by (template_version, activity_key) and stores only overrides and user-entered fields
+
+Usage:
+    python -m services.delta_storage [--report]
+"""
+
+import argparse
+import sys
+from datetime import datetime
+
+from plan_utils import plan_db_rows
+from services.lakebase import lakebase
+from services.template_compiler import activity_hash
+from services.template_store import get_template, stages_to_document, template_checksum
+
+INSERT_TEMPLATE_ACTIVITIES_SQL = """
+    INSERT INTO test.template_activities (
+        template_version, activity_key, position, "Stage", "Outcome", "Embedded_Questions", "Owner_Name"
+    ) VALUES %s
+    ON CONFLICT (template_version, activity_key) DO NOTHING
+"""
+
+TEMPLATE_ACTIVITY_VALUES = """(
+    %(template_version)s, %(activity_key)s, %(position)s, %(Stage)s, %(Outcome)s,
+    %(Embedded_Questions)s, %(Owner_Name)s
+)"""
+
+UPSERT_HEADER_SQL = """
+    INSERT INTO test.use_cases (
+        use_case_id, use_case_name, customer_name, solution_architect, account_executive,
+        ssa_required, poc_required, start_date, template_version,
+        created_by, created_at, updated_by, updated_at
+    ) VALUES (
+        %(use_case_id)s, %(use_case_name)s, %(customer_name)s, %(solution_architect)s, %(account_executive)s,
+        %(ssa_required)s, %(poc_required)s, %(start_date)s, %(template_version)s,
+        %(user_name)s, %(now)s, %(user_name)s, %(now)s
+    )
+    ON CONFLICT (use_case_id) DO UPDATE
+    SET use_case_name = EXCLUDED.use_case_name,
+        customer_name = EXCLUDED.customer_name,
+        solution_architect = EXCLUDED.solution_architect,
+        account_executive = EXCLUDED.account_executive,
+        ssa_required = EXCLUDED.ssa_required,
+        poc_required = EXCLUDED.poc_required,
+        start_date = EXCLUDED.start_date,
+        template_version = EXCLUDED.template_version,
+        updated_by = EXCLUDED.updated_by,
+        updated_at = EXCLUDED.updated_at
+"""
+
+INSERT_ACTIVITIES_SQL = """
+    INSERT INTO test.use_case_activities (
+        use_case_id, position, activity_key, "Stage", "Outcome", "Embedded_Questions",
+        "Owner_Name", "Start_Date", "End_Date", "Progress", "Notes"
+    ) VALUES %s
+"""
+
+ACTIVITY_VALUES = """(
+    %(use_case_id)s, %(position)s, %(activity_key)s, %(Stage)s, %(Outcome)s, %(Embedded_Questions)s,
+    %(Owner_Name)s, %(Start_Date)s, %(End_Date)s, %(Progress)s, %(Notes)s
+)"""
+
+SIZE_REPORT_SQL = """
+    SELECT relname, pg_total_relation_size(c.oid), c.reltuples::bigint
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'test'
+    AND relname IN ('use_case_maps', 'use_case_maps_wide', 'use_cases', 'use_case_activities', 'template_activities')
+    ORDER BY relname
+"""
+
+# Template versions already stored in test.template_activities by this process
+_synced_versions = set()
+_tables_ready = False
+
+
+def _ensure_tables():
+    """Create the delta storage tables and view once per process"""
+    global _tables_ready
+    if not _tables_ready:
+        _tables_ready = lakebase.create_delta_storage_tables()
+
+
+def substitute_owner(owner, solution_architect, account_executive):
+    """Template owner with SA/AE replaced by the plan's names, as the use case form does"""
+    if 'SA' in owner and solution_architect:
+        owner = owner.replace('SA', solution_architect)
+    if 'AE' in owner and account_executive:
+        owner = owner.replace('AE', account_executive)
+    return owner
+
+
+def template_activities(version, stages):
+    """{activity_key: row} of a template version as stored in test.template_activities"""
+    activities = {}
+    for stage_code, stage in stages.items():
+        for activity in stage['activities']:
+            key = activity_hash(stage_code, activity['outcome'])
+            activities.setdefault(key, {
+                'template_version': version,
+                'activity_key': key,
+                'position': len(activities),
+                'Stage': stage_code,
+                'Outcome': activity['outcome'],
+                'Embedded_Questions': activity.get('questions', ''),
+                'Owner_Name': activity.get('owner', '')
+            })
+    return activities
+
+
+def compiled_template_version(stages):
+    """Version recorded for plans saved against the compiled template
+
+    Derived from the template's content checksum and negative, so it never
+    meets a published version and a recompiled template (new questions or
+    owners) gets rows of its own instead of reusing the old text.
+    """
+    return -1 - int(template_checksum(stages_to_document(stages))[:7], 16)
+
+
+def current_template():
+    """(version, {activity_key: row}) of the current template"""
+    version, stages = get_template()
+    version = version or compiled_template_version(stages)
+    return version, template_activities(version, stages)
+
+
+def sync_template_activities(cursor, version, activities):
+    """Store a template version's activities (versions are immutable, existing rows are kept)
+
+    Call mark_template_synced once the transaction has committed.
+    """
+    if version not in _synced_versions:
+        lakebase.insert_rows(cursor, INSERT_TEMPLATE_ACTIVITIES_SQL, TEMPLATE_ACTIVITY_VALUES,
+                             list(activities.values()))
+
+
+def mark_template_synced(version):
+    """Skip storing this template version again in this process"""
+    _synced_versions.add(version)
+
+
+def activity_delta(use_case_data, activity, fields, stage_code, position, template):
+    """Narrow row for one activity: template reference plus the fields that differ from it
+
+    fields are the activity's activity_db_fields.
+    """
+    key = activity_hash(stage_code, activity['activity'])
+    known = template.get(key)
+
+    row = {
+        'use_case_id': use_case_data['use_case_id'],
+        'position': position,
+        'activity_key': key if known else None,
+        'Stage': None if known else stage_code,
+        'Outcome': None if known and known['Outcome'] == fields['Outcome'] else fields['Outcome'],
+        'Embedded_Questions': fields['Embedded_Questions'],
+        'Owner_Name': fields['Owner_Name'],
+        'Start_Date': fields['Start_Date'],
+        'End_Date': fields['End_Date'],
+        'Progress': fields['Progress'] or None,
+        'Notes': fields['Notes'] or None
+    }
+    if known:
+        if known['Embedded_Questions'] == fields['Embedded_Questions']:
+            row['Embedded_Questions'] = None
+        template_owner = substitute_owner(known['Owner_Name'], use_case_data.get('solution_architect', ''),
+                                          use_case_data.get('account_executive', ''))
+        if template_owner == fields['Owner_Name']:
+            row['Owner_Name'] = None
+    return row
+
+
+def save_use_case_delta(use_case_data, user_name):
+    """Save a use case in template-delta form; same contract as save_use_case_to_lakebase
+
+    One transaction upserts the header row and replaces the plan's activity
+    rows, which only carry overrides of the current template version.
+    Returns (success, message).
+    """
+    try:
+        lakebase.connect()
+        _ensure_tables()
+
+        version, template = current_template()
+
+        rows = [
+            activity_delta(use_case_data, activity, fields, stage_code, position, template)
+            for position, (stage_code, activity, fields) in enumerate(plan_db_rows(use_case_data))
+        ]
+
+        with lakebase.transaction() as cursor:
+            sync_template_activities(cursor, version, template)
+            cursor.execute(UPSERT_HEADER_SQL, {
+                'use_case_id': use_case_data['use_case_id'],
+                'use_case_name': use_case_data['name'],
+                'customer_name': use_case_data['customer'],
+                'solution_architect': use_case_data.get('solution_architect', ''),
+                'account_executive': use_case_data.get('account_executive', ''),
+                'ssa_required': use_case_data.get('ssa_required', False),
+                'poc_required': use_case_data.get('poc_happening', False),
+                'start_date': datetime.fromisoformat(use_case_data['start_date']).date(),
+                'template_version': version,
+                'user_name': user_name,
+                'now': datetime.now()
+            })
+            cursor.execute("DELETE FROM test.use_case_activities WHERE use_case_id = %s",
+                           (use_case_data['use_case_id'],))
+            lakebase.insert_rows(cursor, INSERT_ACTIVITIES_SQL, ACTIVITY_VALUES, rows)
+        mark_template_synced(version)
+
+        lakebase.close()
+        inherited = sum(1 for row in rows if row['activity_key'] is not None)
+        return True, f"Successfully saved {len(rows)} activities to database ({inherited} from template v{version})"
+
+    except Exception as e:
+        return False, f"Failed to save to database: {str(e)}"
+
+
+def storage_report():
+    """Total size (bytes, indexes and TOAST included) and estimated rows of the wide and delta tables"""
+    rows = lakebase.query(SIZE_REPORT_SQL) or []
+    return {row[0]: {'bytes': row[1], 'rows': row[2]} for row in rows}
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Template-delta storage maintenance")
+    parser.add_argument('--report', action='store_true', help="Compare the wide and delta table sizes")
+    args = parser.parse_args(argv)
+
+    lakebase.create_delta_storage_tables()
+    if args.report:
+        for table, size in storage_report().items():
+            print(f"test.{table:<22} {size['bytes'] / 1024 / 1024:>10.1f} MB {size['rows']:>12} rows")
+    lakebase.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+"""
+Plan-vs-template deviation analysis
+Aligns each plan's activity sequence with the template for its SSA/POC flags on hashed,
+normalised outcomes and reports missing, added and reordered activities per plan and in aggregate
+
+Usage:
+    python -m services.deviation [--local use_case_data/use_cases.json] [--dry-run] [--top 10]
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from plan_utils import normalize_stage_code
+from services.duration_stats import OUTCOME_KEY_SQL
+from services.lakebase import lakebase
+from services.template_compiler import activity_hash, outcome_key
+from services.template_store import get_template
+
+# Outcomes whose absence is reported separately in the aggregate
+EXIT_CRITERIA_KEY = 'exit criteria'
+
+DEVIATION_KINDS = ('missing', 'added', 'reordered')
+
+PLAN_ROWS_SQL = """
+    SELECT use_case_id, MAX(use_case_name) OVER w, MAX(customer_name) OVER w,
+           bool_or(ssa_required) OVER w, bool_or(poc_required) OVER w,
+           "Stage", "Outcome"
+    FROM test.use_case_maps
+    WHERE use_case_id IS NOT NULL AND use_case_id != '' AND "Stage" IS NOT NULL
+    WINDOW w AS (PARTITION BY use_case_id)
+    ORDER BY use_case_id, p_id
+"""
+
+INSERT_DEVIATIONS_SQL = """
+    INSERT INTO test.plan_deviations (
+        use_case_id, use_case_name, customer_name, template_version,
+        missing, added, reordered, conformance, details, analysed_at
+    ) VALUES %s
+"""
+
+DEVIATION_VALUES = """(
+    %(use_case_id)s, %(use_case_name)s, %(customer_name)s, %(template_version)s,
+    %(missing)s, %(added)s, %(reordered)s, %(conformance)s, %(details)s::jsonb, %(analysed_at)s
+)"""
+
+
+def _occurrence_keys(hashes):
+    """Pair every hash with its occurrence number so repeated activities align in order"""
+    seen = Counter()
+    keys = []
+    for value in hashes:
+        keys.append((value, seen[value]))
+        seen[value] += 1
+    return keys
+
+
+def expected_sequence(stages, ssa_required, poc_happening):
+    """(stage_code, outcome, conditional) of the template activities a plan with these flags starts with"""
+    return [
+        (stage_code, activity['outcome'], activity.get('conditional'))
+        for stage_code, stage in stages.items()
+        for activity in stage['activities']
+        if not (activity.get('conditional') == 'ssa' and not ssa_required)
+        and not (activity.get('conditional') == 'poc' and not poc_happening)
+    ]
+
+
+def compile_expected(stages):
+    """Hashed expected sequences for the four SSA/POC combinations"""
+    compiled = {}
+    for ssa_required, poc_happening in itertools.product((False, True), repeat=2):
+        sequence = expected_sequence(stages, ssa_required, poc_happening)
+        keys = _occurrence_keys(activity_hash(stage_code, outcome) for stage_code, outcome, _ in sequence)
+        compiled[(ssa_required, poc_happening)] = (sequence, keys, {key: idx for idx, key in enumerate(keys)})
+    return compiled
+
+
+def _longest_increasing(positions):
+    """Indexes (into positions) of one longest strictly increasing subsequence"""
+    tails, tail_idx, previous = [], [], [None] * len(positions)
+    for idx, value in enumerate(positions):
+        slot = bisect.bisect_left(tails, value)
+        if slot == len(tails):
+            tails.append(value)
+            tail_idx.append(idx)
+        else:
+            tails[slot] = value
+            tail_idx[slot] = idx
+        previous[idx] = tail_idx[slot - 1] if slot else None
+
+    result = []
+    idx = tail_idx[-1] if tail_idx else None
+    while idx is not None:
+        result.append(idx)
+        idx = previous[idx]
+    return set(result)
+
+
+def align_plan(plan_activities, expected):
+    """Deviation of one plan from its expected template sequence
+
+    plan_activities is [(stage_code, outcome)] in plan order, expected an entry
+    of compile_expected. Activities are matched on hash and occurrence in one
+    pass; the matched ones outside the longest run kept in template order are
+    the reordered ones (the fewest moves that restore the template order).
+    """
+    sequence, keys, position_of = expected
+    plan_keys = _occurrence_keys(activity_hash(stage_code, outcome) for stage_code, outcome in plan_activities)
+
+    matched, added = [], []
+    for plan_idx, key in enumerate(plan_keys):
+        if key in position_of:
+            matched.append((plan_idx, position_of[key]))
+        else:
+            added.append(plan_activities[plan_idx])
+
+    in_order = _longest_increasing([position for _, position in matched])
+    reordered = [plan_activities[plan_idx] for idx, (plan_idx, _) in enumerate(matched) if idx not in in_order]
+    found = {position for _, position in matched}
+    missing = [sequence[position] for position in range(len(sequence)) if position not in found]
+
+    return {
+        'template_activities': len(sequence),
+        'plan_activities': len(plan_activities),
+        'missing': [(stage_code, outcome) for stage_code, outcome, _ in missing],
+        'missing_poc': sum(1 for _, _, conditional in missing if conditional == 'poc'),
+        'added': added,
+        'reordered': reordered,
+        'conformance': round(len(in_order) / len(sequence), 3) if sequence else 1.0
+    }
+
+
+def analyse_portfolio(plans, stages):
+    """Align every plan; plans yields dicts with use_case_id, name, customer, ssa_required,
+    poc_happening and activities [(stage_code, outcome)]
+
+    Returns (per-plan results, aggregate). The most_* lists count plans:
+    activities are keyed on (stage, normalised outcome) and counted once per
+    plan, and labelled with the first outcome text seen for the key.
+    """
+    expected = compile_expected(stages)
+    results = []
+    counts = {kind: Counter() for kind in DEVIATION_KINDS}
+    labels = {}
+    for plan in plans:
+        result = align_plan(plan['activities'], expected[(bool(plan['ssa_required']), bool(plan['poc_happening']))])
+        result.update({key: plan[key] for key in ('use_case_id', 'name', 'customer')})
+        results.append(result)
+        for kind in DEVIATION_KINDS:
+            keys = set()
+            for stage_code, outcome in result[kind]:
+                key = (stage_code, outcome_key(outcome))
+                labels.setdefault(key, outcome)
+                keys.add(key)
+            counts[kind].update(keys)
+
+    def top(counter):
+        return [{'stage': key[0], 'activity': labels[key], 'plans': count} for key, count in counter.most_common()]
+
+    aggregate = {
+        'plans': len(results),
+        'conforming': sum(1 for result in results if not (result['missing'] or result['added'] or result['reordered'])),
+        'avg_conformance': round(sum(r['conformance'] for r in results) / len(results), 3) if results else 1.0,
+        'exit_criteria_skipped': sum(
+            1 for result in results
+            if any(EXIT_CRITERIA_KEY in outcome_key(outcome) for _, outcome in result['missing'])
+        ),
+        'poc_steps_removed': sum(1 for result in results if result['missing_poc']),
+        'with_custom_activities': sum(1 for result in results if result['added']),
+        'most_missing': top(counts['missing']),
+        'most_added': top(counts['added']),
+        'most_reordered': top(counts['reordered'])
+    }
+    return results, aggregate
+
+
+def lakebase_plans():
+    """Stream the plans of test.use_case_maps, one dict per use case, in p_id order"""
+    rows = lakebase.query(PLAN_ROWS_SQL) or []
+    for use_case_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+        group = list(group)
+        _, name, customer, ssa_required, poc_required, _, _ = group[0]
+        yield {
+            'use_case_id': use_case_id,
+            'name': name,
+            'customer': customer,
+            'ssa_required': ssa_required,
+            'poc_happening': poc_required,
+            'activities': [(row[5], row[6]) for row in group]
+        }
+
+
+def local_plans(use_cases):
+    """Plans of the local JSON store in the shape analyse_portfolio expects"""
+    for use_case in use_cases.values():
+        yield {
+            'use_case_id': use_case['use_case_id'],
+            'name': use_case.get('name'),
+            'customer': use_case.get('customer'),
+            'ssa_required': use_case.get('ssa_required', False),
+            'poc_happening': use_case.get('poc_happening', False),
+            'activities': [
+                (normalize_stage_code(stage['stage_name']), activity['activity'])
+                for stage in use_case.get('stages', []) for activity in stage['activities']
+            ]
+        }
+
+
+def store_deviations(results, template_version):
+    """Replace the stored deviation report with these results in one transaction"""
+    now = datetime.now()
+    rows = [{
+        'use_case_id': result['use_case_id'],
+        'use_case_name': result['name'],
+        'customer_name': result['customer'],
+        'template_version': template_version,
+        'missing': len(result['missing']),
+        'added': len(result['added']),
+        'reordered': len(result['reordered']),
+        'conformance': result['conformance'],
+        # [stage, outcome, normalised outcome] per activity
+        'details': json.dumps({
+            kind: [[stage_code, outcome, outcome_key(outcome)] for stage_code, outcome in result[kind]]
+            for kind in DEVIATION_KINDS
+        }),
+        'analysed_at': now
+    } for result in results]
+
+    with lakebase.transaction() as cursor:
+        cursor.execute("DELETE FROM test.plan_deviations")
+        lakebase.insert_rows(cursor, INSERT_DEVIATIONS_SQL, DEVIATION_VALUES, rows)
+    return len(rows)
+
+
+def load_deviations():
+    """Stored per-plan deviation counts, least conforming first"""
+    rows = lakebase.query("""
+        SELECT use_case_id, use_case_name, customer_name, template_version,
+               missing, added, reordered, conformance, analysed_at
+        FROM test.plan_deviations
+        ORDER BY conformance, use_case_id
+    """) or []
+    columns = ['use_case_id', 'use_case_name', 'customer', 'template_version',
+               'missing', 'added', 'reordered', 'conformance', 'analysed_at']
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def top_deviations(kind, limit=10):
+    """Activities most often missing, added or reordered in the stored report
+
+    Grouped like analyse_portfolio: by stage and normalised outcome, counting
+    plans. Reports stored before the key was recorded are normalised here.
+    """
+    if kind not in DEVIATION_KINDS:
+        raise ValueError(f"Unknown deviation kind: {kind}")
+    rows = lakebase.query(f"""
+        SELECT stage, MIN(outcome), COUNT(DISTINCT use_case_id)
+        FROM (
+            SELECT use_case_id, item->>0 AS stage, item->>1 AS outcome,
+                   COALESCE(item->>2, {OUTCOME_KEY_SQL.format(column="item->>1")}) AS key
+            FROM test.plan_deviations, jsonb_array_elements(details->'{kind}') item
+        ) items
+        GROUP BY stage, key
+        ORDER BY 3 DESC, 1, 2
+        LIMIT %(limit)s
+    """, {'limit': limit}) or []
+    return [{'stage': row[0], 'activity': row[1], 'plans': row[2]} for row in rows]
+
+
+def main(argv=None):
+    """Command line entry point (nightly batch job)"""
+    parser = argparse.ArgumentParser(description="Analyse how far plans deviate from the MAP template")
+    parser.add_argument('--local', help="Analyse a local use_cases.json instead of test.use_case_maps")
+    parser.add_argument('--dry-run', action='store_true', help="Print the report without storing it")
+    parser.add_argument('--top', type=int, default=10, help="Activities listed per aggregate")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    template_version, stages = get_template()
+    if args.local:
+        use_cases = json.loads(Path(args.local).read_text())
+        results, aggregate = analyse_portfolio(local_plans(use_cases), stages)
+    else:
+        lakebase.create_plan_deviations_table()
+        results, aggregate = analyse_portfolio(lakebase_plans(), stages)
+        if not args.dry_run:
+            store_deviations(results, template_version)
+        lakebase.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"{aggregate['plans']} plans against template v{template_version or 'built-in'} in {elapsed:.2f}s")
+    print(f"  conforming: {aggregate['conforming']}, average conformance: {aggregate['avg_conformance']:.0%}")
+    print(f"  exit criteria checks skipped: {aggregate['exit_criteria_skipped']} plans, "
+          f"POC steps removed: {aggregate['poc_steps_removed']} plans, "
+          f"custom activities: {aggregate['with_custom_activities']} plans")
+    for title, key in (("Most often missing", 'most_missing'), ("Most often added", 'most_added'),
+                       ("Most often reordered", 'most_reordered')):
+        if aggregate[key]:
+            print(f"{title}:")
+            for entry in aggregate[key][:args.top]:
+                print(f"  {entry['plans']:>5}  {entry['stage']}  {entry['activity']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
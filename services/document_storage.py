@@ -0,0 +1,235 @@
+"""
+Document storage for use cases
+Each use case is stored as its app document (stages -> activities) in one JSONB row of
+test.use_case_documents, so a save is one upsert and a load one primary-key read
+
+Usage:
+    python -m services.document_storage [--benchmark 50] [--activities 40]
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from datetime import date, datetime
+
+from services.delta_storage import save_use_case_delta
+from services.lakebase import lakebase
+from services.row_storage import load_use_case_rows, save_use_case_rows
+from services.template_store import get_template
+
+# Key of the document version kept in the app's use_case_data (not stored inside the document)
+VERSION_KEY = 'document_version'
+
+# Save refused because the stored version moved on; retrying cannot succeed
+CONFLICT_MESSAGE = "Failed to save to database: the use case was changed by someone else, reload it first"
+
+# Use case ids written (and removed again) by the benchmark
+BENCHMARK_PREFIX = 'BENCH-'
+
+# Insert, or overwrite when the stored version is still the one the caller loaded
+# (no expected version: last write wins); returns no row on a version conflict
+UPSERT_DOCUMENT_SQL = """
+    INSERT INTO test.use_case_documents (
+        use_case_id, version, document, created_by, created_at, updated_by, updated_at
+    ) VALUES (
+        %(use_case_id)s, 1, %(document)s::jsonb, %(user_name)s, %(now)s, %(user_name)s, %(now)s
+    )
+    ON CONFLICT (use_case_id) DO UPDATE
+    SET version = test.use_case_documents.version + 1,
+        document = EXCLUDED.document,
+        updated_by = EXCLUDED.updated_by,
+        updated_at = EXCLUDED.updated_at
+    WHERE %(expected_version)s::integer IS NULL
+    OR test.use_case_documents.version = %(expected_version)s::integer
+    RETURNING version
+"""
+
+LOAD_DOCUMENT_SQL = """
+    SELECT version, document
+    FROM test.use_case_documents
+    WHERE use_case_id = %(use_case_id)s
+"""
+
+_tables_ready = False
+
+
+def _ensure_tables():
+    """Create the documents table once per process"""
+    global _tables_ready
+    if not _tables_ready:
+        _tables_ready = lakebase.create_use_case_documents_table()
+
+
+def _json_default(value):
+    """Dates and timestamps of the document as ISO strings, like the local JSON store"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _document(value):
+    """JSONB column value as a dict (drivers without a jsonb adapter return text)"""
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def save_use_case_document(use_case_data, user_name):
+    """Save a use case as one JSONB document; same contract as save_use_case_to_lakebase
+
+    If use_case_data carries the version it was loaded at, the save only
+    succeeds while that is still the stored version. The new version is
+    written back to use_case_data. Returns (success, message).
+    """
+    try:
+        lakebase.connect()
+        _ensure_tables()
+
+        document = {key: value for key, value in use_case_data.items() if key != VERSION_KEY}
+        with lakebase.transaction() as cursor:
+            cursor.execute(UPSERT_DOCUMENT_SQL, {
+                'use_case_id': use_case_data['use_case_id'],
+                'document': json.dumps(document, default=_json_default),
+                'expected_version': use_case_data.get(VERSION_KEY),
+                'user_name': user_name,
+                'now': datetime.now()
+            })
+            result = cursor.fetchone()
+
+        lakebase.close()
+        if result is None:
+            return False, CONFLICT_MESSAGE
+        use_case_data[VERSION_KEY] = result[0]
+        activities = sum(len(stage['activities']) for stage in use_case_data['stages'])
+        return True, f"Successfully saved {activities} activities to database (version {result[0]})"
+
+    except Exception as e:
+        return False, f"Failed to save to database: {str(e)}"
+
+
+def load_use_case_document(use_case_id):
+    """The stored use case document with its version under VERSION_KEY; None if absent"""
+    rows = lakebase.query(LOAD_DOCUMENT_SQL, {'use_case_id': use_case_id})
+    if not rows:
+        return None
+    version, document = rows[0]
+    use_case_data = _document(document)
+    use_case_data[VERSION_KEY] = version
+    return use_case_data
+
+
+def find_use_case_documents(customer=None, owner=None, status=None):
+    """Stored use cases matching the given fields, newest first
+
+    Every filter is a JSONB containment test, answered from the GIN index.
+    """
+    filters = []
+    if customer:
+        filters.append({'customer': customer})
+    if owner:
+        filters.append({'stages': [{'activities': [{'owner': owner}]}]})
+    if status:
+        filters.append({'stages': [{'activities': [{'status': status}]}]})
+
+    where = ' AND '.join(['document @> %s::jsonb'] * len(filters)) or 'TRUE'
+    rows = lakebase.query(f"""
+        SELECT version, document
+        FROM test.use_case_documents
+        WHERE {where}
+        ORDER BY updated_at DESC
+    """, tuple(json.dumps(value) for value in filters)) or []
+
+    documents = []
+    for version, document in rows:
+        use_case_data = _document(document)
+        use_case_data[VERSION_KEY] = version
+        documents.append(use_case_data)
+    return documents
+
+
+def benchmark_use_case(use_case_id, activities):
+    """A synthetic plan with the given number of activities cycled from the current template"""
+    _, stages = get_template()
+    template = [(stage_code, activity) for stage_code, stage in stages.items() for activity in stage['activities']]
+    plan_stages = {}
+    for idx in range(activities):
+        stage_code, activity = template[idx % len(template)]
+        plan_stages.setdefault(stage_code, []).append({
+            'activity': activity['outcome'],
+            'description': activity.get('questions', ''),
+            'owner': activity.get('owner', ''),
+            'duration_days': 5,
+            'status': 'Not Started',
+            'notes': f"Benchmark activity {idx}"
+        })
+    return {
+        'use_case_id': use_case_id,
+        'user_id': 'benchmark',
+        'name': f"Benchmark plan {use_case_id}",
+        'customer': 'Benchmark',
+        'solution_architect': 'Benchmark SA',
+        'account_executive': 'Benchmark AE',
+        'start_date': date.today().isoformat(),
+        'ssa_required': True,
+        'poc_happening': True,
+        'status': 'Planning',
+        'stages': [{'stage_name': stage_code, 'activities': acts} for stage_code, acts in plan_stages.items()]
+    }
+
+
+def run_benchmark(plans, activities):
+    """Median save and load milliseconds of each layout for plans of the given size"""
+    layouts = {
+        'rows': (save_use_case_rows, load_use_case_rows),
+        'delta': (save_use_case_delta,
+                  lambda use_case_id: load_use_case_rows(use_case_id, 'test.use_case_maps_expanded')),
+        'document': (save_use_case_document, load_use_case_document)
+    }
+    results = {}
+    try:
+        for layout, (save, load) in layouts.items():
+            saves, loads = [], []
+            for idx in range(plans):
+                use_case = benchmark_use_case(f"{BENCHMARK_PREFIX}{layout.upper()}-{idx:05d}", activities)
+                started = time.perf_counter()
+                success, message = save(use_case, 'benchmark')
+                saves.append(time.perf_counter() - started)
+                if not success:
+                    raise RuntimeError(message)
+
+                lakebase.connect()
+                started = time.perf_counter()
+                load(use_case['use_case_id'])
+                loads.append(time.perf_counter() - started)
+            results[layout] = (statistics.median(saves) * 1000, statistics.median(loads) * 1000)
+    finally:
+        lakebase.connect()
+        pattern = {'pattern': f"{BENCHMARK_PREFIX}%"}
+        lakebase.query("DELETE FROM test.use_case_maps WHERE use_case_id LIKE %(pattern)s", pattern)
+        lakebase.query("DELETE FROM test.use_cases WHERE use_case_id LIKE %(pattern)s", pattern)
+        lakebase.query("DELETE FROM test.use_case_documents WHERE use_case_id LIKE %(pattern)s", pattern)
+    return results
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="JSONB document storage for use cases")
+    parser.add_argument('--benchmark', type=int, metavar='PLANS',
+                        help="Save and load this many plans in each storage layout")
+    parser.add_argument('--activities', type=int, default=40, help="Activities per benchmark plan")
+    args = parser.parse_args(argv)
+
+    lakebase.create_use_case_documents_table()
+    if args.benchmark:
+        lakebase.create_use_case_maps_table()
+        lakebase.create_delta_storage_tables()
+        results = run_benchmark(args.benchmark, args.activities)
+        print(f"{args.benchmark} plans of {args.activities} activities, median per plan:")
+        for layout, (save_ms, load_ms) in results.items():
+            print(f"  {layout:<9} save {save_ms:>8.1f}ms  load {load_ms:>8.1f}ms")
+    lakebase.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Historical activity duration estimates
+Per-outcome median/P80 durations (by stage, overall and per customer) computed with
+percentile_cont from test.maps and test.use_case_maps into test.activity_duration_stats,
+refreshed incrementally after saves (or by this job) and read through an in-process cache
+for prefilling new plans
+
+Usage:
+    python -m services.duration_stats [--full]
+"""
+
+import argparse
+import sys
+import threading
+import time
+from datetime import datetime
+
+from config import Config
+from services.lakebase import lakebase
+from services.template_compiler import outcome_key
+
+DEFAULT_DURATION_DAYS = 5
+
+# Per-customer statistics are only trusted with this many samples
+MIN_SEGMENT_SAMPLES = 3
+
+# Segment holding the statistics over all customers
+ALL_SEGMENTS = '*'
+
+CACHE_TTL_SECONDS = 300
+
+# Saves refresh the statistics at most this often per process
+REFRESH_INTERVAL_SECONDS = 300
+
+# SQL twin of template_compiler.outcome_key
+OUTCOME_KEY_SQL = "trim(regexp_replace(lower({column}), '[^a-z0-9]+', ' ', 'g'))"
+
+# Keys touched since the last refresh are recomputed from all of their samples;
+# a full refresh recomputes everything
+REFRESH_SQL = f"""
+    INSERT INTO test.activity_duration_stats
+        (stage, outcome_key, segment, samples, median_days, p80_days, refreshed_at)
+    SELECT stage, outcome_key,
+           CASE WHEN GROUPING(segment) = 1 THEN '{ALL_SEGMENTS}' ELSE segment END,
+           COUNT(*),
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY days),
+           percentile_cont(0.8) WITHIN GROUP (ORDER BY days),
+           %(now)s
+    FROM (
+        SELECT "Stage" AS stage,
+               {OUTCOME_KEY_SQL.format(column='COALESCE("Outcome", "Action")')} AS outcome_key,
+               '' AS segment,
+               "End_Date" - "Start_Date" AS days
+        FROM test.maps
+        WHERE "Stage" IS NOT NULL AND "Start_Date" IS NOT NULL AND "End_Date" IS NOT NULL
+        UNION ALL
+        SELECT "Stage",
+               {OUTCOME_KEY_SQL.format(column='"Outcome"')},
+               COALESCE(customer_name, ''),
+               "End_Date" - "Start_Date"
+        FROM test.use_case_maps
+        WHERE "Stage" IS NOT NULL AND "Start_Date" IS NOT NULL AND "End_Date" IS NOT NULL
+    ) samples
+    WHERE days > 0
+    AND (%(full)s OR (stage, outcome_key) IN (
+        SELECT "Stage", {OUTCOME_KEY_SQL.format(column='"Outcome"')}
+        FROM test.use_case_maps
+        WHERE updated_at > %(since)s
+    ))
+    GROUP BY GROUPING SETS ((stage, outcome_key, segment), (stage, outcome_key))
+    ON CONFLICT (stage, outcome_key, segment) DO UPDATE
+    SET samples = EXCLUDED.samples,
+        median_days = EXCLUDED.median_days,
+        p80_days = EXCLUDED.p80_days,
+        refreshed_at = EXCLUDED.refreshed_at
+"""
+
+# LATERAL join giving the estimated days ("days" column) for an activity inside
+# set-based SQL: the customer's own statistics when trusted, else the overall ones
+ESTIMATE_JOIN_SQL = f"""
+    LEFT JOIN LATERAL (
+        SELECT GREATEST(round(ds.median_days)::int, 1) AS days
+        FROM test.activity_duration_stats ds
+        WHERE ds.stage = {{stage}}
+        AND ds.outcome_key = {OUTCOME_KEY_SQL.format(column='{outcome}')}
+        AND (ds.segment = '{ALL_SEGMENTS}' OR (ds.segment = {{customer}} AND ds.samples >= {MIN_SEGMENT_SAMPLES}))
+        ORDER BY ds.segment = '{ALL_SEGMENTS}'
+        LIMIT 1
+    ) {{alias}} ON TRUE
+"""
+
+_stats_cache = {'loaded_at': 0.0, 'stats': {}}
+_cache_lock = threading.Lock()
+_refresh_state = {'refreshed_at': 0.0}
+_refresh_lock = threading.Lock()
+
+
+def estimate_join(stage, outcome, customer, alias='estimate'):
+    """ESTIMATE_JOIN_SQL for the given SQL expressions"""
+    return ESTIMATE_JOIN_SQL.format(stage=stage, outcome=outcome, customer=customer, alias=alias)
+
+
+def refresh_duration_stats(full=False):
+    """Recompute the statistics of outcomes changed since the last refresh (or all); returns rows written"""
+    lakebase.create_use_case_maps_table()
+    result = lakebase.query("SELECT MAX(refreshed_at) FROM test.activity_duration_stats")
+    since = result[0][0] if result and result[0][0] else None
+    return lakebase.query(REFRESH_SQL, {
+        'now': datetime.now(),
+        'full': full or since is None,
+        'since': since or datetime.min
+    })
+
+
+def refresh_after_save():
+    """Incremental refresh from the save path, at most every REFRESH_INTERVAL_SECONDS
+
+    Saves run on the outbox worker thread, so this never delays a page
+    render; schedule the command line job to cover quiet periods.
+    """
+    with _refresh_lock:
+        if time.monotonic() - _refresh_state['refreshed_at'] < REFRESH_INTERVAL_SECONDS:
+            return
+        _refresh_state['refreshed_at'] = time.monotonic()
+    try:
+        refresh_duration_stats()
+    except Exception as e:
+        print(f"Error refreshing duration statistics: {e}")
+
+
+def load_duration_stats():
+    """Read the whole lookup table: (stage, outcome_key, segment) -> (samples, median, p80)"""
+    rows = lakebase.query("""
+        SELECT stage, outcome_key, segment, samples, median_days, p80_days
+        FROM test.activity_duration_stats
+    """) or []
+    return {(row[0], row[1], row[2]): (row[3], float(row[4]), float(row[5])) for row in rows}
+
+
+def get_duration_stats():
+    """Cached duration statistics, re-read at most every CACHE_TTL_SECONDS
+
+    Only reads test.activity_duration_stats (refreshing is left to saves and
+    the job). Returns an empty dict without a database (callers fall back to
+    the default).
+    """
+    with _cache_lock:
+        if time.monotonic() - _stats_cache['loaded_at'] < CACHE_TTL_SECONDS:
+            return _stats_cache['stats']
+
+        if Config.validate():
+            try:
+                _stats_cache['stats'] = load_duration_stats()
+            except Exception as e:
+                print(f"Error loading duration statistics: {e}")
+        _stats_cache['loaded_at'] = time.monotonic()
+        return _stats_cache['stats']
+
+
+def estimate_activity(stats, stage_code, outcome, customer=None):
+    """Prefilled duration fields for an activity from the statistics
+
+    Returns {'duration_days': median} plus a schedule-risk 'estimate' with the
+    P80 as the pessimistic duration when the history shows a spread, or the
+    default duration when the outcome has no history.
+    """
+    key = outcome_key(outcome)
+    found = stats.get((stage_code, key, customer or ''))
+    if not found or found[0] < MIN_SEGMENT_SAMPLES:
+        found = stats.get((stage_code, key, ALL_SEGMENTS))
+    if not found:
+        return {'duration_days': DEFAULT_DURATION_DAYS}
+
+    _, median, p80 = found
+    duration = max(round(median), 1)
+    fields = {'duration_days': duration}
+    if round(p80) > duration:
+        fields['estimate'] = {'distribution': 'triangular', 'pessimistic_days': round(p80)}
+    return fields
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Refresh the activity duration statistics")
+    parser.add_argument('--full', action='store_true', help="Recompute every outcome, not just changed ones")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    written = refresh_duration_stats(full=args.full)
+    lakebase.close()
+    print(f"Refreshed {written} duration statistics in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Plan export service for Databricks Use Case Plans app
+Exports are generated on request with streaming writers and cached on disk
+by a content hash of the plan, so unchanged plans are never serialised twice
+"""
+
+import csv
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+from plan_utils import build_plan_rows
+from template_structure import USE_CASE_COLUMNS
+from services.xlsx_export import XLSX_AVAILABLE, write_xlsx, write_map_workbook
+
+
+def plan_content_hash(use_case):
+    """SHA-256 of the plan document, hashed chunk by chunk as it is encoded"""
+    digest = hashlib.sha256()
+    encoder = json.JSONEncoder(sort_keys=True, default=str)
+    for chunk in encoder.iterencode(use_case):
+        digest.update(chunk.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _write_delimited(use_case, path, delimiter):
+    """Write plan rows one at a time as delimited text"""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=USE_CASE_COLUMNS, delimiter=delimiter,
+                                extrasaction='ignore')
+        writer.writeheader()
+        for row in build_plan_rows(use_case):
+            writer.writerow(row)
+
+
+def write_csv(use_case, path):
+    """Write the plan as CSV"""
+    _write_delimited(use_case, path, ',')
+
+
+def write_tsv(use_case, path):
+    """Write the plan as tab-separated values"""
+    _write_delimited(use_case, path, '\t')
+
+
+def write_json(use_case, path):
+    """Write the plan as a JSON array of rows, one row at a time"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for idx, row in enumerate(build_plan_rows(use_case)):
+            if idx:
+                f.write(',')
+            f.write('\n')
+            json.dump(row, f, default=str)
+        f.write('\n]\n')
+
+
+# Supported export formats, in the order they are offered in the UI
+EXPORT_FORMATS = {
+    "CSV": {"extension": "csv", "mime": "text/csv", "writer": write_csv},
+    "TSV": {"extension": "tsv", "mime": "text/tab-separated-values", "writer": write_tsv},
+    "JSON": {"extension": "json", "mime": "application/json", "writer": write_json},
+}
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+if XLSX_AVAILABLE:
+    EXPORT_FORMATS["XLSX"] = {"extension": "xlsx", "mime": XLSX_MIME, "writer": write_xlsx}
+
+
+def _cached_export(cache_dir, prefix, content_hash, extension, write):
+    """Return the cached export path, calling write(path) only on a cache miss"""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    path = cache_dir / f"{prefix}{content_hash}.{extension}"
+    if path.exists():
+        return path
+
+    # Write to a temporary file first so a failed export never poisons the cache
+    tmp_path = path.with_name(f"{prefix}{content_hash}.tmp.{extension}")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+    # Only exact {prefix}{hash}.{extension} names: the glob also matches plans
+    # whose id starts with this one, and temporary files
+    stale_name = re.compile(re.escape(prefix) + f"[0-9a-f]{{{len(content_hash)}}}" + re.escape(f".{extension}"))
+    for stale in cache_dir.glob(f"{prefix}*.{extension}"):
+        if stale != path and stale_name.fullmatch(stale.name):
+            try:
+                stale.unlink()
+            except OSError:
+                pass
+
+    return path
+
+
+def export_plan(use_case, export_format, cache_dir):
+    """Return the path of an export of the plan, generating it only on a cache miss
+
+    Files are named {use_case_id}_{hash}.{ext}; older exports of the same plan
+    and format are removed once a new one has been written.
+    """
+    spec = EXPORT_FORMATS[export_format]
+    return _cached_export(
+        cache_dir,
+        f"{use_case['use_case_id']}_",
+        plan_content_hash(use_case)[:16],
+        spec['extension'],
+        lambda path: spec['writer'](use_case, path)
+    )
+
+
+def export_portfolio_xlsx(use_cases, portfolio_name, cache_dir):
+    """Return the path of a workbook with one MAP sheet per plan
+
+    Cached by the combined content hash of the plans, in the order given.
+    """
+    digest = hashlib.sha256()
+    for use_case in use_cases:
+        digest.update(plan_content_hash(use_case).encode('utf-8'))
+
+    safe_name = ''.join(c if c.isalnum() else '-' for c in portfolio_name)[:40] or 'portfolio'
+    return _cached_export(
+        cache_dir,
+        f"portfolio_{safe_name}_",
+        digest.hexdigest()[:16],
+        "xlsx",
+        lambda path: write_map_workbook(use_cases, path)
+    )
@@ -0,0 +1,182 @@
+"""
+Gantt timelines for single plans and whole portfolios
+Bars come from plan_utils.build_plan_rows, are culled to the visible date window and
+rolled up to stage or use case level when there are too many, then drawn as WebGL lines
+"""
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from plan_utils import build_plan_rows
+
+STATUS_COLORS = {
+    "Not Started": "#9AA5B1",
+    "In Progress": "#1B5E9E",
+    "Completed": "#00A972",
+    "Blocked": "#FF3621",
+    "On Hold": "#FFAB00"
+}
+
+# Levels of detail, finest first
+LOD_LEVELS = ["activity", "stage", "use_case"]
+
+# Above this many bars the chart rolls up to a coarser level of detail
+DEFAULT_MAX_BARS = 5000
+
+# Lanes beyond this are drawn without tick labels
+MAX_LABELLED_LANES = 60
+
+
+def gantt_frame(use_cases, portfolio=False):
+    """One row per activity bar: Lane, Use Case, Stage, Activity, Owner, Status, Start, End
+
+    A single plan gets one lane per activity (ordered by stage); a portfolio
+    gets one lane per use case with its activities laid end to end.
+    """
+    records = []
+    for use_case in use_cases:
+        label = f"{use_case['use_case_id']} • {use_case.get('customer', '')}"
+        for idx, row in enumerate(build_plan_rows(use_case)):
+            lane = label if portfolio else f"{row['ID']} · {idx + 1}. {row['Activity'][:40]}"
+            records.append((lane, label, row['ID'], row['Activity'], row['Owner'],
+                            row['Status'], row['Start Date'], row['End Date']))
+
+    frame = pd.DataFrame.from_records(
+        records,
+        columns=['Lane', 'Use Case', 'Stage', 'Activity', 'Owner', 'Status', 'Start', 'End']
+    )
+    frame['Start'] = pd.to_datetime(frame['Start'])
+    frame['End'] = pd.to_datetime(frame['End'])
+    return frame
+
+
+def window_frame(frame, window_start=None, window_end=None):
+    """Drop bars that fall entirely outside the visible date window"""
+    mask = np.ones(len(frame), dtype=bool)
+    if window_start is not None:
+        mask &= (frame['End'] >= pd.Timestamp(window_start)).to_numpy()
+    if window_end is not None:
+        mask &= (frame['Start'] <= pd.Timestamp(window_end)).to_numpy()
+    return frame[mask]
+
+
+def _rollup_status(statuses):
+    """Status of a rolled-up bar: blocked wins, then all-completed / all-not-started"""
+    values = set(statuses)
+    for status in ("Blocked", "On Hold"):
+        if status in values:
+            return status
+    if len(values) == 1:
+        return values.pop()
+    return "In Progress"
+
+
+def rollup_frame(frame, level, portfolio=False):
+    """Aggregate activity bars to the given level of detail
+
+    'stage' merges each use case's stage into one bar, 'use_case' merges the
+    whole plan. Rolled-up bars carry the number of activities they contain.
+    """
+    if level == "activity" or frame.empty:
+        return frame.assign(Activities=1)
+
+    keys = ['Use Case', 'Stage'] if level == "stage" else ['Use Case']
+    rolled = frame.groupby(keys, sort=False).agg(
+        Lane=('Lane', 'first'),
+        Start=('Start', 'min'),
+        End=('End', 'max'),
+        Status=('Status', _rollup_status),
+        Owner=('Owner', lambda owners: ', '.join(sorted(set(filter(None, owners)))[:3])),
+        Activities=('Activity', 'size')
+    ).reset_index()
+
+    if level == "stage":
+        rolled['Activity'] = rolled['Stage'] + " (" + rolled['Activities'].astype(str) + " activities)"
+        if not portfolio:
+            rolled['Lane'] = rolled['Stage']
+    else:
+        rolled['Stage'] = ''
+        rolled['Activity'] = rolled['Activities'].astype(str) + " activities"
+    return rolled
+
+
+def choose_level(frame, max_bars=DEFAULT_MAX_BARS, portfolio=False):
+    """Finest level of detail that keeps the bar count within max_bars"""
+    if len(frame) <= max_bars:
+        return "activity"
+    stage_bars = len(frame.drop_duplicates(['Use Case', 'Stage']))
+    if stage_bars <= max_bars or not portfolio:
+        return "stage"
+    return "use_case"
+
+
+def _segments(bars):
+    """Interleave bars into x/y arrays with None gaps so one trace draws them all"""
+    count = len(bars)
+    x = np.empty(count * 3, dtype=object)
+    x[0::3] = bars['Start'].dt.to_pydatetime()
+    x[1::3] = bars['End'].dt.to_pydatetime()
+    x[2::3] = None
+    y = np.empty(count * 3, dtype=object)
+    y[0::3] = y[1::3] = bars['Lane'].to_numpy()
+    y[2::3] = None
+
+    hover = (bars['Use Case'] + "<br>" + bars['Activity'] + "<br>" + bars['Owner'].fillna('')
+             + "<br>" + bars['Start'].dt.strftime('%Y-%m-%d') + " → " + bars['End'].dt.strftime('%Y-%m-%d')).to_numpy()
+    text = np.empty(count * 3, dtype=object)
+    text[0::3] = text[1::3] = hover
+    text[2::3] = None
+    return x, y, text
+
+
+def gantt_figure(bars, title=None):
+    """Build the WebGL Gantt figure: one Scattergl line trace per status"""
+    lanes = list(dict.fromkeys(bars['Lane']))
+    bar_width = max(2, min(18, 600 // max(len(lanes), 1)))
+
+    fig = go.Figure()
+    for status, color in STATUS_COLORS.items():
+        status_bars = bars[bars['Status'] == status]
+        if status_bars.empty:
+            continue
+        x, y, text = _segments(status_bars)
+        fig.add_trace(go.Scattergl(
+            x=x, y=y, text=text,
+            mode='lines',
+            line={'color': color, 'width': bar_width},
+            name=status,
+            hoverinfo='text',
+            connectgaps=False
+        ))
+
+    fig.update_layout(
+        title=title,
+        height=min(max(300, 22 * len(lanes) + 120), 1200),
+        margin={'l': 10, 'r': 10, 't': 40 if title else 10, 'b': 10},
+        legend={'orientation': 'h', 'y': 1.02, 'x': 0},
+        xaxis={'type': 'date'},
+        yaxis={
+            'type': 'category',
+            'categoryorder': 'array',
+            'categoryarray': lanes,
+            'autorange': 'reversed',
+            'showticklabels': len(lanes) <= MAX_LABELLED_LANES
+        }
+    )
+    return fig
+
+
+def build_gantt(use_cases, portfolio=False, window=None, level="auto", max_bars=DEFAULT_MAX_BARS):
+    """Compute the Gantt figure for one or many use cases
+
+    Returns (figure, level, bar_count); level 'auto' picks the finest level
+    of detail that fits max_bars bars in the date window.
+    """
+    frame = gantt_frame(use_cases, portfolio)
+    if window:
+        frame = window_frame(frame, *window)
+    if level == "auto":
+        level = choose_level(frame, max_bars, portfolio)
+    bars = rollup_frame(frame, level, portfolio)
+    return gantt_figure(bars), level, len(bars)
@@ -4,6 +4,10 @@ Supports multiple PostgreSQL drivers for better Databricks compatibility
 Based on the EasyJet app architecture with enhancements
 """
 
+import io
+import threading
+from contextlib import contextmanager
+
 from config import config
 
 # Try to import PostgreSQL drivers in order of preference
@@ -36,11 +40,30 @@ if not POSTGRES_DRIVER:
     except ImportError:
         pass
 
+def _csv_field(value):
+    """One COPY CSV field: NULL as an unquoted \\N, everything else quoted text"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '"' + str(value).replace('"', '""') + '"'
+
 class LakebaseService:
     def __init__(self):
-        self.connection = None
+        # One connection per thread: background workers (save outbox, change log)
+        # run next to the Streamlit script and must not share its transactions
+        self._local = threading.local()
         self.driver_info = f"Using driver: {POSTGRES_DRIVER}" if POSTGRES_DRIVER else "No PostgreSQL driver available"
 
+    @property
+    def connection(self):
+        """This thread's connection (None until connect)"""
+        return getattr(self._local, 'connection', None)
+
+    @connection.setter
+    def connection(self, value):
+        self._local.connection = value
+
     def _is_connection_closed(self):
         """Check if connection is closed, handling different driver APIs"""
         if self.connection is None:
@@ -126,6 +149,74 @@ class LakebaseService:
                     pass
             raise Exception(f"Batch execution failed ({POSTGRES_DRIVER}): {e}")
 
+    @contextmanager
+    def transaction(self, commit=True):
+        """Run several statements in one transaction, yielding a cursor
+
+        Commits when the block exits normally and rolls back on any error.
+        With commit=False the transaction is always rolled back (dry runs).
+        """
+        if not self.connect():
+            raise Exception("Database connection not available")
+
+        cursor = self.connection.cursor()
+        try:
+            yield cursor
+            if commit:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        except Exception as e:
+            try:
+                self.connection.rollback()
+            except:
+                pass
+            raise Exception(f"Transaction failed ({POSTGRES_DRIVER}): {e}")
+        finally:
+            try:
+                cursor.close()
+            except:
+                pass
+
+    def insert_rows(self, cursor, insert_sql, values_template, rows):
+        """Insert many rows through an open cursor
+
+        Uses psycopg2's multi-row execute_values when available and falls back
+        to executemany for the other drivers. insert_sql must end with VALUES %s
+        and values_template is the per-row placeholder tuple, e.g. (%(a)s, %(b)s).
+        """
+        if not rows:
+            return 0
+
+        if POSTGRES_DRIVER == "psycopg2":
+            from psycopg2.extras import execute_values
+            execute_values(cursor, insert_sql, rows, template=values_template, page_size=1000)
+        else:
+            cursor.executemany(insert_sql.replace("%s", values_template), rows)
+        return len(rows)
+
+    def copy_rows(self, cursor, table, columns, rows):
+        """Bulk load rows (value sequences in column order) through an open cursor with COPY
+
+        psycopg2 streams the CSV through copy_expert and pg8000 through
+        execute(stream=...); other drivers fall back to executemany.
+        """
+        if not rows:
+            return 0
+
+        column_list = ', '.join(columns)
+        if POSTGRES_DRIVER in ("psycopg2", "pg8000"):
+            data = io.StringIO(''.join(','.join(_csv_field(value) for value in row) + '\n' for row in rows))
+            copy_sql = f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+            if POSTGRES_DRIVER == "psycopg2":
+                cursor.copy_expert(copy_sql, data)
+            else:
+                cursor.execute(copy_sql, stream=data)
+        else:
+            placeholders = ', '.join(['%s'] * len(columns))
+            cursor.executemany(f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})", rows)
+        return len(rows)
+
     def create_tables(self):
         """Create the necessary tables for use case plans"""
         try:
@@ -189,6 +280,19 @@ class LakebaseService:
                 )
             """)
 
+            # Templates are versioned documents validated by checksum
+            self.query("""
+                ALTER TABLE use_case_plans.templates
+                ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1,
+                ADD COLUMN IF NOT EXISTS checksum TEXT,
+                ADD COLUMN IF NOT EXISTS created_by TEXT
+            """)
+
+            self.query("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_templates_name_version
+                ON use_case_plans.templates(name, version)
+            """)
+
             return True
 
         except Exception as e:
@@ -196,17 +300,270 @@ class LakebaseService:
             return False
 
     def create_use_case_maps_table(self):
-        """Create test.use_case_maps table for storing app-created use cases"""
+        """Create test.use_case_maps table for storing app-created use cases
+
+        Once test.use_case_maps is the normalised compatibility view only the
+        tables alongside it are created.
+        """
         try:
             if not self.connect():
                 return False
 
-            # Create use_case_maps table matching the structure of test.maps
-            # but with additional audit fields
-            # Note: Assuming test schema already exists
+            # After schema_migration switch test.use_case_maps is the view over
+            # the normalised tables, which have their own indexes
+            from services.schema_migration import normalised_schema_active
+            if not normalised_schema_active():
+                # Create use_case_maps table matching the structure of test.maps
+                # but with additional audit fields
+                # Note: Assuming test schema already exists
+                self.query("""
+                    CREATE TABLE IF NOT EXISTS test.use_case_maps (
+                        p_id BIGSERIAL PRIMARY KEY,
+                        use_case_id TEXT NOT NULL,
+                        use_case_name TEXT,
+                        customer_name TEXT,
+                        "Stage" TEXT,
+                        "Outcome" TEXT,
+                        "Embedded_Questions" TEXT,
+                        "Owner_Name" TEXT,
+                        "Start_Date" DATE,
+                        "End_Date" DATE,
+                        "Progress" DOUBLE PRECISION,
+                        "Notes" TEXT,
+                        "Action" TEXT,
+                        solution_architect TEXT,
+                        account_executive TEXT,
+                        ssa_required BOOLEAN DEFAULT FALSE,
+                        poc_required BOOLEAN DEFAULT FALSE,
+                        created_by TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_by TEXT,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        position INTEGER
+                    )
+                """)
+
+                # Tables created before rows stored their position in the plan
+                self.query("""
+                    ALTER TABLE test.use_case_maps ADD COLUMN IF NOT EXISTS position INTEGER
+                """)
+
+                # Create index on use_case_id for faster lookups
+                self.query("""
+                    CREATE INDEX IF NOT EXISTS idx_use_case_id
+                    ON test.use_case_maps(use_case_id)
+                """)
+
+                # Create index on customer_name for faster filtering
+                self.query("""
+                    CREATE INDEX IF NOT EXISTS idx_customer_name
+                    ON test.use_case_maps(customer_name)
+                """)
+
+                # GiST index on the activity date range for due/overdue/in-window queries
+                # (LEAST/GREATEST so imported rows with reversed dates cannot break inserts)
+                self.query("""
+                    CREATE INDEX IF NOT EXISTS idx_use_case_maps_date_range
+                    ON test.use_case_maps USING GIST (
+                        daterange(LEAST("Start_Date", "End_Date"), GREATEST("Start_Date", "End_Date"), '[]')
+                    )
+                """)
+
+            # Historical duration statistics per stage/outcome, overall ('*') and per customer
             self.query("""
-                CREATE TABLE IF NOT EXISTS test.use_case_maps (
+                CREATE TABLE IF NOT EXISTS test.activity_duration_stats (
+                    stage TEXT NOT NULL,
+                    outcome_key TEXT NOT NULL,
+                    segment TEXT NOT NULL,
+                    samples INTEGER NOT NULL,
+                    median_days DOUBLE PRECISION NOT NULL,
+                    p80_days DOUBLE PRECISION NOT NULL,
+                    refreshed_at TIMESTAMP NOT NULL,
+                    PRIMARY KEY (stage, outcome_key, segment)
+                )
+            """)
+
+            return True
+
+        except Exception as e:
+            print(f"Failed to create use_case_maps table: {e}")
+            return False
+
+    def create_map_imports_table(self):
+        """Create the ledger of imported MAP workbooks used to resume bulk imports"""
+        try:
+            if not self.connect():
+                return False
+
+            self.query("""
+                CREATE TABLE IF NOT EXISTS test.use_case_map_imports (
+                    file_hash TEXT PRIMARY KEY,
+                    source_file TEXT,
+                    use_case_id TEXT NOT NULL,
+                    row_count INTEGER,
+                    imported_by TEXT,
+                    imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self.query("""
+                CREATE INDEX IF NOT EXISTS idx_use_case_map_imports_use_case
+                ON test.use_case_map_imports (use_case_id)
+            """)
+
+            return True
+
+        except Exception as e:
+            print(f"Failed to create use_case_map_imports table: {e}")
+            return False
+
+    def create_delta_storage_tables(self):
+        """Create the normalised use case tables and their wide-row view
+
+        test.use_cases holds one header row per use case, test.use_case_activities
+        one row per activity referencing the template by (template_version,
+        activity_key) and storing only what differs from it: NULL text or owner
+        means "as in the template" (owner after SA/AE substitution), NULL
+        progress or notes means none.
+        """
+        try:
+            if not self.connect():
+                return False
+
+            self.query("""
+                CREATE TABLE IF NOT EXISTS test.template_activities (
+                    template_version INTEGER NOT NULL,
+                    activity_key BIGINT NOT NULL,
+                    position INTEGER NOT NULL,
+                    "Stage" TEXT NOT NULL,
+                    "Outcome" TEXT NOT NULL,
+                    "Embedded_Questions" TEXT,
+                    "Owner_Name" TEXT,
+                    stored_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (template_version, activity_key)
+                )
+            """)
+
+            self.query("""
+                CREATE TABLE IF NOT EXISTS test.use_cases (
+                    use_case_id TEXT PRIMARY KEY,
+                    use_case_name TEXT,
+                    customer_name TEXT,
+                    solution_architect TEXT,
+                    account_executive TEXT,
+                    ssa_required BOOLEAN DEFAULT FALSE,
+                    poc_required BOOLEAN DEFAULT FALSE,
+                    start_date DATE,
+                    template_version INTEGER,
+                    created_by TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_by TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            self.query("""
+                CREATE TABLE IF NOT EXISTS test.use_case_activities (
                     p_id BIGSERIAL PRIMARY KEY,
+                    use_case_id TEXT NOT NULL REFERENCES test.use_cases(use_case_id) ON DELETE CASCADE,
+                    position SMALLINT NOT NULL,
+                    activity_key BIGINT,
+                    "Stage" TEXT,
+                    "Outcome" TEXT,
+                    "Embedded_Questions" TEXT,
+                    "Owner_Name" TEXT,
+                    "Start_Date" DATE,
+                    "End_Date" DATE,
+                    "Progress" DOUBLE PRECISION,
+                    "Notes" TEXT
+                )
+            """)
+
+            self.query("""
+                CREATE INDEX IF NOT EXISTS idx_use_case_activities_use_case
+                ON test.use_case_activities(use_case_id, position)
+            """)
+
+            self.query("""
+                CREATE INDEX IF NOT EXISTS idx_use_case_activities_date_range
+                ON test.use_case_activities USING GIST (
+                    daterange(LEAST("Start_Date", "End_Date"), GREATEST("Start_Date", "End_Date"), '[]')
+                )
+            """)
+
+            self.query("""
+                CREATE INDEX IF NOT EXISTS idx_use_cases_customer
+                ON test.use_cases(customer_name)
+            """)
+
+            self.query("""
+                CREATE INDEX IF NOT EXISTS idx_use_cases_created_at
+                ON test.use_cases(created_at)
+            """)
+
+            # SQL twins of template_compiler.activity_hash and the form's SA/AE substitution
+            self.query("""
+                CREATE OR REPLACE FUNCTION test.activity_key(stage TEXT, outcome TEXT) RETURNS BIGINT
+                LANGUAGE sql IMMUTABLE AS $$
+                    SELECT ('x' || left(md5(stage || '|' || trim(regexp_replace(
+                        lower(COALESCE(outcome, '')), '[^a-z0-9]+', ' ', 'g'))), 16))::bit(64)::bigint
+                $$
+            """)
+
+            self.query("""
+                CREATE OR REPLACE FUNCTION test.substitute_owner(owner TEXT, solution_architect TEXT,
+                                                                 account_executive TEXT) RETURNS TEXT
+                LANGUAGE sql IMMUTABLE AS $$
+                    SELECT CASE WHEN COALESCE(account_executive, '') <> ''
+                                THEN replace(sa_owner, 'AE', account_executive) ELSE sa_owner END
+                    FROM (SELECT CASE WHEN COALESCE(solution_architect, '') <> ''
+                                      THEN replace(owner, 'SA', solution_architect) ELSE owner END AS sa_owner) s
+                $$
+            """)
+
+            # Today's test.use_case_maps row shape, rebuilt from the header, the
+            # activity rows and the referenced template activities
+            self.query("""
+                CREATE OR REPLACE VIEW test.use_case_maps_expanded AS
+                SELECT a.p_id, h.use_case_id, h.use_case_name, h.customer_name,
+                       COALESCE(a."Stage", t."Stage") AS "Stage",
+                       COALESCE(a."Outcome", t."Outcome") AS "Outcome",
+                       COALESCE(a."Embedded_Questions", t."Embedded_Questions", '') AS "Embedded_Questions",
+                       COALESCE(a."Owner_Name",
+                                test.substitute_owner(t."Owner_Name", h.solution_architect, h.account_executive),
+                                '') AS "Owner_Name",
+                       a."Start_Date",
+                       a."End_Date",
+                       COALESCE(a."Progress", 0) AS "Progress",
+                       COALESCE(a."Notes", '') AS "Notes",
+                       COALESCE(a."Outcome", t."Outcome") AS "Action",
+                       h.solution_architect, h.account_executive, h.ssa_required, h.poc_required,
+                       h.created_by, h.created_at, h.updated_by, h.updated_at,
+                       a.position::integer AS position
+                FROM test.use_case_activities a
+                JOIN test.use_cases h ON h.use_case_id = a.use_case_id
+                LEFT JOIN test.template_activities t
+                  ON t.template_version = h.template_version AND t.activity_key = a.activity_key
+            """)
+
+            return True
+
+        except Exception as e:
+            print(f"Failed to create delta storage tables: {e}")
+            return False
+
+    def create_use_case_maps_archive_table(self):
+        """Create test.use_case_maps_archive: the activity rows of closed plans
+
+        Same columns as test.use_case_maps plus archived_at, so rows move with
+        one INSERT ... SELECT and archived plans can be listed and cloned.
+        """
+        try:
+            if not self.connect():
+                return False
+
+            self.query("""
+                CREATE TABLE IF NOT EXISTS test.use_case_maps_archive (
+                    p_id BIGINT NOT NULL,
                     use_case_id TEXT NOT NULL,
                     use_case_name TEXT,
                     customer_name TEXT,
@@ -224,28 +581,163 @@ class LakebaseService:
                     ssa_required BOOLEAN DEFAULT FALSE,
                     poc_required BOOLEAN DEFAULT FALSE,
                     created_by TEXT,
+                    created_at TIMESTAMP,
+                    updated_by TEXT,
+                    updated_at TIMESTAMP,
+                    position INTEGER,
+                    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            self.query("""
+                CREATE INDEX IF NOT EXISTS idx_use_case_maps_archive_use_case_id
+                ON test.use_case_maps_archive(use_case_id)
+            """)
+
+            # Use case sequence numbers count archived plans too
+            self.query("""
+                CREATE INDEX IF NOT EXISTS idx_use_case_maps_archive_customer_created
+                ON test.use_case_maps_archive(customer_name, created_at)
+            """)
+
+            return True
+
+        except Exception as e:
+            print(f"Failed to create use_case_maps_archive table: {e}")
+            return False
+
+    def create_use_case_documents_table(self):
+        """Create test.use_case_documents: one JSONB document per use case
+
+        version is bumped on every save so concurrent edits can be detected.
+        The jsonb_path_ops GIN index serves containment filters on any field of
+        the document (customer, SA/AE, activity owner or status); customer and
+        updated_at get B-tree indexes for the portfolio listing.
+        """
+        try:
+            if not self.connect():
+                return False
+
+            self.query("""
+                CREATE TABLE IF NOT EXISTS test.use_case_documents (
+                    use_case_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 1,
+                    document JSONB NOT NULL,
+                    created_by TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_by TEXT,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
 
-            # Create index on use_case_id for faster lookups
             self.query("""
-                CREATE INDEX IF NOT EXISTS idx_use_case_id
-                ON test.use_case_maps(use_case_id)
+                CREATE INDEX IF NOT EXISTS idx_use_case_documents_document
+                ON test.use_case_documents USING GIN (document jsonb_path_ops)
             """)
 
-            # Create index on customer_name for faster filtering
             self.query("""
-                CREATE INDEX IF NOT EXISTS idx_customer_name
-                ON test.use_case_maps(customer_name)
+                CREATE INDEX IF NOT EXISTS idx_use_case_documents_customer
+                ON test.use_case_documents ((document->>'customer'))
+            """)
+
+            self.query("""
+                CREATE INDEX IF NOT EXISTS idx_use_case_documents_updated_at
+                ON test.use_case_documents (updated_at)
             """)
 
             return True
 
         except Exception as e:
-            print(f"Failed to create use_case_maps table: {e}")
+            print(f"Failed to create use_case_documents table: {e}")
+            return False
+
+    def create_change_log_tables(self):
+        """Create the append-only use case change log and its snapshots
+
+        test.use_case_changes holds one row per changed field of a save or
+        edit (UPDATE and DELETE are rejected by a trigger);
+        test.use_case_snapshots full documents that reconstruction starts from.
+        """
+        try:
+            if not self.connect():
+                return False
+
+            self.query("""
+                CREATE TABLE IF NOT EXISTS test.use_case_changes (
+                    change_id BIGSERIAL PRIMARY KEY,
+                    use_case_id TEXT NOT NULL,
+                    changed_at TIMESTAMP NOT NULL,
+                    changed_by TEXT,
+                    source TEXT,
+                    op TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    label TEXT,
+                    old_value JSONB,
+                    new_value JSONB
+                )
+            """)
+
+            self.query("""
+                CREATE INDEX IF NOT EXISTS idx_use_case_changes_use_case
+                ON test.use_case_changes(use_case_id, changed_at)
+            """)
+
+            self.query("""
+                CREATE OR REPLACE FUNCTION test.reject_change_log_edit() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    RAISE EXCEPTION 'test.use_case_changes is append-only';
+                END
+                $$
+            """)
+
+            self.query("DROP TRIGGER IF EXISTS use_case_changes_append_only ON test.use_case_changes")
+            self.query("""
+                CREATE TRIGGER use_case_changes_append_only
+                BEFORE UPDATE OR DELETE ON test.use_case_changes
+                FOR EACH ROW EXECUTE FUNCTION test.reject_change_log_edit()
+            """)
+
+            self.query("""
+                CREATE TABLE IF NOT EXISTS test.use_case_snapshots (
+                    use_case_id TEXT NOT NULL,
+                    taken_at TIMESTAMP NOT NULL,
+                    document JSONB NOT NULL,
+                    PRIMARY KEY (use_case_id, taken_at)
+                )
+            """)
+
+            return True
+
+        except Exception as e:
+            print(f"Failed to create change log tables: {e}")
+            return False
+
+    def create_plan_deviations_table(self):
+        """Create the nightly plan-vs-template deviation report table"""
+        try:
+            if not self.connect():
+                return False
+
+            self.query("""
+                CREATE TABLE IF NOT EXISTS test.plan_deviations (
+                    use_case_id TEXT PRIMARY KEY,
+                    use_case_name TEXT,
+                    customer_name TEXT,
+                    template_version INTEGER,
+                    missing INTEGER NOT NULL,
+                    added INTEGER NOT NULL,
+                    reordered INTEGER NOT NULL,
+                    conformance DOUBLE PRECISION NOT NULL,
+                    details JSONB,
+                    analysed_at TIMESTAMP NOT NULL
+                )
+            """)
+
+            return True
+
+        except Exception as e:
+            print(f"Failed to create plan_deviations table: {e}")
             return False
 
     def close(self):
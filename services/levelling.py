@@ -0,0 +1,204 @@
+"""
+Capacity-aware resource levelling across a team's plans
+A heuristic list scheduler delays non-critical activities (within their plan's slack, in
+whole weeks) to bring each owner's weekly load under capacity, and proposes the date changes
+"""
+
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from plan_utils import build_plan_rows
+from services.workload import split_owners, week_start
+
+DEFAULT_CAPACITY = 3
+DEFAULT_TIME_BUDGET = 2.0
+
+# Plans are due duration_months after their start
+DAYS_PER_MONTH = 30
+
+
+def _plan_tasks(use_case, base_week):
+    """Week spans of a plan's activities and its slack in whole weeks
+
+    Returns (tasks, slack_weeks) where tasks are (owners, first_week, last_week,
+    row) with weeks counted from base_week; a shared activity ("Alice/Bob")
+    loads every one of its owners.
+    """
+    rows = build_plan_rows(use_case)
+    tasks = []
+    for row in rows:
+        first = (week_start(date.fromisoformat(row['Start Date'])) - base_week).days // 7
+        last = (week_start(date.fromisoformat(row['End Date'])) - base_week).days // 7
+        tasks.append((split_owners(row['Owner']), min(first, last), max(first, last), row))
+
+    plan_start = date.fromisoformat(use_case['start_date'][:10])
+    deadline = plan_start + timedelta(days=DAYS_PER_MONTH * use_case.get('duration_months', 6))
+    finish = date.fromisoformat(rows[-1]['End Date']) if rows else plan_start
+    return tasks, max((deadline - finish).days // 7, 0)
+
+
+class _Schedule:
+    """Weekly load per owner for one scheduling pass"""
+
+    def __init__(self, capacities, default_capacity, weeks):
+        self.capacities = capacities
+        self.default_capacity = default_capacity
+        self.weeks = weeks
+        self.load = {}
+
+    def capacity(self, owner):
+        return self.capacities.get(owner, self.default_capacity)
+
+    def overload(self, owner, first, last, delay):
+        """Extra overload caused by placing one activity delayed by delay weeks"""
+        load = self.load.setdefault(owner, [0] * self.weeks)
+        capacity = self.capacity(owner)
+        return sum(1 for week in range(first + delay, last + delay + 1) if load[week] >= capacity)
+
+    def place(self, owner, first, last, delay):
+        load = self.load.setdefault(owner, [0] * self.weeks)
+        for week in range(first + delay, last + delay + 1):
+            load[week] += 1
+
+    def score(self):
+        """(total overload, worst load/capacity ratio) over all owner-weeks"""
+        total, peak = 0, 0.0
+        for owner, load in self.load.items():
+            capacity = self.capacity(owner)
+            total += sum(max(count - capacity, 0) for count in load)
+            peak = max(peak, max(load) / max(capacity, 1))
+        return total, round(peak, 2)
+
+
+def _schedule_pass(plans, order, owners, capacities, default_capacity, weeks, level):
+    """Place every plan in order; returns (schedule, delays per plan)
+
+    Activities of the levelled owners take the smallest delay (never less than
+    the activity before them, never more than the plan's slack) that adds no
+    overload, else the delay adding the least. Other activities just inherit
+    the previous delay. With level=False nothing moves (the baseline).
+    """
+    schedule = _Schedule(capacities, default_capacity, weeks)
+    delays = {}
+    for plan_idx in order:
+        tasks, slack = plans[plan_idx]
+        delay, plan_delays = 0, []
+        for task_owners, first, last, _ in tasks:
+            levelled = [owner for owner in task_owners if owner in owners]
+            if levelled:
+                if level and slack > delay:
+                    best, best_overload = delay, None
+                    for candidate in range(delay, slack + 1):
+                        overload = sum(schedule.overload(owner, first, last, candidate) for owner in levelled)
+                        if best_overload is None or overload < best_overload:
+                            best, best_overload = candidate, overload
+                        if overload == 0:
+                            break
+                    delay = best
+                for owner in levelled:
+                    schedule.place(owner, first, last, delay)
+            plan_delays.append(delay)
+        delays[plan_idx] = plan_delays
+    return schedule, delays
+
+
+def level_resources(use_cases, owners, capacity=DEFAULT_CAPACITY, capacities=None,
+                    time_budget=DEFAULT_TIME_BUDGET, seed=0):
+    """Propose activity delays that reduce peak weekly load for the given owners
+
+    capacity is the default number of concurrent activities an owner can carry
+    in a week, capacities overrides it per owner. The first pass places plans
+    with the least slack first; further passes randomise the order until the
+    time budget runs out, keeping the best result (least overload, then least
+    total delay). Returns (proposals, summary); apply them with apply_levelling.
+    """
+    started = time.perf_counter()
+    owners = set(owners)
+    capacities = capacities or {}
+    plans_in_scope = [
+        use_case for use_case in use_cases
+        if use_case.get('stages') and any(
+            owner in owners
+            for stage in use_case['stages'] for activity in stage['activities']
+            for owner in split_owners(activity.get('owner'))
+        )
+    ]
+    if not plans_in_scope:
+        return [], {'plans': 0, 'activities': 0, 'passes': 0, 'seconds': 0.0, 'before': (0, 0.0), 'after': (0, 0.0)}
+
+    base_week = min(week_start(date.fromisoformat(uc['start_date'][:10])) for uc in plans_in_scope)
+    plans = [_plan_tasks(use_case, base_week) for use_case in plans_in_scope]
+    weeks = max((task[2] for tasks, _ in plans for task in tasks), default=0) \
+        + max(slack for _, slack in plans) + 2
+
+    order = sorted(range(len(plans)), key=lambda idx: (plans[idx][1], idx))
+    baseline, _ = _schedule_pass(plans, order, owners, capacities, capacity, weeks, level=False)
+    schedule, best_delays = _schedule_pass(plans, order, owners, capacities, capacity, weeks, level=True)
+    best_key = (schedule.score(), sum(d[-1] for d in best_delays.values() if d))
+    passes = 1
+
+    rng = random.Random(seed)
+    while time.perf_counter() - started < time_budget:
+        # Keep the slack ordering roughly, but shuffle plans with similar slack
+        shuffled = sorted(order, key=lambda idx: plans[idx][1] + rng.random() * 4)
+        schedule, delays = _schedule_pass(plans, shuffled, owners, capacities, capacity, weeks, level=True)
+        key = (schedule.score(), sum(d[-1] for d in delays.values() if d))
+        passes += 1
+        if key < best_key:
+            best_key, best_delays = key, delays
+        if best_key[0][0] == 0:
+            break
+
+    proposals = []
+    for plan_idx, use_case in enumerate(plans_in_scope):
+        tasks, _ = plans[plan_idx]
+        previous = 0
+        for position, ((_, _, _, row), delay) in enumerate(zip(tasks, best_delays[plan_idx])):
+            if delay > previous:
+                start = datetime.strptime(row['Start Date'], '%Y-%m-%d').date()
+                proposals.append({
+                    'use_case_id': use_case['use_case_id'],
+                    'use_case_name': use_case.get('name', ''),
+                    'position': position,
+                    'stage': row['ID'],
+                    'activity': row['Activity'],
+                    'owner': row['Owner'],
+                    'current_start': start,
+                    'proposed_start': start + timedelta(weeks=delay),
+                    'extra_lag_days': (delay - previous) * 7
+                })
+            previous = delay
+
+    summary = {
+        'plans': len(plans),
+        'activities': sum(len(tasks) for tasks, _ in plans),
+        'passes': passes,
+        'seconds': round(time.perf_counter() - started, 2),
+        'before': baseline.score(),
+        'after': best_key[0]
+    }
+    return proposals, summary
+
+
+def apply_levelling(use_cases_by_id, proposals):
+    """Apply accepted proposals as activity lag; returns the ids of the changed use cases
+
+    Each proposal holds back one activity (and with it the rest of its plan)
+    by extra_lag_days, exactly as proposed.
+    """
+    changed = set()
+    for proposal in proposals:
+        use_case = use_cases_by_id.get(proposal['use_case_id'])
+        if not use_case:
+            continue
+        activities = [activity for stage in use_case['stages'] for activity in stage['activities']]
+        if proposal['position'] >= len(activities):
+            continue
+        activity = activities[proposal['position']]
+        activity['lag_days'] = activity.get('lag_days', 0) + proposal['extra_lag_days']
+        changed.add(proposal['use_case_id'])
+
+    for use_case_id in changed:
+        use_cases_by_id[use_case_id]['updated_at'] = datetime.now().isoformat()
+    return sorted(changed)
@@ -0,0 +1,145 @@
+"""
+Server-side cloning of a map into a new use case
+Reads a test.maps, test.use_case_maps or archived map with one SELECT, doing owner
+substitution, date shifting and duration estimates in SQL; the caller saves the
+resulting use case like any other, so its rows follow the plan's order and schedule
+"""
+
+from compiled_template import COMPILED_TEMPLATE
+from services.duration_stats import DEFAULT_DURATION_DAYS, estimate_join
+from services.lakebase import lakebase
+
+# Shift every date so the earliest activity starts on the new start date;
+# activities without dates start on it and last their historical median
+# duration (or the default), like a form save
+CLONE_SELECT = """
+    SELECT s."Stage", s.outcome, s.questions, {owner_sql},
+           COALESCE(s."Start_Date" + s.shift, %(start_date)s::date),
+           COALESCE(s."End_Date" + s.shift, COALESCE(s."Start_Date" + s.shift, %(start_date)s::date)
+                    + COALESCE(estimate.days, """ + str(DEFAULT_DURATION_DAYS) + """)),
+           s.ssa_required, s.poc_required
+    FROM ({source_sql}) s
+""" + estimate_join('s."Stage"', 's.outcome', '%(customer_name)s') + """
+    ORDER BY s.position NULLS LAST, s.p_id
+"""
+
+# Template maps hold role names (SA, AE) in the owner column
+MAPS_OWNER_SQL = """
+    CASE WHEN %(account_executive)s <> ''
+         THEN replace(CASE WHEN %(solution_architect)s <> ''
+                           THEN replace(s.owner, 'SA', %(solution_architect)s)
+                           ELSE s.owner END, 'AE', %(account_executive)s)
+         ELSE CASE WHEN %(solution_architect)s <> ''
+                   THEN replace(s.owner, 'SA', %(solution_architect)s)
+                   ELSE s.owner END
+    END
+"""
+
+MAPS_SOURCE_SQL = """
+    SELECT p_id, NULL::integer AS position, "Stage",
+           COALESCE("Outcome", "Action") AS outcome,
+           COALESCE("Embedded_Questions", '') AS questions,
+           COALESCE("Owner_Name", '') AS owner,
+           "Start_Date", "End_Date",
+           %(start_date)s::date - MIN("Start_Date") OVER () AS shift,
+           bool_or(COALESCE("Outcome", "Action", '') LIKE '%%SSA%%') OVER () AS ssa_required,
+           bool_or(COALESCE("Outcome", "Action", '') LIKE '%%POC%%') OVER () AS poc_required
+    FROM test.maps
+    WHERE "ID" = %(source_id)s AND "Stage" IS NOT NULL
+"""
+
+# App-created maps already hold people's names: swap the source SA/AE for the new ones
+USE_CASE_MAPS_OWNER_SQL = """
+    CASE WHEN COALESCE(s.source_ae, '') <> '' AND %(account_executive)s <> ''
+         THEN replace(CASE WHEN COALESCE(s.source_sa, '') <> '' AND %(solution_architect)s <> ''
+                           THEN replace(s.owner, s.source_sa, %(solution_architect)s)
+                           ELSE s.owner END, s.source_ae, %(account_executive)s)
+         ELSE CASE WHEN COALESCE(s.source_sa, '') <> '' AND %(solution_architect)s <> ''
+                   THEN replace(s.owner, s.source_sa, %(solution_architect)s)
+                   ELSE s.owner END
+    END
+"""
+
+# Saves used to append a new batch of rows each time (each with its own
+# created_at); clone only the latest batch, keeping repeated activities, in
+# plan order. {table} is test.use_case_maps or the archive, {batch} narrows
+# the archive to its latest archived batch
+SAVED_SOURCE_SQL = """
+    SELECT *,
+           %(start_date)s::date - MIN("Start_Date") OVER () AS shift
+    FROM (
+        SELECT p_id, position, "Stage", "Outcome" AS outcome,
+               COALESCE("Embedded_Questions", '') AS questions,
+               COALESCE("Owner_Name", '') AS owner,
+               "Start_Date", "End_Date", ssa_required, poc_required,
+               solution_architect AS source_sa, account_executive AS source_ae
+        FROM {table}
+        WHERE use_case_id = %(source_id)s AND "Stage" IS NOT NULL {batch}
+        AND created_at IS NOT DISTINCT FROM (
+            SELECT MAX(created_at) FROM {table} WHERE use_case_id = %(source_id)s {batch}
+        )
+    ) latest
+"""
+
+USE_CASE_MAPS_SOURCE_SQL = SAVED_SOURCE_SQL.format(table="test.use_case_maps", batch="")
+
+# Archived plans are cloned like app-created ones, from their latest archived batch
+# (archives written before the move replaced earlier batches can hold several)
+ARCHIVE_SOURCE_SQL = SAVED_SOURCE_SQL.format(
+    table="test.use_case_maps_archive",
+    batch="AND archived_at = (SELECT MAX(archived_at) FROM test.use_case_maps_archive "
+          "WHERE use_case_id = %(source_id)s)"
+)
+
+# Stage names of the form ("U2 - Uncover") by stage code
+STAGE_NAMES = {stage_code: f"{stage_code} - {name}" for stage_code, name, _, _ in COMPILED_TEMPLATE}
+
+CLONE_SQL = {
+    'maps': CLONE_SELECT.format(owner_sql=MAPS_OWNER_SQL, source_sql=MAPS_SOURCE_SQL),
+    'use_case_maps': CLONE_SELECT.format(owner_sql=USE_CASE_MAPS_OWNER_SQL, source_sql=USE_CASE_MAPS_SOURCE_SQL),
+    'use_case_maps_archive': CLONE_SELECT.format(owner_sql=USE_CASE_MAPS_OWNER_SQL, source_sql=ARCHIVE_SOURCE_SQL),
+}
+
+
+def clone_map(source_id, source, customer_name, solution_architect, account_executive, start_date):
+    """The activities of a map as cloned into a new use case (one round trip)
+
+    source is 'maps', 'use_case_maps' or 'use_case_maps_archive'. Returns the
+    activity rows (Stage, Outcome, Embedded_Questions, Owner_Name,
+    Start_Date, End_Date, ssa_required, poc_required) in source order; an
+    empty list means the source map was empty. Nothing is written: saving
+    the use case built from the rows stores them in the plan's order with
+    its schedule.
+    """
+    if source not in CLONE_SQL:
+        raise ValueError(f"Unknown map source {source!r}")
+
+    lakebase.create_use_case_maps_table()
+    return lakebase.query(CLONE_SQL[source], {
+        'source_id': str(source_id),
+        'customer_name': customer_name,
+        'solution_architect': solution_architect or '',
+        'account_executive': account_executive or '',
+        'start_date': start_date
+    }) or []
+
+
+def cloned_requirements(rows):
+    """(ssa_required, poc_required) of a clone, as stored on its source rows"""
+    return any(row[6] for row in rows), any(row[7] for row in rows)
+
+
+def stages_from_cloned_rows(rows):
+    """Group cloned rows into the app's stages/activities structure, with the form's stage names"""
+    stages = {}
+    for stage, outcome, questions, owner, start, end, _, _ in rows:
+        duration = (end - start).days if start and end else 5
+        stages.setdefault(stage, []).append({
+            'activity': outcome,
+            'description': questions or '',
+            'owner': owner or '',
+            'duration_days': max(duration, 1),
+            'status': 'Not Started'
+        })
+    return [{'stage_name': STAGE_NAMES.get(stage, stage), 'activities': activities}
+            for stage, activities in stages.items()]
@@ -0,0 +1,423 @@
+"""
+Bulk importer for filled-in MAP Excel workbooks into test.use_case_maps
+Workbooks are parsed in read-only streaming mode across a process pool and
+loaded in batched transactions; a ledger of imported files makes runs resumable
+
+Usage:
+    python -m services.map_importer path/to/folder [--customer NAME] [--workers N] [--dry-run]
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from functools import partial
+from pathlib import Path
+
+from plan_utils import normalize_stage_code, status_progress
+
+try:
+    import openpyxl
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    openpyxl = None
+    OPENPYXL_AVAILABLE = False
+
+VALID_STAGES = {"U2", "U3", "U4", "U5", "U6"}
+
+# Workbook header names (lower case) and the test.use_case_maps column they fill
+HEADER_COLUMNS = {
+    "stage": "Stage",
+    "outcome": "Outcome",
+    "embedded questions": "Embedded_Questions",
+    "owner name": "Owner_Name",
+    "owner": "Owner_Name",
+    "start date": "Start_Date",
+    "end date": "End_Date",
+    "progress": "Progress",
+    "notes": "Notes"
+}
+
+# Template Progress dropdown values mapped to app statuses
+TEMPLATE_PROGRESS_STATUS = {
+    "not started": "Not Started",
+    "in progress": "In Progress",
+    "blocked": "Blocked",
+    "on hold": "On Hold",
+    "complete": "Completed",
+    "completed": "Completed"
+}
+
+# Title row written by the XLSX exporter: "{name} • {customer} ({use_case_id})"
+EXPORT_TITLE = re.compile(r'^(?P<name>.*?) • (?P<customer>.*?) \((?P<use_case_id>[^()]*)\)$')
+
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%d-%b-%Y', '%d %b %Y']
+
+HEADER_SCAN_ROWS = 10
+
+INSERT_COLUMNS = [
+    'use_case_id', 'use_case_name', 'customer_name', 'Stage', 'Outcome',
+    'Embedded_Questions', 'Owner_Name', 'Start_Date', 'End_Date', 'Progress',
+    'Notes', 'Action', 'solution_architect', 'account_executive',
+    'ssa_required', 'poc_required', 'created_by', 'created_at', 'updated_by', 'updated_at', 'position'
+]
+
+INSERT_SQL = (
+    "INSERT INTO test.use_case_maps ("
+    + ", ".join(c if c.islower() else f'"{c}"' for c in INSERT_COLUMNS)
+    + ") VALUES %s"
+)
+INSERT_TEMPLATE = "(" + ", ".join(f"%({c})s" for c in INSERT_COLUMNS) + ")"
+
+# Whether a use case id already has rows, and whether an earlier import created it
+EXISTING_SQL = """
+    SELECT EXISTS (SELECT 1 FROM test.use_case_maps WHERE use_case_id = %(use_case_id)s),
+           EXISTS (SELECT 1 FROM test.use_case_map_imports WHERE use_case_id = %(use_case_id)s)
+"""
+
+
+def file_hash(path):
+    """SHA-256 of a file's bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _parse_date(value):
+    """Coerce a cell value to a date, returning None for blanks and raising on garbage"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised date {text!r}")
+
+
+def _parse_progress(value):
+    """Coerce a Progress cell (template dropdown text or a number) to a percentage"""
+    if value is None or value == '':
+        return 0.0
+    if isinstance(value, (int, float)):
+        # Fractions come from percentage-formatted cells
+        return float(value) * 100 if 0 < value <= 1 else float(value)
+    status = TEMPLATE_PROGRESS_STATUS.get(str(value).strip().lower())
+    if status is None:
+        raise ValueError(f"unknown progress {value!r}")
+    return status_progress(status)
+
+
+def find_header_row(rows):
+    """Find the header row, returning (rows consumed, {column index: db column}, title)"""
+    title = None
+    for offset, row in enumerate(rows, start=1):
+        cells = [str(c).strip().lower() if c is not None else '' for c in row]
+        if 'stage' in cells and 'outcome' in cells:
+            columns = {idx: HEADER_COLUMNS[cell] for idx, cell in enumerate(cells) if cell in HEADER_COLUMNS}
+            return offset, columns, title
+        if title is None and row and isinstance(row[0], str):
+            title = row[0].strip()
+        if offset >= HEADER_SCAN_ROWS:
+            break
+    return None, None, title
+
+
+def parse_workbook(path, customer='', skip_hashes=frozenset()):
+    """Parse and validate one MAP workbook (runs in a worker process)
+
+    Returns a dict with the use case details, the valid activity rows, the
+    per-row validation errors and the parse time. Workbooks whose hash is in
+    skip_hashes are reported as skipped without being opened.
+    """
+    started = time.perf_counter()
+    result = {
+        'file': str(path),
+        'file_hash': file_hash(path),
+        'use_case': None,
+        'rows': [],
+        'errors': [],
+        'status': 'parsed',
+        'parse_seconds': 0.0
+    }
+    if result['file_hash'] in skip_hashes:
+        result['status'] = 'skipped'
+        return result
+
+    try:
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['errors'].append(f"cannot open workbook: {e}")
+        return result
+
+    try:
+        worksheet = workbook['MAP'] if 'MAP' in workbook.sheetnames else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        header_row, columns, title = find_header_row(rows)
+        if header_row is None:
+            result['status'] = 'failed'
+            result['errors'].append("no Stage/Outcome header row found")
+            return result
+
+        # Use case details: exporter title row if present, otherwise the file name
+        # and customer, so a corrected copy of a workbook replaces the plan its
+        # earlier import created (the file hash only skips identical files)
+        title_match = EXPORT_TITLE.match(title or '')
+        stem = Path(path).stem
+        if title_match:
+            use_case = title_match.groupdict()
+        else:
+            use_case = {'name': stem, 'customer': customer,
+                        'use_case_id': f"{stem}-{customer}" if customer else stem}
+        use_case['use_case_id'] = re.sub(r'[^A-Za-z0-9_-]+', '-', use_case['use_case_id']).strip('-').upper()
+        use_case['customer'] = use_case['customer'] or customer
+        result['use_case'] = use_case
+
+        for row_number, row in enumerate(rows, start=header_row + 1):
+            values = {column: row[idx] for idx, column in columns.items() if idx < len(row)}
+            if not any(v not in (None, '') for v in values.values()):
+                continue
+
+            stage = normalize_stage_code(str(values.get('Stage') or '').strip())
+            outcome = str(values.get('Outcome') or '').strip()
+            try:
+                if stage not in VALID_STAGES:
+                    raise ValueError(f"invalid stage {values.get('Stage')!r}")
+                if not outcome:
+                    raise ValueError("missing outcome")
+                start_date = _parse_date(values.get('Start_Date'))
+                end_date = _parse_date(values.get('End_Date'))
+                if start_date and end_date and end_date < start_date:
+                    raise ValueError("end date before start date")
+                progress = _parse_progress(values.get('Progress'))
+            except ValueError as e:
+                result['errors'].append(f"row {row_number}: {e}")
+                continue
+
+            result['rows'].append({
+                'Stage': stage,
+                'Outcome': outcome,
+                'Embedded_Questions': str(values.get('Embedded_Questions') or ''),
+                'Owner_Name': str(values.get('Owner_Name') or ''),
+                'Start_Date': start_date,
+                'End_Date': end_date,
+                'Progress': progress,
+                'Notes': str(values.get('Notes') or ''),
+                'Action': outcome
+            })
+    finally:
+        workbook.close()
+        result['parse_seconds'] = time.perf_counter() - started
+
+    if not result['rows']:
+        result['status'] = 'failed'
+    return result
+
+
+def _db_rows(parsed, user_name, now):
+    """Expand parsed activities into full test.use_case_maps rows"""
+    use_case = parsed['use_case']
+    outcomes = ' '.join(row['Outcome'] for row in parsed['rows'])
+    header = {
+        'use_case_id': use_case['use_case_id'],
+        'use_case_name': use_case['name'],
+        'customer_name': use_case['customer'],
+        'solution_architect': '',
+        'account_executive': '',
+        # Same convention as the form: SSA/POC activities are only present when required
+        'ssa_required': 'SSA' in outcomes,
+        'poc_required': 'POC' in outcomes,
+        'created_by': user_name,
+        'created_at': now,
+        'updated_by': user_name,
+        'updated_at': now
+    }
+    return [{**header, **row, 'position': position} for position, row in enumerate(parsed['rows'])]
+
+
+def _load_batch(lakebase, batch, user_name):
+    """Load the use cases of the batch and record the files, in one transaction
+
+    Rows of a use case are only replaced when an earlier import created it;
+    a workbook whose id belongs to a plan created in the app is rejected.
+    Returns {file: error} of the rejected workbooks.
+    """
+    now = datetime.now()
+    rejected = {}
+    with lakebase.transaction() as cursor:
+        for parsed in batch:
+            use_case_id = parsed['use_case']['use_case_id']
+            cursor.execute(EXISTING_SQL, {'use_case_id': use_case_id})
+            has_rows, imported = cursor.fetchone()
+            if has_rows and not imported:
+                rejected[parsed['file']] = f"use case {use_case_id} already exists and was not created by an import"
+                continue
+            if has_rows:
+                cursor.execute("DELETE FROM test.use_case_maps WHERE use_case_id = %s", (use_case_id,))
+            lakebase.insert_rows(cursor, INSERT_SQL, INSERT_TEMPLATE, _db_rows(parsed, user_name, now))
+            cursor.execute("""
+                INSERT INTO test.use_case_map_imports
+                    (file_hash, source_file, use_case_id, row_count, imported_by, imported_at)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (file_hash) DO NOTHING
+            """, (parsed['file_hash'], parsed['file'], use_case_id, len(parsed['rows']), user_name, now))
+    return rejected
+
+
+def _report_entry(parsed, status, load_seconds=0.0, error=None):
+    """Per-file line of the import report"""
+    seconds = parsed['parse_seconds'] + load_seconds
+    errors = list(parsed['errors']) + ([error] if error else [])
+    return {
+        'file': Path(parsed['file']).name,
+        'use_case_id': (parsed['use_case'] or {}).get('use_case_id', ''),
+        'status': status,
+        'rows': len(parsed['rows']),
+        'errors': len(errors),
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(len(parsed['rows']) / seconds, 1) if seconds else 0.0,
+        'error_details': errors
+    }
+
+
+def import_workbooks(paths, user_name, customer='', workers=None, batch_rows=5000,
+                     dry_run=False, resume=True):
+    """Import MAP workbooks into test.use_case_maps
+
+    Files are parsed in parallel and loaded as they arrive, in transactions of
+    up to batch_rows rows. With resume, files already recorded in
+    test.use_case_map_imports are skipped. Returns the per-file report.
+    """
+    if not OPENPYXL_AVAILABLE:
+        raise ImportError("openpyxl is required to import MAP workbooks")
+
+    from services.lakebase import lakebase
+
+    skip_hashes = frozenset()
+    if not dry_run:
+        lakebase.create_use_case_maps_table()
+        lakebase.create_map_imports_table()
+        if resume:
+            skip_hashes = frozenset(row[0] for row in
+                                    lakebase.query("SELECT file_hash FROM test.use_case_map_imports") or [])
+
+    report = []
+    batch = []
+    batch_size = 0
+    # Use case id -> file that claimed it in this run
+    claimed = {}
+
+    def flush():
+        nonlocal batch, batch_size
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            rejected = _load_batch(lakebase, batch, user_name)
+            share = (time.perf_counter() - started) / len(batch)
+            report.extend(_report_entry(parsed, 'failed', error=rejected[parsed['file']])
+                          if parsed['file'] in rejected else _report_entry(parsed, 'imported', share)
+                          for parsed in batch)
+        except Exception as e:
+            report.extend(_report_entry(parsed, 'failed', error=str(e)) for parsed in batch)
+        batch, batch_size = [], 0
+
+    parse = partial(parse_workbook, customer=customer, skip_hashes=skip_hashes)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(parse, path) for path in paths]
+        for future in as_completed(futures):
+            parsed = future.result()
+            if parsed['status'] == 'parsed':
+                use_case_id = parsed['use_case']['use_case_id']
+                if use_case_id in claimed:
+                    report.append(_report_entry(parsed, 'failed', error=(
+                        f"use case {use_case_id} is also in {Path(claimed[use_case_id]).name}")))
+                    continue
+                claimed[use_case_id] = parsed['file']
+
+            if parsed['status'] != 'parsed' or dry_run:
+                status = 'validated' if parsed['status'] == 'parsed' else parsed['status']
+                report.append(_report_entry(parsed, status))
+                continue
+
+            batch.append(parsed)
+            batch_size += len(parsed['rows'])
+            if batch_size >= batch_rows:
+                flush()
+    flush()
+
+    if not dry_run:
+        lakebase.close()
+    return report
+
+
+def summarize_report(report, elapsed_seconds):
+    """Totals across an import report"""
+    rows = sum(entry['rows'] for entry in report if entry['status'] in ('imported', 'validated'))
+    return {
+        'files': len(report),
+        'imported': sum(1 for entry in report if entry['status'] == 'imported'),
+        'skipped': sum(1 for entry in report if entry['status'] == 'skipped'),
+        'failed': sum(1 for entry in report if entry['status'] == 'failed'),
+        'rows': rows,
+        'errors': sum(entry['errors'] for entry in report),
+        'seconds': round(elapsed_seconds, 2),
+        'rows_per_second': round(rows / elapsed_seconds, 1) if elapsed_seconds else 0.0
+    }
+
+
+def find_workbooks(paths):
+    """Expand files and folders into a sorted list of .xlsx workbooks"""
+    workbooks = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            workbooks.extend(p for p in path.rglob('*.xlsx') if not p.name.startswith('~$'))
+        elif path.suffix.lower() == '.xlsx':
+            workbooks.append(path)
+    return sorted(workbooks)
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Bulk import MAP workbooks into test.use_case_maps")
+    parser.add_argument('paths', nargs='+', help="Workbook files or folders to import")
+    parser.add_argument('--customer', default='', help="Customer name for workbooks without one")
+    parser.add_argument('--user', default='importer', help="Value for created_by/updated_by")
+    parser.add_argument('--workers', type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument('--batch-rows', type=int, default=5000, help="Rows per load transaction")
+    parser.add_argument('--dry-run', action='store_true', help="Parse and validate only")
+    parser.add_argument('--no-resume', action='store_true', help="Re-import files already in the ledger")
+    args = parser.parse_args(argv)
+
+    workbooks = find_workbooks(args.paths)
+    started = time.perf_counter()
+    report = import_workbooks(workbooks, args.user, customer=args.customer, workers=args.workers,
+                              batch_rows=args.batch_rows, dry_run=args.dry_run,
+                              resume=not args.no_resume)
+    summary = summarize_report(report, time.perf_counter() - started)
+
+    for entry in sorted(report, key=lambda e: e['file']):
+        print(f"{entry['status']:<10} {entry['file']:<50} {entry['rows']:>6} rows "
+              f"{entry['rows_per_second']:>10.1f} rows/s {entry['errors']:>4} errors")
+        for error in entry['error_details']:
+            print(f"           - {error}")
+
+    print("=" * 50)
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
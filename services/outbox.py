@@ -0,0 +1,337 @@
+"""
+Write-behind queue for use case saves
+Saves are committed to a durable local outbox (SQLite next to the JSON store) and return at
+once; a background worker drains it to Lakebase in batches, retrying failures with backoff
+and applying each use case's entries strictly in order. Version conflicts, and entries that
+keep failing, stop until the user resolves or retries them
+
+Usage:
+    python -m services.outbox [--path use_case_data/outbox.sqlite3] [--retry]
+"""
+
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from config import Config
+from services.document_storage import CONFLICT_MESSAGE, VERSION_KEY
+
+DEFAULT_PATH = Path("use_case_data") / "outbox.sqlite3"
+
+# Use cases synced per pass of the worker
+BATCH_SIZE = 20
+
+# Retry delay doubles per failed attempt, from BACKOFF_SECONDS up to MAX_BACKOFF_SECONDS
+BACKOFF_SECONDS = 2.0
+MAX_BACKOFF_SECONDS = 300.0
+
+# Failed attempts after which an entry stops retrying (about 25 minutes of backoff)
+MAX_ATTEMPTS = 10
+
+# Idle worker checks for due retries this often (new entries wake it at once)
+POLL_SECONDS = 5.0
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        use_case_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        user_name TEXT,
+        payload TEXT NOT NULL,
+        enqueued_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT,
+        stopped TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_outbox_use_case ON outbox (use_case_id, seq);
+    CREATE TABLE IF NOT EXISTS sync_state (
+        use_case_id TEXT PRIMARY KEY,
+        synced_at REAL NOT NULL,
+        message TEXT,
+        document_version INTEGER
+    );
+"""
+
+# The oldest entry of every use case; later ones wait until it is synced
+HEADS_SQL = """
+    SELECT o.seq, o.use_case_id, o.kind, o.user_name, o.payload, o.attempts
+    FROM outbox o
+    JOIN (SELECT use_case_id, MIN(seq) AS seq FROM outbox GROUP BY use_case_id) h ON h.seq = o.seq
+    WHERE o.next_attempt_at <= ? AND o.stopped IS NULL
+    ORDER BY o.seq
+    LIMIT ?
+"""
+
+STATUS_SQL = """
+    SELECT o.use_case_id, COUNT(*), MAX(o.attempts), MIN(o.next_attempt_at),
+           (SELECT last_error FROM outbox e WHERE e.use_case_id = o.use_case_id ORDER BY seq LIMIT 1),
+           (SELECT stopped FROM outbox e WHERE e.use_case_id = o.use_case_id ORDER BY seq LIMIT 1)
+    FROM outbox o
+    GROUP BY o.use_case_id
+"""
+
+
+class Outbox:
+    """Durable queue of pending database writes, one SQLite file
+
+    Entries are 'save' (the whole use case document) or 'update' (the
+    targeted activity changes of an edit in the Excel-like view). A save
+    supersedes every earlier entry of its use case, since it carries the
+    complete document.
+
+    An entry that hit a document version conflict stops as 'conflict', one
+    that failed MAX_ATTEMPTS times as 'failed'; either holds back the later
+    entries of its use case until it is resolved or retried.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.wake = threading.Event()
+        with self._connect() as db:
+            db.executescript(SCHEMA_SQL)
+            # Outboxes created before entries could stop
+            if 'stopped' not in {row[1] for row in db.execute("PRAGMA table_info(outbox)")}:
+                db.execute("ALTER TABLE outbox ADD COLUMN stopped TEXT")
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=FULL")
+        return db
+
+    def enqueue(self, kind, use_case_id, payload, user_name):
+        """Commit one write to the outbox and wake the worker; returns its sequence number"""
+        now = time.time()
+        db = self._connect()
+        try:
+            with db:
+                if kind == 'save':
+                    # Superseded (an entry the worker is applying right now simply finishes)
+                    db.execute("DELETE FROM outbox WHERE use_case_id = ?", (use_case_id,))
+                cursor = db.execute(
+                    "INSERT INTO outbox (use_case_id, kind, user_name, payload, enqueued_at, next_attempt_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (use_case_id, kind, user_name, json.dumps(payload, default=str), now, now)
+                )
+                seq = cursor.lastrowid
+        finally:
+            db.close()
+        self.wake.set()
+        return seq
+
+    def due_entries(self, limit=BATCH_SIZE):
+        """Head entries (one per use case) whose next attempt is due, oldest first"""
+        db = self._connect()
+        try:
+            rows = db.execute(HEADS_SQL, (time.time(), limit)).fetchall()
+        finally:
+            db.close()
+        return [{
+            'seq': seq, 'use_case_id': use_case_id, 'kind': kind, 'user_name': user_name,
+            'payload': json.loads(payload), 'attempts': attempts
+        } for seq, use_case_id, kind, user_name, payload, attempts in rows]
+
+    def last_version(self, use_case_id):
+        """Document version of the use case's last synced save (document storage mode)"""
+        db = self._connect()
+        try:
+            row = db.execute("SELECT document_version FROM sync_state WHERE use_case_id = ?",
+                             (use_case_id,)).fetchone()
+        finally:
+            db.close()
+        return row[0] if row else None
+
+    def mark_synced(self, entry, message, document_version=None):
+        db = self._connect()
+        try:
+            with db:
+                db.execute("DELETE FROM outbox WHERE seq = ?", (entry['seq'],))
+                db.execute(
+                    "INSERT INTO sync_state (use_case_id, synced_at, message, document_version) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (use_case_id) DO UPDATE SET synced_at = excluded.synced_at, "
+                    "message = excluded.message, "
+                    "document_version = COALESCE(excluded.document_version, sync_state.document_version)",
+                    (entry['use_case_id'], time.time(), message, document_version)
+                )
+        finally:
+            db.close()
+
+    def mark_failed(self, entry, error):
+        """Schedule the next attempt with exponential backoff (jittered)
+
+        A version conflict fails the same way every time, so it stops at
+        once; any other error stops after MAX_ATTEMPTS.
+        """
+        attempts = entry['attempts'] + 1
+        delay = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+        if str(error) == CONFLICT_MESSAGE:
+            stopped = 'conflict'
+        elif attempts >= MAX_ATTEMPTS:
+            stopped = 'failed'
+        else:
+            stopped = None
+        db = self._connect()
+        try:
+            with db:
+                db.execute("UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, stopped = ? "
+                           "WHERE seq = ?", (attempts, time.time() + delay, str(error), stopped, entry['seq']))
+        finally:
+            db.close()
+
+    def retry_now(self, use_case_id=None):
+        """Make failed entries (of one use case, or all) due immediately
+
+        Entries that stopped after MAX_ATTEMPTS get one more attempt;
+        conflicts wait for resolve_conflict.
+        """
+        db = self._connect()
+        try:
+            with db:
+                where = "WHERE (stopped IS NULL OR stopped = 'failed')"
+                if use_case_id:
+                    db.execute(f"UPDATE outbox SET next_attempt_at = 0, stopped = NULL {where} AND use_case_id = ?",
+                               (use_case_id,))
+                else:
+                    db.execute(f"UPDATE outbox SET next_attempt_at = 0, stopped = NULL {where}")
+        finally:
+            db.close()
+        self.wake.set()
+
+    def resolve_conflict(self, use_case_id, document_version, overwrite):
+        """Settle a version conflict against the stored document_version
+
+        overwrite sends the queued entries again on top of that version;
+        otherwise they are dropped (the local copy was reloaded).
+        """
+        db = self._connect()
+        try:
+            with db:
+                db.execute(
+                    "INSERT INTO sync_state (use_case_id, synced_at, message, document_version) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (use_case_id) DO UPDATE SET document_version = excluded.document_version",
+                    (use_case_id, time.time(), None, document_version)
+                )
+                if overwrite:
+                    db.execute("UPDATE outbox SET next_attempt_at = 0, attempts = 0, stopped = NULL "
+                               "WHERE use_case_id = ?", (use_case_id,))
+                else:
+                    db.execute("DELETE FROM outbox WHERE use_case_id = ?", (use_case_id,))
+        finally:
+            db.close()
+        self.wake.set()
+
+    def statuses(self):
+        """{use_case_id: sync status} of every use case with a queued or synced write
+
+        state is 'pending' (queued, not failed yet), 'retrying' (last attempt
+        failed), 'conflict' (stopped on a version conflict), 'failed' (stopped
+        after MAX_ATTEMPTS) or 'synced'.
+        """
+        db = self._connect()
+        try:
+            synced = db.execute("SELECT use_case_id, synced_at, message FROM sync_state").fetchall()
+            queued = db.execute(STATUS_SQL).fetchall()
+        finally:
+            db.close()
+
+        statuses = {use_case_id: {
+            'state': 'synced', 'pending': 0, 'attempts': 0, 'next_attempt_at': None, 'last_error': None,
+            'synced_at': datetime.fromtimestamp(synced_at), 'message': message
+        } for use_case_id, synced_at, message in synced}
+        for use_case_id, pending, attempts, next_attempt_at, last_error, stopped in queued:
+            status = statuses.setdefault(use_case_id, {'synced_at': None, 'message': None})
+            status.update({
+                'state': stopped or ('retrying' if attempts else 'pending'),
+                'pending': pending,
+                'attempts': attempts,
+                'next_attempt_at': datetime.fromtimestamp(next_attempt_at) if attempts else None,
+                'last_error': last_error
+            })
+        return statuses
+
+    def sync_pass(self, apply, limit=BATCH_SIZE):
+        """Apply up to limit due head entries; returns (synced, failed)
+
+        apply(kind, payload, user_name) performs the write and returns
+        (success, message). In document storage mode the expected version is
+        the newer of the one the entry's copy was loaded at and the one the
+        previous synced save of the use case produced.
+        """
+        synced = failed = 0
+        for entry in self.due_entries(limit):
+            use_case = entry['payload'].get('use_case')
+            if use_case is not None:
+                versions = [version for version in (use_case.get(VERSION_KEY), self.last_version(entry['use_case_id']))
+                            if version is not None]
+                if versions:
+                    use_case[VERSION_KEY] = max(versions)
+            try:
+                success, message = apply(entry['kind'], entry['payload'], entry['user_name'])
+            except Exception as e:
+                success, message = False, str(e)
+
+            if success:
+                self.mark_synced(entry, message, use_case.get(VERSION_KEY) if use_case else None)
+                synced += 1
+            else:
+                self.mark_failed(entry, message)
+                failed += 1
+        return synced, failed
+
+    def run(self, apply, stop=None):
+        """Worker loop: drain due entries, then wait for new ones or the next poll"""
+        while stop is None or not stop.is_set():
+            try:
+                synced, _ = self.sync_pass(apply) if Config.validate() else (0, 0)
+            except Exception as e:
+                print(f"Error syncing outbox: {e}")
+                synced = 0
+            if not synced:
+                self.wake.wait(POLL_SECONDS)
+                self.wake.clear()
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def start_worker(path, apply):
+    """The process-wide outbox for path, with its background worker started on first call"""
+    with _workers_lock:
+        key = str(Path(path).resolve())
+        if key not in _workers:
+            outbox = Outbox(path)
+            thread = threading.Thread(target=outbox.run, args=(apply,), name="outbox-worker", daemon=True)
+            thread.start()
+            _workers[key] = outbox
+        return _workers[key]
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Inspect or drain the use case save outbox")
+    parser.add_argument('--path', default=str(DEFAULT_PATH), help="Outbox file")
+    parser.add_argument('--retry', action='store_true',
+                        help="Make failed saves due now (the running app's worker picks them up)")
+    args = parser.parse_args(argv)
+
+    outbox = Outbox(args.path)
+    if args.retry:
+        outbox.retry_now()
+
+    for use_case_id, status in sorted(outbox.statuses().items()):
+        detail = status['last_error'] or status['message'] or ''
+        print(f"{use_case_id:<20} {status['state']:<9} {status['pending']:>3} queued  {detail}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
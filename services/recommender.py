@@ -0,0 +1,334 @@
+"""
+Similar past plans for a new use case
+Hashed word n-gram TF-IDF vectors over plan names, outcomes, questions and notes from
+test.maps and test.use_case_maps, held as a sparse inverted index updated on save
+
+Usage:
+    python -m services.recommender "customer churn lakehouse migration" [--top 5]
+"""
+
+import argparse
+import re
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from config import Config
+from services.lakebase import lakebase
+
+# Hashed feature space: no vocabulary to fit, so documents can be added at any time
+N_FEATURES = 2 ** 20
+
+DEFAULT_TOP_K = 5
+
+# Documents added since the last compaction are scored directly; beyond this
+# many the inverted index (and every document norm) is rebuilt
+COMPACT_AFTER = 256
+
+# App-created plans saved by other sessions are picked up this often
+SYNC_SECONDS = 60
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+MAPS_DOCUMENTS_SQL = """
+    SELECT 'maps', "ID", NULL, NULL, COUNT(*), MIN("Start_Date"), MAX("End_Date"),
+           string_agg(concat_ws(' ', COALESCE("Outcome", "Action"), "Embedded_Questions", "Notes"), ' ')
+    FROM test.maps
+    WHERE "ID" IS NOT NULL AND "ID" != '' AND "ID" NOT LIKE '%/%' AND "Stage" IS NOT NULL
+    GROUP BY "ID"
+"""
+
+USE_CASE_DOCUMENTS_SQL = """
+    SELECT 'use_case_maps', use_case_id, MAX(use_case_name), MAX(customer_name), COUNT(*),
+           MIN("Start_Date"), MAX("End_Date"),
+           string_agg(concat_ws(' ', "Outcome", "Embedded_Questions", "Notes"), ' ')
+    FROM test.use_case_maps
+    WHERE use_case_id IS NOT NULL AND use_case_id != ''
+    GROUP BY use_case_id
+    HAVING MAX(updated_at) >= %(since)s
+"""
+
+
+def hashed_features(text):
+    """Sorted feature ids and sublinear term frequencies of the text's unigrams and bigrams"""
+    tokens = TOKEN_RE.findall((text or '').lower())
+    grams = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    if not grams:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    # crc32 rather than hash(): ids must not change between processes
+    ids = np.fromiter((zlib.crc32(gram.encode()) % N_FEATURES for gram in grams), dtype=np.int64, count=len(grams))
+    features, counts = np.unique(ids, return_counts=True)
+    return features, 1.0 + np.log(counts)
+
+
+def use_case_document(use_case):
+    """(map entry, text) of a locally stored use case, as indexed after a save"""
+    activities = [activity for stage in use_case.get('stages', []) for activity in stage['activities']]
+    text = ' '.join([use_case.get('name', '')] + [
+        f"{activity.get('activity', '')} {activity.get('description', '')} {activity.get('notes', '')}"
+        for activity in activities
+    ])
+    entry = {
+        'id': use_case['use_case_id'],
+        'name': use_case.get('name'),
+        'customer': use_case.get('customer'),
+        'activity_count': len(activities),
+        'start_date': use_case.get('start_date'),
+        'end_date': None,
+        'source': 'use_case_maps',
+        'editable': True
+    }
+    return entry, text
+
+
+class SimilarityIndex:
+    """Cosine similarity search over hashed TF-IDF vectors
+
+    Rows are kept as per-document (features, tf) arrays; the compacted part is
+    an inverted index (postings sorted by feature) so a query only touches the
+    postings of its own features, summed per document with one bincount.
+    Replaced documents are tombstoned and dropped at the next compaction.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.row_features = []
+        self.row_tf = []
+        self.rows_by_key = {}
+        self.alive = np.zeros(0, dtype=bool)
+        self.norms = np.zeros(0)
+        self.df = np.zeros(N_FEATURES, dtype=np.int32)
+        self.documents = 0
+        self.pending = []
+        self.lock = threading.Lock()
+        self._postings = (np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64),
+                          np.zeros(0, dtype=np.int64), np.zeros(0))
+
+    def idf(self, features):
+        """Smoothed inverse document frequency of the given features"""
+        return np.log((1.0 + self.documents) / (1.0 + self.df[features])) + 1.0
+
+    def __len__(self):
+        return self.documents
+
+    def add(self, entry, text):
+        """Index (or re-index) one map; entry is its map dict with 'source' and 'id'"""
+        features, tf = hashed_features(text)
+        key = (entry['source'], str(entry['id']))
+        with self.lock:
+            self._remove(key)
+            row = len(self.entries)
+            self.entries.append(entry)
+            self.row_features.append(features)
+            self.row_tf.append(tf)
+            self.rows_by_key[key] = row
+            self.df[features] += 1
+            self.documents += 1
+            self.alive = np.append(self.alive, True)
+            self.norms = np.append(self.norms, np.sqrt(np.sum((tf * self.idf(features)) ** 2)))
+            self.pending.append(row)
+            if len(self.pending) > COMPACT_AFTER:
+                self._compact()
+
+    def add_many(self, documents):
+        """Bulk load [(entry, text)], compacting once at the end"""
+        with self.lock:
+            self.alive = np.concatenate([self.alive, np.ones(len(documents), dtype=bool)])
+            for entry, text in documents:
+                features, tf = hashed_features(text)
+                key = (entry['source'], str(entry['id']))
+                self._remove(key)
+                self.rows_by_key[key] = len(self.entries)
+                self.entries.append(entry)
+                self.row_features.append(features)
+                self.row_tf.append(tf)
+                self.df[features] += 1
+                self.documents += 1
+            self._compact()
+
+    def remove(self, source, map_id):
+        """Drop a map from the results"""
+        with self.lock:
+            self._remove((source, str(map_id)))
+
+    def _remove(self, key):
+        row = self.rows_by_key.pop(key, None)
+        if row is not None:
+            self.alive[row] = False
+            self.df[self.row_features[row]] -= 1
+            self.documents -= 1
+
+    def _compact(self):
+        """Drop tombstoned rows, renumbering the live ones, and rebuild the inverted index and norms"""
+        live = np.flatnonzero(self.alive)
+        renumbered = {int(row): new_row for new_row, row in enumerate(live)}
+        self.entries = [self.entries[row] for row in live]
+        self.row_features = [self.row_features[row] for row in live]
+        self.row_tf = [self.row_tf[row] for row in live]
+        self.rows_by_key = {key: renumbered[row] for key, row in self.rows_by_key.items()}
+        self.alive = np.ones(len(live), dtype=bool)
+
+        if len(live):
+            lengths = np.array([len(features) for features in self.row_features])
+            features = np.concatenate(self.row_features)
+            tf = np.concatenate(self.row_tf)
+        else:
+            lengths, features, tf = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        rows = np.repeat(np.arange(len(live)), lengths)
+
+        order = np.argsort(features, kind='stable')
+        features, rows, tf = features[order], rows[order], tf[order]
+        unique, starts = np.unique(features, return_index=True)
+        self._postings = (unique, np.append(starts, len(features)), rows, tf)
+
+        weights = tf * self.idf(features)
+        self.norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(self.entries)))
+        self.pending = []
+
+    def search(self, text, top_k=DEFAULT_TOP_K, exclude=()):
+        """Top-k [(entry, similarity)] for the text, best first"""
+        features, tf = hashed_features(text)
+        if not len(features):
+            return []
+
+        with self.lock:
+            if not self.documents:
+                return []
+            query = tf * self.idf(features)
+            query_norm = np.sqrt(np.sum(query ** 2))
+            # Document side weight is tf * idf, so each posting contributes tf * idf^2 * query tf
+            query_weights = query * self.idf(features)
+
+            unique, starts, rows, posting_tf = self._postings
+            positions = np.searchsorted(unique, features)
+            found = (positions < len(unique)) & (unique[np.minimum(positions, len(unique) - 1)] == features)
+            slices = [(starts[pos], starts[pos + 1], weight)
+                      for pos, weight in zip(positions[found], query_weights[found])]
+            hit_rows = np.concatenate([rows[start:end] for start, end, _ in slices] or [np.zeros(0, dtype=np.int64)])
+            hit_weights = np.concatenate([posting_tf[start:end] * weight for start, end, weight in slices] or [np.zeros(0)])
+            scores = np.bincount(hit_rows, weights=hit_weights, minlength=len(self.entries))
+
+            # Documents added since the last compaction
+            for row in self.pending:
+                common, query_idx, row_idx = np.intersect1d(features, self.row_features[row],
+                                                            assume_unique=True, return_indices=True)
+                if len(common):
+                    scores[row] += np.sum(query_weights[query_idx] * self.row_tf[row][row_idx])
+
+            scores = np.where(self.alive & (self.norms > 0), scores / np.maximum(self.norms, 1e-12) / query_norm, 0.0)
+            for source, map_id in exclude:
+                row = self.rows_by_key.get((source, str(map_id)))
+                if row is not None:
+                    scores[row] = 0.0
+
+            count = min(top_k, int(np.count_nonzero(scores)))
+            if not count:
+                return []
+            best = np.argpartition(-scores, count - 1)[:count]
+            best = best[np.argsort(-scores[best])]
+            return [(self.entries[row], float(scores[row])) for row in best]
+
+
+_index_state = {'index': None, 'synced_at': datetime.min, 'checked_at': 0.0}
+_index_lock = threading.Lock()
+
+
+def _document(row):
+    """(map entry, text) of a documents query row"""
+    source, map_id, name, customer, activity_count, start_date, end_date, text = row
+    return {
+        'id': map_id,
+        'name': name,
+        'customer': customer,
+        'activity_count': activity_count,
+        'start_date': start_date,
+        'end_date': end_date,
+        'source': source,
+        'editable': source == 'use_case_maps'
+    }, ' '.join(part for part in (name, text) if part)
+
+
+def _use_case_documents(since):
+    """Documents of the app-created plans changed since the watermark, and the new watermark"""
+    result = lakebase.query("SELECT MAX(updated_at) FROM test.use_case_maps")
+    watermark = result[0][0] if result and result[0][0] else since
+    return [_document(row) for row in lakebase.query(USE_CASE_DOCUMENTS_SQL, {'since': since}) or []], watermark
+
+
+def build_index():
+    """Full index over both tables; returns (index, use_case_maps watermark)"""
+    lakebase.create_use_case_maps_table()
+    documents, watermark = _use_case_documents(datetime.min)
+    documents += [_document(row) for row in lakebase.query(MAPS_DOCUMENTS_SQL) or []]
+    index = SimilarityIndex()
+    index.add_many(documents)
+    return index, watermark
+
+
+def get_index():
+    """The process-wide index, built on first use and synced at most every SYNC_SECONDS
+
+    Returns None without a database.
+    """
+    with _index_lock:
+        state = _index_state
+        if time.monotonic() - state['checked_at'] < SYNC_SECONDS:
+            return state['index']
+
+        if Config.validate():
+            try:
+                if state['index'] is None:
+                    state['index'], state['synced_at'] = build_index()
+                else:
+                    documents, state['synced_at'] = _use_case_documents(state['synced_at'])
+                    for entry, text in documents:
+                        state['index'].add(entry, text)
+            except Exception as e:
+                print(f"Error syncing similar plans index: {e}")
+        state['checked_at'] = time.monotonic()
+        return state['index']
+
+
+def index_use_case(use_case):
+    """Re-index a use case just saved to the database (no-op before the index exists)"""
+    index = _index_state['index']
+    if index is not None:
+        index.add(*use_case_document(use_case))
+
+
+def similar_maps(text, top_k=DEFAULT_TOP_K, exclude=()):
+    """Top-k [(map entry, similarity)] for the text; empty without a database"""
+    index = get_index()
+    return index.search(text, top_k, exclude) if index is not None else []
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Find past plans similar to a description")
+    parser.add_argument('text', help="Use case name or description")
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP_K, help="Number of results")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    index, _ = build_index()
+    lakebase.close()
+    built = time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = index.search(args.text, args.top)
+    searched = time.perf_counter() - started
+
+    for entry, score in results:
+        label = entry['id'] if entry['source'] == 'use_case_maps' else f"Map #{entry['id']}"
+        print(f"{score:.3f}  {label}  {entry.get('name') or ''}  {entry.get('customer') or ''}")
+    print(f"Indexed {len(index)} maps in {built:.2f}s, searched in {searched * 1000:.1f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Row-per-activity storage for use cases
+The original layout: the use case document is shredded into one wide test.use_case_maps
+row per activity on save and reassembled from those rows on load
+"""
+
+from datetime import datetime
+
+from plan_utils import plan_db_rows, progress_status
+from services.lakebase import lakebase
+
+INSERT_ROWS_SQL = """
+    INSERT INTO test.use_case_maps (
+        use_case_id, use_case_name, customer_name, "Stage", "Outcome",
+        "Embedded_Questions", "Owner_Name", "Start_Date", "End_Date",
+        "Progress", "Notes", "Action", solution_architect, account_executive,
+        ssa_required, poc_required, created_by, created_at, updated_by, updated_at, position
+    ) VALUES %s
+"""
+
+ROW_VALUES = """(
+    %(use_case_id)s, %(use_case_name)s, %(customer_name)s, %(Stage)s, %(Outcome)s,
+    %(Embedded_Questions)s, %(Owner_Name)s, %(Start_Date)s, %(End_Date)s,
+    %(Progress)s, %(Notes)s, %(Action)s, %(solution_architect)s, %(account_executive)s,
+    %(ssa_required)s, %(poc_required)s, %(created_by)s, %(created_at)s, %(updated_by)s, %(updated_at)s,
+    %(position)s
+)"""
+
+# Creation of the rows being replaced, so a re-save keeps the plan's original
+# created_at (and with it its month partition)
+CREATED_SQL = """
+    SELECT (array_agg(created_by ORDER BY created_at))[1], MIN(created_at)
+    FROM test.use_case_maps
+    WHERE use_case_id = %(use_case_id)s
+"""
+
+# {table} is test.use_case_maps or, for the delta layout, test.use_case_maps_expanded
+LOAD_ROWS_SQL = """
+    SELECT use_case_name, customer_name, solution_architect, account_executive,
+           ssa_required, poc_required, created_by, created_at,
+           "Stage", "Outcome", "Embedded_Questions", "Owner_Name",
+           "Start_Date", "End_Date", "Progress", "Notes"
+    FROM {table}
+    WHERE use_case_id = %(use_case_id)s
+    ORDER BY position NULLS LAST, p_id
+"""
+
+
+def plan_created_at(use_case_data):
+    """When the plan was created, per its own created_at; None if unknown"""
+    try:
+        return datetime.fromisoformat(use_case_data['created_at']).replace(tzinfo=None)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def save_use_case_rows(use_case_data, user_name):
+    """Replace the use case's test.use_case_maps rows, one per activity; returns (success, message)
+
+    Earlier rows are deleted in the same transaction, so repeated saves no
+    longer leave copies of every activity behind. Rows created before the
+    plan itself belong to another plan that got the same id and are never
+    replaced.
+    """
+    try:
+        lakebase.connect()
+
+        # First ensure the table exists
+        lakebase.create_use_case_maps_table()
+
+        now = datetime.now()
+        with lakebase.transaction() as cursor:
+            cursor.execute(CREATED_SQL, {'use_case_id': use_case_data['use_case_id']})
+            created_by, created_at = cursor.fetchone()
+            plan_created = plan_created_at(use_case_data)
+            collision = bool(created_at and plan_created and created_at < plan_created)
+
+            # Prepare rows for insertion - one row per activity, numbered in view order
+            rows = []
+            for position, (stage_code, activity, fields) in enumerate(plan_db_rows(use_case_data)):
+                row = {
+                    'use_case_id': use_case_data['use_case_id'],
+                    'use_case_name': use_case_data['name'],
+                    'customer_name': use_case_data['customer'],
+                    'Stage': stage_code,
+                    **fields,
+                    'solution_architect': use_case_data.get('solution_architect', ''),
+                    'account_executive': use_case_data.get('account_executive', ''),
+                    'ssa_required': use_case_data.get('ssa_required', False),
+                    'poc_required': use_case_data.get('poc_happening', False),
+                    'created_by': created_by or user_name,
+                    'created_at': created_at or now,
+                    'updated_by': user_name,
+                    'updated_at': now,
+                    'position': position
+                }
+                rows.append(row)
+
+            if not collision:
+                cursor.execute("DELETE FROM test.use_case_maps WHERE use_case_id = %s",
+                               (use_case_data['use_case_id'],))
+                lakebase.insert_rows(cursor, INSERT_ROWS_SQL, ROW_VALUES, rows)
+        lakebase.close()
+
+        if collision:
+            return False, (f"Use case id {use_case_data['use_case_id']} already belongs to a plan created by "
+                           f"{created_by} on {created_at:%Y-%m-%d %H:%M}; its rows were not replaced")
+
+        return True, f"Successfully saved {len(rows)} activities to database"
+
+    except Exception as e:
+        return False, f"Failed to save to database: {str(e)}"
+
+
+def load_use_case_rows(use_case_id, table='test.use_case_maps'):
+    """Reassemble the use case document from its activity rows; None if it has none"""
+    rows = lakebase.query(LOAD_ROWS_SQL.format(table=table), {'use_case_id': use_case_id}) or []
+    if not rows:
+        return None
+
+    name, customer, solution_architect, account_executive, ssa_required, poc_required, created_by, created_at = rows[0][:8]
+    start_date = min((row[12] for row in rows if row[12]), default=None)
+    stages = {}
+    for stage, outcome, questions, owner, start, end, progress, notes in (row[8:] for row in rows):
+        stages.setdefault(stage, []).append({
+            'activity': outcome,
+            'description': questions or '',
+            'owner': owner or '',
+            'duration_days': max((end - start).days, 1) if start and end else 5,
+            'status': progress_status(progress),
+            'notes': notes or ''
+        })
+
+    return {
+        'use_case_id': use_case_id,
+        'user_id': created_by,
+        'name': name,
+        'customer': customer,
+        'solution_architect': solution_architect or '',
+        'account_executive': account_executive or '',
+        'ssa_required': bool(ssa_required),
+        'poc_happening': bool(poc_required),
+        'start_date': start_date.isoformat() if start_date else None,
+        'status': 'Planning',
+        'created_at': created_at.isoformat() if created_at else None,
+        'stages': [{'stage_name': stage, 'activities': activities} for stage, activities in stages.items()]
+    }
@@ -0,0 +1,594 @@
+"""
+Migration of test.use_case_maps to the normalised use case schema
+Backfills the wide table into test.use_cases (headers) and test.use_case_activities online,
+in batched transactions, then swaps in a view named test.use_case_maps for existing readers.
+The wide table can also be converted to monthly range partitions on created_at.
+
+Usage:
+    python -m services.schema_migration status
+    python -m services.schema_migration backfill [--batch-size 200] [--pause 0.1]
+    python -m services.schema_migration switch
+    python -m services.schema_migration partition [--batch-size 5000] [--pause 0.1]
+    python -m services.schema_migration partitions [--months-ahead 3]
+"""
+
+import argparse
+import re
+import sys
+import time
+from datetime import date
+
+from services.delta_storage import current_template, mark_template_synced, sync_template_activities
+from services.lakebase import lakebase
+
+DEFAULT_BATCH_SIZE = 200
+
+# The wide table keeps its data under this name after the switch
+WIDE_TABLE = 'use_case_maps_wide'
+
+# Use cases whose wide rows changed since they were copied (or never were)
+PENDING_SQL = """
+    SELECT m.use_case_id
+    FROM test.use_case_maps m
+    LEFT JOIN test.use_cases h ON h.use_case_id = m.use_case_id
+    WHERE m.use_case_id IS NOT NULL AND m.use_case_id != ''
+    GROUP BY m.use_case_id
+    HAVING MAX(h.updated_at) IS NULL OR MAX(m.updated_at) > MAX(h.updated_at)
+    ORDER BY m.use_case_id
+"""
+
+# Copies of use cases deleted or archived from the wide table after they were
+# backfilled (their activities go with them, ON DELETE CASCADE)
+ORPHANED_SQL = """
+    DELETE FROM test.use_cases h
+    WHERE NOT EXISTS (SELECT 1 FROM test.use_case_maps m WHERE m.use_case_id = h.use_case_id)
+"""
+
+# The header takes the latest name/customer/team and the earliest creation;
+# its updated_at is the wide rows' latest so later edits show up as pending
+COPY_HEADERS_SQL = """
+    INSERT INTO test.use_cases (
+        use_case_id, use_case_name, customer_name, solution_architect, account_executive,
+        ssa_required, poc_required, start_date, template_version,
+        created_by, created_at, updated_by, updated_at
+    )
+    SELECT use_case_id,
+           (array_agg(use_case_name ORDER BY updated_at DESC))[1],
+           (array_agg(customer_name ORDER BY updated_at DESC))[1],
+           (array_agg(solution_architect ORDER BY updated_at DESC))[1],
+           (array_agg(account_executive ORDER BY updated_at DESC))[1],
+           COALESCE(bool_or(ssa_required), FALSE), COALESCE(bool_or(poc_required), FALSE),
+           MIN("Start_Date"), %(template_version)s,
+           (array_agg(created_by ORDER BY created_at))[1], MIN(created_at),
+           (array_agg(updated_by ORDER BY updated_at DESC))[1], MAX(updated_at)
+    FROM test.use_case_maps
+    WHERE use_case_id = ANY(%(use_case_ids)s)
+    GROUP BY use_case_id
+    ON CONFLICT (use_case_id) DO UPDATE
+    SET use_case_name = EXCLUDED.use_case_name,
+        customer_name = EXCLUDED.customer_name,
+        solution_architect = EXCLUDED.solution_architect,
+        account_executive = EXCLUDED.account_executive,
+        ssa_required = EXCLUDED.ssa_required,
+        poc_required = EXCLUDED.poc_required,
+        start_date = EXCLUDED.start_date,
+        template_version = EXCLUDED.template_version,
+        updated_by = EXCLUDED.updated_by,
+        updated_at = EXCLUDED.updated_at
+"""
+
+# Activities keep their plan order (stored position, then p_id); template text is dropped where it matches
+COPY_ACTIVITIES_SQL = """
+    INSERT INTO test.use_case_activities (
+        use_case_id, position, activity_key, "Stage", "Outcome", "Embedded_Questions",
+        "Owner_Name", "Start_Date", "End_Date", "Progress", "Notes"
+    )
+    SELECT m.use_case_id,
+           (row_number() OVER (PARTITION BY m.use_case_id ORDER BY m.position NULLS LAST, m.p_id) - 1)::smallint,
+           t.activity_key,
+           CASE WHEN t.activity_key IS NULL THEN m."Stage" END,
+           CASE WHEN t."Outcome" IS NOT DISTINCT FROM m.outcome THEN NULL ELSE m.outcome END,
+           CASE WHEN t."Embedded_Questions" IS NOT DISTINCT FROM m."Embedded_Questions"
+                THEN NULL ELSE m."Embedded_Questions" END,
+           CASE WHEN test.substitute_owner(t."Owner_Name", h.solution_architect, h.account_executive)
+                     IS NOT DISTINCT FROM m."Owner_Name"
+                THEN NULL ELSE m."Owner_Name" END,
+           m."Start_Date", m."End_Date", NULLIF(m."Progress", 0), NULLIF(m."Notes", '')
+    FROM (
+        SELECT *, COALESCE("Outcome", "Action") AS outcome
+        FROM test.use_case_maps
+        WHERE use_case_id = ANY(%(use_case_ids)s)
+    ) m
+    JOIN test.use_cases h ON h.use_case_id = m.use_case_id
+    LEFT JOIN test.template_activities t
+      ON t.template_version = h.template_version
+     AND t.activity_key = test.activity_key(m."Stage", m.outcome)
+    ORDER BY m.use_case_id, m.p_id
+"""
+
+# Writes through the compatibility view: header upserted (only when its fields
+# change; a new one takes the most recently stored template version), activity
+# stored as a delta against the header's template version
+WRITE_TRIGGER_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION test.use_case_maps_write() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        hdr test.use_cases%ROWTYPE;
+        tpl test.template_activities%ROWTYPE;
+        v_outcome TEXT;
+        v_stage TEXT;
+        v_questions TEXT;
+        v_owner TEXT;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM test.use_case_activities WHERE p_id = OLD.p_id;
+            DELETE FROM test.use_cases h
+            WHERE h.use_case_id = OLD.use_case_id
+            AND NOT EXISTS (SELECT 1 FROM test.use_case_activities a WHERE a.use_case_id = OLD.use_case_id);
+            RETURN OLD;
+        END IF;
+
+        INSERT INTO test.use_cases AS h (
+            use_case_id, use_case_name, customer_name, solution_architect, account_executive,
+            ssa_required, poc_required, start_date, template_version,
+            created_by, created_at, updated_by, updated_at
+        ) VALUES (
+            NEW.use_case_id, NEW.use_case_name, NEW.customer_name, NEW.solution_architect, NEW.account_executive,
+            COALESCE(NEW.ssa_required, FALSE), COALESCE(NEW.poc_required, FALSE), NEW."Start_Date",
+            (SELECT template_version FROM test.template_activities ORDER BY stored_at DESC LIMIT 1),
+            NEW.created_by, COALESCE(NEW.created_at, now()), NEW.updated_by, COALESCE(NEW.updated_at, now())
+        )
+        ON CONFLICT (use_case_id) DO UPDATE
+        SET use_case_name = EXCLUDED.use_case_name,
+            customer_name = EXCLUDED.customer_name,
+            solution_architect = EXCLUDED.solution_architect,
+            account_executive = EXCLUDED.account_executive,
+            ssa_required = EXCLUDED.ssa_required,
+            poc_required = EXCLUDED.poc_required,
+            start_date = LEAST(h.start_date, EXCLUDED.start_date),
+            updated_by = EXCLUDED.updated_by,
+            updated_at = EXCLUDED.updated_at
+        WHERE (h.use_case_name, h.customer_name, h.solution_architect, h.account_executive,
+               h.ssa_required, h.poc_required, h.updated_by, h.updated_at)
+              IS DISTINCT FROM
+              (EXCLUDED.use_case_name, EXCLUDED.customer_name, EXCLUDED.solution_architect,
+               EXCLUDED.account_executive, EXCLUDED.ssa_required, EXCLUDED.poc_required,
+               EXCLUDED.updated_by, EXCLUDED.updated_at)
+           OR EXCLUDED.start_date < h.start_date
+        RETURNING * INTO hdr;
+
+        IF hdr.use_case_id IS NULL THEN
+            SELECT * INTO hdr FROM test.use_cases WHERE use_case_id = NEW.use_case_id;
+        END IF;
+
+        v_outcome := COALESCE(NEW."Outcome", NEW."Action");
+        SELECT * INTO tpl FROM test.template_activities t
+        WHERE t.template_version = hdr.template_version
+        AND t.activity_key = test.activity_key(NEW."Stage", v_outcome);
+
+        v_stage := CASE WHEN tpl.activity_key IS NULL THEN NEW."Stage" END;
+        IF tpl."Outcome" IS NOT DISTINCT FROM v_outcome THEN v_outcome := NULL; END IF;
+        v_questions := CASE WHEN tpl."Embedded_Questions" IS NOT DISTINCT FROM NEW."Embedded_Questions"
+                            THEN NULL ELSE NEW."Embedded_Questions" END;
+        v_owner := CASE WHEN test.substitute_owner(tpl."Owner_Name", hdr.solution_architect, hdr.account_executive)
+                             IS NOT DISTINCT FROM NEW."Owner_Name"
+                        THEN NULL ELSE NEW."Owner_Name" END;
+
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO test.use_case_activities (
+                use_case_id, position, activity_key, "Stage", "Outcome", "Embedded_Questions",
+                "Owner_Name", "Start_Date", "End_Date", "Progress", "Notes"
+            ) VALUES (
+                NEW.use_case_id,
+                COALESCE(NEW.position, (SELECT COALESCE(MAX(a.position) + 1, 0) FROM test.use_case_activities a
+                                        WHERE a.use_case_id = NEW.use_case_id)),
+                tpl.activity_key, v_stage, v_outcome, v_questions,
+                v_owner, NEW."Start_Date", NEW."End_Date", NULLIF(NEW."Progress", 0), NULLIF(NEW."Notes", '')
+            )
+            RETURNING p_id INTO NEW.p_id;
+        ELSE
+            UPDATE test.use_case_activities
+            SET use_case_id = NEW.use_case_id,
+                position = COALESCE(NEW.position, position),
+                activity_key = tpl.activity_key,
+                "Stage" = v_stage,
+                "Outcome" = v_outcome,
+                "Embedded_Questions" = v_questions,
+                "Owner_Name" = v_owner,
+                "Start_Date" = NEW."Start_Date",
+                "End_Date" = NEW."End_Date",
+                "Progress" = NULLIF(NEW."Progress", 0),
+                "Notes" = NULLIF(NEW."Notes", '')
+            WHERE p_id = OLD.p_id;
+        END IF;
+        RETURN NEW;
+    END
+    $$
+"""
+
+# The unpartitioned wide table keeps its data under this name after partitioning
+UNPARTITIONED_TABLE = 'use_case_maps_unpartitioned'
+
+# Partitioned copy of the wide table while it is being filled
+PARTITIONED_TABLE = 'use_case_maps_partitioned'
+
+DEFAULT_PARTITION = 'use_case_maps_default'
+DEFAULT_COPY_BATCH_ROWS = 5000
+DEFAULT_MONTHS_AHEAD = 3
+
+PARTITION_NAME_RE = re.compile(r'^use_case_maps_p(\d{4})_(\d{2})$')
+
+WIDE_COLUMNS = """
+    p_id, use_case_id, use_case_name, customer_name, "Stage", "Outcome",
+    "Embedded_Questions", "Owner_Name", "Start_Date", "End_Date",
+    "Progress", "Notes", "Action", solution_architect, account_executive,
+    ssa_required, poc_required, created_by, created_at, updated_by, updated_at, position
+"""
+
+# created_at is the partition key and part of the primary key, so never NULL
+WIDE_SELECT = WIDE_COLUMNS.replace("created_at,", "COALESCE(created_at, updated_at, now()),")
+
+COPY_ROWS_SQL = f"""
+    INSERT INTO test.{PARTITIONED_TABLE} ({WIDE_COLUMNS})
+    SELECT {WIDE_SELECT}
+    FROM test.use_case_maps
+    WHERE p_id > %(after)s
+    ORDER BY p_id
+    LIMIT %(limit)s
+    RETURNING p_id
+"""
+
+# Under the switch lock: drop copies of rows updated or deleted since they were
+# copied, then copy every row not (or no longer) in the partitioned table
+DROP_STALE_COPIES_SQL = f"""
+    DELETE FROM test.{PARTITIONED_TABLE} n
+    WHERE NOT EXISTS (
+        SELECT 1 FROM test.use_case_maps o
+        WHERE o.p_id = n.p_id AND o.updated_at IS NOT DISTINCT FROM n.updated_at
+    )
+"""
+
+COPY_MISSING_ROWS_SQL = f"""
+    INSERT INTO test.{PARTITIONED_TABLE} ({WIDE_COLUMNS})
+    SELECT {WIDE_SELECT}
+    FROM test.use_case_maps o
+    WHERE NOT EXISTS (SELECT 1 FROM test.{PARTITIONED_TABLE} n WHERE n.p_id = o.p_id)
+"""
+
+RELKIND_SQL = """
+    SELECT c.relkind
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'test' AND c.relname = %(table)s
+"""
+
+PARTITIONS_SQL = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    JOIN pg_class p ON p.oid = i.inhparent
+    JOIN pg_namespace n ON n.oid = p.relnamespace
+    WHERE n.nspname = 'test' AND p.relname = %(parent)s
+    ORDER BY c.relname
+"""
+
+IS_VIEW_SQL = """
+    SELECT table_type = 'VIEW'
+    FROM information_schema.tables
+    WHERE table_schema = 'test' AND table_name = 'use_case_maps'
+"""
+
+_state = {'normalised': False}
+
+
+def normalised_schema_active():
+    """Whether test.use_case_maps is already the compatibility view (cached once true)"""
+    if not _state['normalised']:
+        result = lakebase.query(IS_VIEW_SQL)
+        _state['normalised'] = bool(result and result[0][0])
+    return _state['normalised']
+
+
+def pending_use_cases():
+    """Ids of the use cases the backfill still has to copy"""
+    return [row[0] for row in lakebase.query(PENDING_SQL) or []]
+
+
+def copy_use_cases(cursor, use_case_ids, template_version):
+    """Copy use cases from the wide table, replacing any earlier copy; returns activities copied"""
+    params = {'use_case_ids': use_case_ids, 'template_version': template_version}
+    cursor.execute("DELETE FROM test.use_case_activities WHERE use_case_id = ANY(%(use_case_ids)s)", params)
+    cursor.execute(COPY_HEADERS_SQL, params)
+    cursor.execute(COPY_ACTIVITIES_SQL, params)
+    return cursor.rowcount
+
+
+def backfill(batch_size=DEFAULT_BATCH_SIZE, pause=0.0, max_passes=10, progress=None):
+    """Copy the wide table into the normalised tables while the app keeps writing
+
+    Each batch of use cases is one short transaction; passes repeat until no
+    use case changed since its copy (or max_passes). pause sleeps between
+    batches to leave room for interactive traffic. Returns a report dict.
+    """
+    lakebase.create_use_case_maps_table()
+    lakebase.create_delta_storage_tables()
+    if normalised_schema_active():
+        return {'use_cases': 0, 'activities': 0, 'batches': 0, 'passes': 0, 'pending': 0}
+
+    template_version, template = current_template()
+    with lakebase.transaction() as cursor:
+        sync_template_activities(cursor, template_version, template)
+    mark_template_synced(template_version)
+
+    report = {'use_cases': 0, 'activities': 0, 'batches': 0, 'passes': 0}
+    pending = pending_use_cases()
+    while pending and report['passes'] < max_passes:
+        report['passes'] += 1
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            with lakebase.transaction() as cursor:
+                report['activities'] += copy_use_cases(cursor, batch, template_version)
+            report['use_cases'] += len(batch)
+            report['batches'] += 1
+            if progress:
+                progress(report)
+            if pause:
+                time.sleep(pause)
+        pending = pending_use_cases()
+
+    report['pending'] = len(pending)
+    return report
+
+
+def switch_over():
+    """Swap the wide table for the compatibility view in one short transaction
+
+    Writers are blocked (readers are not) while the last changed use cases
+    are copied and copies of use cases no longer in the wide table are
+    deleted, the wide table is renamed to test.use_case_maps_wide and the
+    view with its INSTEAD OF trigger takes its name. Run backfill first so the
+    final catch-up is small. Returns the number of use cases caught up.
+    """
+    if normalised_schema_active():
+        return 0
+
+    template_version, _ = current_template()
+    with lakebase.transaction() as cursor:
+        cursor.execute("LOCK TABLE test.use_case_maps IN EXCLUSIVE MODE")
+        cursor.execute(PENDING_SQL)
+        pending = [row[0] for row in cursor.fetchall()]
+        if pending:
+            copy_use_cases(cursor, pending, template_version)
+        cursor.execute(ORPHANED_SQL)
+
+        cursor.execute(f"ALTER TABLE test.use_case_maps RENAME TO {WIDE_TABLE}")
+        cursor.execute("CREATE VIEW test.use_case_maps AS SELECT * FROM test.use_case_maps_expanded")
+        cursor.execute(WRITE_TRIGGER_FUNCTION_SQL)
+        cursor.execute("""
+            CREATE TRIGGER use_case_maps_write
+            INSTEAD OF INSERT OR UPDATE OR DELETE ON test.use_case_maps
+            FOR EACH ROW EXECUTE FUNCTION test.use_case_maps_write()
+        """)
+    _state['normalised'] = True
+    return len(pending)
+
+
+def migration_status():
+    """Counts describing how far the migration got"""
+    lakebase.create_delta_storage_tables()
+    status = {'normalised': normalised_schema_active()}
+    status['headers'] = lakebase.query("SELECT COUNT(*) FROM test.use_cases")[0][0]
+    status['activities'] = lakebase.query("SELECT COUNT(*) FROM test.use_case_activities")[0][0]
+    status['pending'] = 0 if status['normalised'] else len(pending_use_cases())
+    status['partitioned'] = use_case_maps_partitioned()
+    return status
+
+
+def _relkind(table):
+    """pg_class.relkind of a test table ('r' table, 'p' partitioned, 'v' view), None if absent"""
+    result = lakebase.query(RELKIND_SQL, {'table': table})
+    return result[0][0] if result else None
+
+
+def use_case_maps_partitioned():
+    """Whether test.use_case_maps is already range partitioned"""
+    return _relkind('use_case_maps') == 'p'
+
+
+def _add_months(month, months):
+    """First day of the month months after the given first of a month"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    """Name of the partition holding rows created in the given month"""
+    return f"use_case_maps_p{month:%Y_%m}"
+
+
+def _partition_month(name):
+    """First day of the month a partition covers, None for the default partition"""
+    match = PARTITION_NAME_RE.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def ensure_partitions(parent='use_case_maps', first_month=None, months_ahead=DEFAULT_MONTHS_AHEAD):
+    """Create the monthly partitions from first_month (default this month) to months_ahead ahead
+
+    Rows the default partition already holds for a new month are moved into it
+    in the same transaction (a partition cannot be attached over them).
+    Returns the names of the partitions created.
+    """
+    current = date.today().replace(day=1)
+    month = min(first_month or current, current)
+    existing = {row[0] for row in lakebase.query(PARTITIONS_SQL, {'parent': parent}) or []}
+
+    created = []
+    while month <= _add_months(current, months_ahead):
+        name = partition_name(month)
+        if name not in existing:
+            bounds = {'start': month, 'end': _add_months(month, 1)}
+            with lakebase.transaction() as cursor:
+                cursor.execute(f"""
+                    SELECT EXISTS (SELECT 1 FROM test.{DEFAULT_PARTITION}
+                                   WHERE created_at >= %(start)s AND created_at < %(end)s)
+                """, bounds)
+                stranded = cursor.fetchone()[0]
+                if stranded:
+                    cursor.execute(f"ALTER TABLE test.{parent} DETACH PARTITION test.{DEFAULT_PARTITION}")
+                cursor.execute(f"""
+                    CREATE TABLE test.{name} PARTITION OF test.{parent}
+                    FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')
+                """)
+                if stranded:
+                    cursor.execute(f"""
+                        WITH moved AS (
+                            DELETE FROM test.{DEFAULT_PARTITION}
+                            WHERE created_at >= %(start)s AND created_at < %(end)s
+                            RETURNING *
+                        )
+                        INSERT INTO test.{parent} SELECT * FROM moved
+                    """, bounds)
+                    cursor.execute(f"ALTER TABLE test.{parent} ATTACH PARTITION test.{DEFAULT_PARTITION} DEFAULT")
+            created.append(name)
+        month = _add_months(month, 1)
+    return created
+
+
+def drop_empty_partitions(parent='use_case_maps'):
+    """Drop past monthly partitions the archive has emptied; returns their names"""
+    current = date.today().replace(day=1)
+    dropped = []
+    for (name,) in lakebase.query(PARTITIONS_SQL, {'parent': parent}) or []:
+        month = _partition_month(name)
+        if month is None or month >= current:
+            continue
+        with lakebase.transaction() as cursor:
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM test.{name})")
+            if not cursor.fetchone()[0]:
+                cursor.execute(f"ALTER TABLE test.{parent} DETACH PARTITION test.{name}")
+                cursor.execute(f"DROP TABLE test.{name}")
+                dropped.append(name)
+    return dropped
+
+
+def partition_use_case_maps(batch_size=DEFAULT_COPY_BATCH_ROWS, pause=0.0, months_ahead=DEFAULT_MONTHS_AHEAD,
+                            progress=None):
+    """Convert the wide test.use_case_maps into monthly range partitions on created_at
+
+    A partitioned copy (same columns and p_id sequence, primary key
+    (p_id, created_at)) is filled in batches of rows while the app keeps
+    writing; one short transaction then blocks writers, catches up changed,
+    new and deleted rows and swaps the names. The old table stays as
+    test.use_case_maps_unpartitioned. Returns a report dict.
+    """
+    lakebase.create_use_case_maps_table()
+    kind = _relkind('use_case_maps')
+    if kind != 'r':
+        reason = 'already partitioned' if kind == 'p' else 'a view over the normalised tables'
+        return {'rows': 0, 'batches': 0, 'caught_up': 0, 'partitions': 0, 'skipped': reason}
+
+    sequence = lakebase.query("SELECT pg_get_serial_sequence('test.use_case_maps', 'p_id')")[0][0]
+    with lakebase.transaction() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS test.{PARTITIONED_TABLE}")
+        cursor.execute(f"""
+            CREATE TABLE test.{PARTITIONED_TABLE} (LIKE test.use_case_maps INCLUDING DEFAULTS)
+            PARTITION BY RANGE (created_at)
+        """)
+        cursor.execute(f"ALTER TABLE test.{PARTITIONED_TABLE} ALTER COLUMN created_at SET NOT NULL")
+        cursor.execute(f"ALTER TABLE test.{PARTITIONED_TABLE} ADD PRIMARY KEY (p_id, created_at)")
+        cursor.execute(f"CREATE TABLE test.{DEFAULT_PARTITION} PARTITION OF test.{PARTITIONED_TABLE} DEFAULT")
+        cursor.execute(f"CREATE INDEX idx_use_case_maps_part_use_case_id ON test.{PARTITIONED_TABLE} (use_case_id)")
+        cursor.execute(f"""
+            CREATE INDEX idx_use_case_maps_part_customer_created
+            ON test.{PARTITIONED_TABLE} (customer_name, created_at)
+        """)
+        cursor.execute(f"""
+            CREATE INDEX idx_use_case_maps_part_date_range
+            ON test.{PARTITIONED_TABLE} USING GIST (
+                daterange(LEAST("Start_Date", "End_Date"), GREATEST("Start_Date", "End_Date"), '[]')
+            )
+        """)
+
+    oldest = lakebase.query("SELECT MIN(COALESCE(created_at, updated_at)) FROM test.use_case_maps")[0][0]
+    first_month = oldest.date().replace(day=1) if oldest else None
+    partitions = ensure_partitions(PARTITIONED_TABLE, first_month, months_ahead)
+
+    report = {'rows': 0, 'batches': 0, 'caught_up': 0, 'partitions': len(partitions)}
+    after = 0
+    while True:
+        with lakebase.transaction() as cursor:
+            cursor.execute(COPY_ROWS_SQL, {'after': after, 'limit': batch_size})
+            copied = [row[0] for row in cursor.fetchall()]
+        if not copied:
+            break
+        after = max(copied)
+        report['rows'] += len(copied)
+        report['batches'] += 1
+        if progress:
+            progress(report)
+        if pause:
+            time.sleep(pause)
+
+    with lakebase.transaction() as cursor:
+        cursor.execute("LOCK TABLE test.use_case_maps IN EXCLUSIVE MODE")
+        cursor.execute(DROP_STALE_COPIES_SQL)
+        cursor.execute(COPY_MISSING_ROWS_SQL)
+        report['caught_up'] = cursor.rowcount
+        cursor.execute(f"ALTER TABLE test.use_case_maps RENAME TO {UNPARTITIONED_TABLE}")
+        cursor.execute(f"ALTER TABLE test.{PARTITIONED_TABLE} RENAME TO use_case_maps")
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY test.use_case_maps.p_id")
+    return report
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Migrate test.use_case_maps to the normalised schema")
+    parser.add_argument('command', choices=['status', 'backfill', 'switch', 'partition', 'partitions'])
+    parser.add_argument('--batch-size', type=int,
+                        help=f"Use cases (backfill, default {DEFAULT_BATCH_SIZE}) or rows "
+                             f"(partition, default {DEFAULT_COPY_BATCH_ROWS}) per transaction")
+    parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument('--months-ahead', type=int, default=DEFAULT_MONTHS_AHEAD,
+                        help="Monthly partitions to keep created ahead of the current month")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.command == 'status':
+        status = migration_status()
+        state = "switched" if status['normalised'] else f"{status['pending']} use cases pending"
+        print(f"{status['headers']} use cases, {status['activities']} activities normalised; {state}; "
+              f"wide table {'partitioned' if status['partitioned'] else 'not partitioned'}")
+    elif args.command == 'backfill':
+        report = backfill(args.batch_size or DEFAULT_BATCH_SIZE, args.pause, progress=lambda r: print(
+            f"  batch {r['batches']}: {r['use_cases']} use cases, {r['activities']} activities", flush=True))
+        print(f"Backfilled {report['use_cases']} use cases ({report['activities']} activities) in "
+              f"{report['passes']} passes, {report['pending']} still pending, "
+              f"{time.perf_counter() - started:.1f}s")
+    elif args.command == 'switch':
+        caught_up = switch_over()
+        print(f"test.use_case_maps is now a view over the normalised tables "
+              f"({caught_up} use cases caught up, {time.perf_counter() - started:.1f}s)")
+    elif args.command == 'partition':
+        report = partition_use_case_maps(args.batch_size or DEFAULT_COPY_BATCH_ROWS, args.pause, args.months_ahead,
+                                         progress=lambda r: print(f"  batch {r['batches']}: {r['rows']} rows",
+                                                                  flush=True))
+        if report.get('skipped'):
+            print(f"test.use_case_maps not partitioned: it is {report['skipped']}")
+        else:
+            print(f"test.use_case_maps is now partitioned by month on created_at "
+                  f"({report['partitions']} partitions, {report['rows']} rows copied, "
+                  f"{report['caught_up']} caught up, {time.perf_counter() - started:.1f}s)")
+    elif use_case_maps_partitioned():
+        # Monthly maintenance: next months' partitions, drop the ones archiving emptied
+        created = ensure_partitions(months_ahead=args.months_ahead)
+        dropped = drop_empty_partitions()
+        print(f"Partitions created: {', '.join(created) or 'none'}; dropped: {', '.join(dropped) or 'none'}")
+    else:
+        print("test.use_case_maps is not partitioned; run the partition command first")
+    lakebase.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
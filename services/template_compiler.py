@@ -0,0 +1,261 @@
+"""
+Build-time compiler for the Consolidated MAP Template
+Reads the shipped Excel workbook (or test.template) and emits compiled_template.py,
+a versioned, content-hashed module of frozen tuples the app loads at startup
+
+Usage:
+    python -m services.template_compiler [--source workbook|database] [--check]
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import runpy
+import sys
+from functools import lru_cache
+from pathlib import Path
+
+from consolidated_map_template import CONSOLIDATED_MAP_TEMPLATE
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+WORKBOOK_PATH = ROOT_DIR / "Consolidated MAP Template [Make A Copy] (1).xlsx"
+ARTIFACT_PATH = ROOT_DIR / "compiled_template.py"
+
+TEMPLATE_STAGE_CODES = ["U2", "U3", "U4", "U5"]
+
+
+def outcome_key(outcome):
+    """Normalised outcome used to match activities across template copies"""
+    return re.sub(r'[^a-z0-9]+', ' ', (outcome or '').lower()).strip()
+
+
+@lru_cache(maxsize=65536)
+def activity_hash(stage_code, outcome):
+    """Signed 64-bit hash of a (stage, normalised outcome) pair, usable as a BIGINT key
+
+    The first 8 bytes of an MD5 so that the database can compute the same key
+    (test.activity_key). Memoised: across a portfolio the same few hundred
+    outcomes repeat.
+    """
+    digest = hashlib.md5(f"{stage_code}|{outcome_key(outcome)}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+def content_hash(data):
+    """SHA-256 of the canonical JSON encoding of a structure"""
+    encoded = json.dumps(data, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def read_workbook_rows(path=WORKBOOK_PATH):
+    """Read (stage, outcome, questions, owner) rows from the MAP sheet of the workbook"""
+    import openpyxl
+    from services.map_importer import find_header_row
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook['MAP'] if 'MAP' in workbook.sheetnames else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        _, columns, _ = find_header_row(rows)
+        if not columns:
+            raise ValueError(f"No Stage/Outcome header row in {path}")
+        index = {column: idx for idx, column in columns.items()}
+
+        def cell(row, column):
+            idx = index.get(column)
+            value = row[idx] if idx is not None and idx < len(row) else None
+            return str(value).strip() if value is not None else ''
+
+        return [
+            (cell(row, 'Stage'), cell(row, 'Outcome'), cell(row, 'Embedded_Questions'), cell(row, 'Owner_Name'))
+            for row in rows
+            if cell(row, 'Stage') and cell(row, 'Outcome')
+        ]
+    finally:
+        workbook.close()
+
+
+def read_database_rows():
+    """Read (stage, outcome, questions, owner) rows from test.template"""
+    from services.lakebase import lakebase
+
+    rows = lakebase.query("""
+        SELECT stage, outcome, asset_podcast, owner_name
+        FROM test.template
+        ORDER BY id
+    """) or []
+    lakebase.close()
+    return [tuple((value or '').strip() for value in row) for row in rows if row[0] and row[1]]
+
+
+def compile_template(rows):
+    """Compile source rows into the frozen template structure
+
+    Returns a tuple of (stage_code, name, description, activities) where each
+    activity is (outcome, questions, owner, conditional). Stage names and
+    descriptions, SSA/POC conditionals and owners missing from the source are
+    taken from the matching activity in consolidated_map_template.py.
+    """
+    overlay = {
+        (stage_code, outcome_key(activity['outcome'])): activity
+        for stage_code, stage in CONSOLIDATED_MAP_TEMPLATE.items()
+        for activity in stage['activities']
+    }
+
+    activities_by_stage = {}
+    for stage, outcome, questions, owner in rows:
+        known = overlay.get((stage, outcome_key(outcome)), {})
+        activities_by_stage.setdefault(stage, []).append((
+            outcome,
+            questions or known.get('questions', ''),
+            owner or known.get('owner', ''),
+            known.get('conditional')
+        ))
+
+    stage_codes = [code for code in TEMPLATE_STAGE_CODES if code in activities_by_stage]
+    stage_codes += sorted(code for code in activities_by_stage if code not in TEMPLATE_STAGE_CODES)
+
+    compiled = []
+    for stage_code in stage_codes:
+        meta = CONSOLIDATED_MAP_TEMPLATE.get(stage_code, {})
+        compiled.append((
+            stage_code,
+            meta.get('name', stage_code),
+            meta.get('description', ''),
+            tuple(activities_by_stage[stage_code])
+        ))
+    return tuple(compiled)
+
+
+def file_sha256(path):
+    """SHA-256 of a file's bytes"""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def render_artifact(compiled, version, source, source_file_hash):
+    """Render the compiled template as Python source"""
+    lines = [
+        '"""',
+        'Precompiled Consolidated MAP Template',
+        'Generated by services/template_compiler.py - do not edit by hand, recompile instead',
+        '"""',
+        '',
+        f'TEMPLATE_VERSION = {version!r}',
+        f'TEMPLATE_SOURCE = {source!r}',
+        f'SOURCE_FILE_HASH = {source_file_hash!r}',
+        f'TEMPLATE_HASH = {content_hash(compiled)!r}',
+        '',
+        '# (stage_code, name, description, ((outcome, questions, owner, conditional), ...))',
+        'COMPILED_TEMPLATE = (',
+    ]
+    for stage_code, name, description, activities in compiled:
+        lines.append(f'    ({stage_code!r}, {name!r}, {description!r}, (')
+        for activity in activities:
+            lines.append(f'        {activity!r},')
+        lines.append('    )),')
+    lines.append(')')
+    return '\n'.join(lines) + '\n'
+
+
+def compile_to_artifact(source='workbook', workbook_path=WORKBOOK_PATH, output=ARTIFACT_PATH):
+    """Compile the template and write the artifact
+
+    The version is bumped only when the compiled content hash changes.
+    Returns (version, template_hash, changed).
+    """
+    if source == 'database':
+        rows = read_database_rows()
+        source_name, source_file_hash = 'test.template', None
+    else:
+        rows = read_workbook_rows(workbook_path)
+        source_name, source_file_hash = Path(workbook_path).name, file_sha256(workbook_path)
+
+    compiled = compile_template(rows)
+    new_hash = content_hash(compiled)
+
+    version = 1
+    output = Path(output)
+    if output.exists():
+        previous = runpy.run_path(str(output))
+        if previous.get('TEMPLATE_HASH') == new_hash and previous.get('SOURCE_FILE_HASH') == source_file_hash:
+            return previous['TEMPLATE_VERSION'], new_hash, False
+        version = previous.get('TEMPLATE_VERSION', 0) + (previous.get('TEMPLATE_HASH') != new_hash)
+
+    output.write_text(render_artifact(compiled, version, source_name, source_file_hash), encoding='utf-8')
+    return version, new_hash, True
+
+
+@lru_cache(maxsize=1)
+def load_compiled_template():
+    """Load and hash-check the precompiled template (once per process)
+
+    Returns (version, stages) where stages has the CONSOLIDATED_MAP_TEMPLATE
+    shape. Falls back to the hand-written template if the artifact is missing
+    or its content no longer matches its hash.
+    """
+    try:
+        import compiled_template
+        compiled = compiled_template.COMPILED_TEMPLATE
+        if content_hash(compiled) != compiled_template.TEMPLATE_HASH:
+            raise ValueError("content hash mismatch")
+    except Exception as e:
+        print(f"Compiled template unusable ({e}), using consolidated_map_template.py")
+        return None, CONSOLIDATED_MAP_TEMPLATE
+
+    stages = {}
+    for stage_code, name, description, activities in compiled:
+        stages[stage_code] = {
+            'name': name,
+            'description': description,
+            'activities': [
+                {'outcome': outcome, 'questions': questions, 'owner': owner, 'conditional': conditional}
+                for outcome, questions, owner, conditional in activities
+            ]
+        }
+    return compiled_template.TEMPLATE_VERSION, stages
+
+
+@lru_cache(maxsize=1)
+def check_template_drift(workbook_path=WORKBOOK_PATH):
+    """Return a drift message if the shipped workbook changed since the last compile, else None"""
+    try:
+        import compiled_template
+    except ImportError:
+        return "compiled_template.py is missing"
+
+    if compiled_template.SOURCE_FILE_HASH is None or not Path(workbook_path).exists():
+        return None
+    if file_sha256(workbook_path) != compiled_template.SOURCE_FILE_HASH:
+        return (f"{Path(workbook_path).name} changed since template v{compiled_template.TEMPLATE_VERSION} "
+                "was compiled; run python -m services.template_compiler")
+    return None
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Compile the MAP template into compiled_template.py")
+    parser.add_argument('--source', choices=['workbook', 'database'], default='workbook')
+    parser.add_argument('--workbook', default=str(WORKBOOK_PATH))
+    parser.add_argument('--output', default=str(ARTIFACT_PATH))
+    parser.add_argument('--check', action='store_true',
+                        help="Fail if the artifact is out of date instead of writing it")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        rows = read_database_rows() if args.source == 'database' else read_workbook_rows(args.workbook)
+        previous = runpy.run_path(args.output) if Path(args.output).exists() else {}
+        if previous.get('TEMPLATE_HASH') != content_hash(compile_template(rows)):
+            print(f"Template drift: {args.output} does not match {args.source}")
+            return 1
+        print(f"{args.output} is up to date (v{previous['TEMPLATE_VERSION']})")
+        return 0
+
+    version, template_hash, changed = compile_to_artifact(args.source, args.workbook, args.output)
+    state = "written" if changed else "unchanged"
+    print(f"Template v{version} ({template_hash[:12]}) {state}: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
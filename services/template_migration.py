@@ -0,0 +1,355 @@
+"""
+Bulk template migration engine for existing use cases
+Computes an activity-level mapping between two template versions and applies it to
+every affected use case in test.use_case_maps with set-based SQL in batched transactions
+
+Usage:
+    python -m services.template_migration --from 1 --to 2 [--dry-run] [--local use_case_data/use_cases.json]
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+from difflib import SequenceMatcher
+from pathlib import Path
+
+from plan_utils import normalize_stage_code
+from services.duration_stats import DEFAULT_DURATION_DAYS, estimate_activity, estimate_join, get_duration_stats
+from services.lakebase import lakebase
+from services.outbox import DEFAULT_PATH as DEFAULT_OUTBOX_PATH, Outbox
+from services.template_store import DEFAULT_TEMPLATE_NAME, load_template_version
+
+# Minimum outcome similarity for an unmatched old/new pair to count as a rename
+RENAME_THRESHOLD = 0.6
+
+DEFAULT_BATCH_SIZE = 200
+
+# Activity fields that only users fill in; removed activities holding any are kept
+USER_ENTERED_CONDITION = """COALESCE(m."Progress", 0) = 0 AND COALESCE(m."Notes", '') = ''"""
+
+RENAME_SQL = """
+    UPDATE test.use_case_maps m
+    SET "Outcome" = v.new_outcome,
+        "Action" = v.new_outcome,
+        "Embedded_Questions" = v.new_questions,
+        updated_by = %(user_name)s,
+        updated_at = %(now)s
+    FROM unnest(%(stages)s::text[], %(old_outcomes)s::text[], %(new_outcomes)s::text[], %(new_questions)s::text[])
+         AS v(stage, old_outcome, new_outcome, new_questions)
+    WHERE m.use_case_id = ANY(%(use_case_ids)s)
+    AND m."Stage" = v.stage
+    AND m."Outcome" = v.old_outcome
+"""
+
+REMOVED_KEPT_SQL = f"""
+    SELECT COUNT(*)
+    FROM test.use_case_maps m
+    JOIN unnest(%(stages)s::text[], %(outcomes)s::text[]) AS v(stage, outcome)
+      ON m."Stage" = v.stage AND m."Outcome" = v.outcome
+    WHERE m.use_case_id = ANY(%(use_case_ids)s)
+    AND NOT ({USER_ENTERED_CONDITION})
+"""
+
+REMOVE_SQL = f"""
+    DELETE FROM test.use_case_maps m
+    USING unnest(%(stages)s::text[], %(outcomes)s::text[]) AS v(stage, outcome)
+    WHERE m.use_case_id = ANY(%(use_case_ids)s)
+    AND m."Stage" = v.stage
+    AND m."Outcome" = v.outcome
+    AND {USER_ENTERED_CONDITION}
+"""
+
+# New activities are added once per use case, honouring SSA/POC flags and
+# substituting SA/AE in the owner like the use case form does; durations come
+# from the historical statistics
+ADD_SQL = f"""
+    INSERT INTO test.use_case_maps (
+        use_case_id, use_case_name, customer_name, "Stage", "Outcome",
+        "Embedded_Questions", "Owner_Name", "Start_Date", "End_Date",
+        "Progress", "Notes", "Action", solution_architect, account_executive,
+        ssa_required, poc_required, created_by, created_at, updated_by, updated_at
+    )
+    SELECT h.use_case_id, h.use_case_name, h.customer_name, v.stage, v.outcome,
+           v.questions,
+           CASE WHEN COALESCE(h.account_executive, '') <> ''
+                THEN replace(v.sa_owner, 'AE', h.account_executive)
+                ELSE v.sa_owner END,
+           h.start_date, h.start_date + COALESCE(estimate.days, {DEFAULT_DURATION_DAYS}),
+           0, '', v.outcome, h.solution_architect, h.account_executive,
+           h.ssa_required, h.poc_required, %(user_name)s, %(now)s, %(user_name)s, %(now)s
+    FROM (
+        SELECT DISTINCT ON (use_case_id)
+               use_case_id, use_case_name, customer_name, solution_architect,
+               account_executive, ssa_required, poc_required,
+               MIN("Start_Date") OVER (PARTITION BY use_case_id) AS start_date
+        FROM test.use_case_maps
+        WHERE use_case_id = ANY(%(use_case_ids)s)
+        ORDER BY use_case_id, updated_at DESC
+    ) h
+    CROSS JOIN LATERAL (
+        SELECT a.stage, a.outcome, a.questions, a.conditional,
+               CASE WHEN COALESCE(h.solution_architect, '') <> ''
+                    THEN replace(a.owner, 'SA', h.solution_architect)
+                    ELSE a.owner END AS sa_owner
+        FROM unnest(%(stages)s::text[], %(outcomes)s::text[], %(questions)s::text[],
+                    %(owners)s::text[], %(conditionals)s::text[])
+             AS a(stage, outcome, questions, owner, conditional)
+    ) v
+    {estimate_join('v.stage', 'v.outcome', 'h.customer_name')}
+    WHERE (v.conditional IS NULL
+           OR (v.conditional = 'ssa' AND h.ssa_required)
+           OR (v.conditional = 'poc' AND h.poc_required))
+    AND NOT EXISTS (
+        SELECT 1 FROM test.use_case_maps e
+        WHERE e.use_case_id = h.use_case_id
+        AND e."Stage" = v.stage
+        AND e."Outcome" = v.outcome
+    )
+"""
+
+AFFECTED_SQL = """
+    SELECT DISTINCT m.use_case_id
+    FROM test.use_case_maps m
+    JOIN unnest(%(stages)s::text[], %(outcomes)s::text[]) AS v(stage, outcome)
+      ON m."Stage" = v.stage AND m."Outcome" = v.outcome
+    ORDER BY m.use_case_id
+"""
+
+
+def _similarity(old_activity, new_activity):
+    """Similarity of two activities, with identical questions counting as a match"""
+    if old_activity.get('questions') and old_activity.get('questions') == new_activity.get('questions'):
+        return 1.0
+    return SequenceMatcher(None, old_activity['outcome'].lower(), new_activity['outcome'].lower()).ratio()
+
+
+def compute_template_mapping(old_stages, new_stages, rename_threshold=RENAME_THRESHOLD):
+    """Compute the activity-level mapping between two template versions
+
+    Activities are matched by outcome within a stage. Unmatched pairs are then
+    paired greedily by similarity to detect renames. Returns a dict of lists:
+    renamed (stage, old_outcome, new_outcome, new_questions), reworded (stage,
+    outcome, new_questions), removed (stage, outcome) and added (stage,
+    outcome, questions, owner, conditional).
+    """
+    mapping = {'renamed': [], 'reworded': [], 'removed': [], 'added': []}
+
+    for stage_code in list(dict.fromkeys(list(old_stages) + list(new_stages))):
+        old_activities = old_stages.get(stage_code, {}).get('activities', [])
+        new_activities = new_stages.get(stage_code, {}).get('activities', [])
+        new_by_outcome = {activity['outcome']: activity for activity in new_activities}
+
+        unmatched_old = []
+        matched_new = set()
+        for old in old_activities:
+            new = new_by_outcome.get(old['outcome'])
+            if new is None:
+                unmatched_old.append(old)
+                continue
+            matched_new.add(old['outcome'])
+            if new.get('questions', '') != old.get('questions', ''):
+                mapping['reworded'].append((stage_code, old['outcome'], new.get('questions', '')))
+
+        unmatched_new = [activity for activity in new_activities if activity['outcome'] not in matched_new]
+        candidates = sorted(
+            ((_similarity(old, new), old_idx, new_idx)
+             for old_idx, old in enumerate(unmatched_old)
+             for new_idx, new in enumerate(unmatched_new)),
+            reverse=True
+        )
+        paired_old, paired_new = set(), set()
+        for score, old_idx, new_idx in candidates:
+            if score < rename_threshold:
+                break
+            if old_idx in paired_old or new_idx in paired_new:
+                continue
+            paired_old.add(old_idx)
+            paired_new.add(new_idx)
+            new = unmatched_new[new_idx]
+            mapping['renamed'].append((stage_code, unmatched_old[old_idx]['outcome'],
+                                       new['outcome'], new.get('questions', '')))
+
+        for old_idx, old in enumerate(unmatched_old):
+            if old_idx not in paired_old:
+                mapping['removed'].append((stage_code, old['outcome']))
+        for new_idx, new in enumerate(unmatched_new):
+            if new_idx not in paired_new:
+                mapping['added'].append((stage_code, new['outcome'], new.get('questions', ''),
+                                         new.get('owner', ''), new.get('conditional')))
+
+    return mapping
+
+
+def _columns(entries, count):
+    """Transpose mapping tuples into per-column lists for unnest()"""
+    return [list(column) for column in zip(*entries)] if entries else [[] for _ in range(count)]
+
+
+def migrate_use_case_maps(old_stages, new_stages, user_name, dry_run=False,
+                          batch_size=DEFAULT_BATCH_SIZE, mapping=None):
+    """Apply a template change to every affected use case in test.use_case_maps
+
+    Affected use cases are those holding at least one activity of the old
+    template. Each batch of use cases is migrated in one transaction (rolled
+    back when dry_run). Owners, dates, progress and notes of kept activities
+    are never touched; removed activities with progress or notes are kept.
+    Returns the migration report.
+    """
+    mapping = mapping or compute_template_mapping(old_stages, new_stages)
+    old_keys = [(stage_code, activity['outcome'])
+                for stage_code, stage in old_stages.items() for activity in stage['activities']]
+    key_stages, key_outcomes = _columns(old_keys, 2)
+
+    rewrites = mapping['renamed'] + [(stage, outcome, outcome, questions)
+                                     for stage, outcome, questions in mapping['reworded']]
+    rename_params = dict(zip(['stages', 'old_outcomes', 'new_outcomes', 'new_questions'], _columns(rewrites, 4)))
+    remove_params = dict(zip(['stages', 'outcomes'], _columns(mapping['removed'], 2)))
+    add_params = dict(zip(['stages', 'outcomes', 'questions', 'owners', 'conditionals'],
+                          _columns(mapping['added'], 5)))
+
+    report = {
+        'dry_run': dry_run,
+        'mapping': {category: len(entries) for category, entries in mapping.items()},
+        'use_cases': 0,
+        'batches': 0,
+        'rows_rewritten': 0,
+        'rows_removed': 0,
+        'rows_kept': 0,
+        'rows_added': 0
+    }
+
+    if not any(mapping.values()):
+        return report
+
+    # Also creates the duration statistics table ADD_SQL reads
+    lakebase.create_use_case_maps_table()
+    affected = [row[0] for row in lakebase.query(AFFECTED_SQL, {'stages': key_stages, 'outcomes': key_outcomes}) or []]
+    report['use_cases'] = len(affected)
+
+    now = datetime.now()
+    for start in range(0, len(affected), batch_size):
+        batch = {'use_case_ids': affected[start:start + batch_size], 'user_name': user_name, 'now': now}
+        with lakebase.transaction(commit=not dry_run) as cursor:
+            if rewrites:
+                cursor.execute(RENAME_SQL, {**batch, **rename_params})
+                report['rows_rewritten'] += cursor.rowcount
+            if mapping['removed']:
+                cursor.execute(REMOVED_KEPT_SQL, {**batch, **remove_params})
+                report['rows_kept'] += cursor.fetchone()[0]
+                cursor.execute(REMOVE_SQL, {**batch, **remove_params})
+                report['rows_removed'] += cursor.rowcount
+            if mapping['added']:
+                cursor.execute(ADD_SQL, {**batch, **add_params})
+                report['rows_added'] += cursor.rowcount
+        report['batches'] += 1
+
+    lakebase.close()
+    return report
+
+
+def migrate_local_use_cases(use_cases, mapping):
+    """Apply a template mapping to locally stored use case documents in place
+
+    Mirrors migrate_use_case_maps for the JSON store. Returns the ids of the
+    use cases changed; their database rows should then be rebuilt from the
+    documents with a full save, since the SQL migration appends added
+    activities at the end and at the plan start instead of in their stage's
+    place on the schedule.
+    """
+    rewrites = {(stage, old): (new, questions) for stage, old, new, questions in mapping['renamed']}
+    rewrites.update({(stage, outcome): (outcome, questions) for stage, outcome, questions in mapping['reworded']})
+    removed = set(mapping['removed'])
+    old_keys = set(rewrites) | removed
+    stats = get_duration_stats() if mapping['added'] else {}
+
+    changed = []
+    for use_case_id, use_case in use_cases.items():
+        stages = use_case.get('stages', [])
+        if not any((normalize_stage_code(stage['stage_name']), activity['activity']) in old_keys
+                   for stage in stages for activity in stage['activities']):
+            continue
+
+        before = json.dumps(stages, sort_keys=True, default=str)
+        for stage in stages:
+            stage_code = normalize_stage_code(stage['stage_name'])
+            activities = []
+            for activity in stage['activities']:
+                key = (stage_code, activity['activity'])
+                if key in removed and activity.get('status', 'Not Started') == 'Not Started' and not activity.get('notes'):
+                    continue
+                if key in rewrites:
+                    activity['activity'], activity['description'] = rewrites[key]
+                activities.append(activity)
+
+            existing = {activity['activity'] for activity in activities}
+            for add_stage, outcome, questions, owner, conditional in mapping['added']:
+                if add_stage != stage_code or outcome in existing:
+                    continue
+                if (conditional == 'ssa' and not use_case.get('ssa_required')) or \
+                        (conditional == 'poc' and not use_case.get('poc_happening')):
+                    continue
+                if 'SA' in owner and use_case.get('solution_architect'):
+                    owner = owner.replace('SA', use_case['solution_architect'])
+                if 'AE' in owner and use_case.get('account_executive'):
+                    owner = owner.replace('AE', use_case['account_executive'])
+                activities.append({'activity': outcome, 'description': questions, 'owner': owner,
+                                   **estimate_activity(stats, stage_code, outcome, use_case.get('customer')),
+                                   'status': 'Not Started'})
+            stage['activities'] = activities
+
+        if json.dumps(stages, sort_keys=True, default=str) != before:
+            use_case['updated_at'] = datetime.now().isoformat()
+            changed.append(use_case_id)
+
+    return changed
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Migrate existing use cases between MAP template versions")
+    parser.add_argument('--from', dest='from_version', type=int, required=True)
+    parser.add_argument('--to', dest='to_version', type=int, required=True)
+    parser.add_argument('--name', default=DEFAULT_TEMPLATE_NAME)
+    parser.add_argument('--user', default='template_migration')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--local', help="Also migrate a local use_cases.json store (and queue full saves of "
+                                        "its changed use cases in the outbox next to it)")
+    parser.add_argument('--dry-run', action='store_true', help="Report changes and roll back")
+    args = parser.parse_args(argv)
+
+    old_stages = load_template_version(args.from_version, args.name)
+    new_stages = load_template_version(args.to_version, args.name)
+    mapping = compute_template_mapping(old_stages, new_stages)
+
+    for category, entries in mapping.items():
+        for entry in entries:
+            if category == 'renamed':
+                print(f"{category:<9} {entry[0]}  {entry[1]} -> {entry[2]}")
+            else:
+                print(f"{category:<9} {entry[0]}  {entry[1]}")
+
+    report = migrate_use_case_maps(old_stages, new_stages, args.user, dry_run=args.dry_run,
+                                   batch_size=args.batch_size, mapping=mapping)
+
+    if args.local:
+        local_path = Path(args.local)
+        use_cases = json.loads(local_path.read_text())
+        changed = migrate_local_use_cases(use_cases, mapping)
+        report['local_use_cases'] = len(changed)
+        if not args.dry_run:
+            local_path.write_text(json.dumps(use_cases, indent=2, default=str))
+            # The running app's outbox worker rewrites their rows from the documents
+            outbox = Outbox(local_path.parent / DEFAULT_OUTBOX_PATH.name)
+            for use_case_id in changed:
+                outbox.enqueue('save', use_case_id, {'use_case': use_cases[use_case_id]}, args.user)
+            report['local_saves_queued'] = len(changed)
+
+    print("=" * 50)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
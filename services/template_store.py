@@ -0,0 +1,175 @@
+"""
+Versioned MAP template store in use_case_plans.templates
+Each published template is a JSONB document with a version and checksum; the app keeps
+a process-level cache that is revalidated with a single SELECT version, checksum
+"""
+
+import json
+import threading
+
+from config import Config
+from services.lakebase import lakebase
+from services.template_compiler import content_hash, load_compiled_template
+
+DEFAULT_TEMPLATE_NAME = "Consolidated MAP Template"
+
+# Process-level cache: template name -> {'version', 'checksum', 'stages'}
+_template_cache = {}
+_cache_lock = threading.Lock()
+_tables_ready = False
+
+
+def stages_to_document(stages):
+    """Convert a stages dict (CONSOLIDATED_MAP_TEMPLATE shape) to the stored document
+
+    Stages are stored as a list so their order survives JSONB key reordering.
+    """
+    return [
+        {
+            'code': stage_code,
+            'name': stage['name'],
+            'description': stage.get('description', ''),
+            'activities': [
+                {
+                    'outcome': activity['outcome'],
+                    'questions': activity.get('questions', ''),
+                    'owner': activity.get('owner', ''),
+                    'conditional': activity.get('conditional')
+                }
+                for activity in stage['activities']
+            ]
+        }
+        for stage_code, stage in stages.items()
+    ]
+
+
+def document_to_stages(document):
+    """Convert a stored document back to a stages dict"""
+    return {
+        stage['code']: {
+            'name': stage['name'],
+            'description': stage.get('description', ''),
+            'activities': stage['activities']
+        }
+        for stage in document
+    }
+
+
+def template_checksum(document):
+    """Checksum of a template document (independent of JSON key order)"""
+    return content_hash(document)
+
+
+def _ensure_tables():
+    """Create the template tables once per process"""
+    global _tables_ready
+    if not _tables_ready:
+        _tables_ready = lakebase.create_tables()
+
+
+def _latest_version(name):
+    """(version, checksum) of the newest stored version of a template, or None"""
+    result = lakebase.query("""
+        SELECT version, checksum
+        FROM use_case_plans.templates
+        WHERE name = %s
+        ORDER BY version DESC
+        LIMIT 1
+    """, (name,))
+    return tuple(result[0]) if result else None
+
+
+def load_template_version(version, name=DEFAULT_TEMPLATE_NAME):
+    """Load and checksum-verify one stored template version, returning its stages"""
+    result = lakebase.query("""
+        SELECT template_data, checksum
+        FROM use_case_plans.templates
+        WHERE name = %s AND version = %s
+    """, (name, version))
+    if not result:
+        raise ValueError(f"{name} v{version} not found")
+
+    document, checksum = result[0]
+    if isinstance(document, str):
+        document = json.loads(document)
+    if template_checksum(document) != checksum:
+        raise ValueError(f"{name} v{version} failed checksum validation")
+    return document_to_stages(document)
+
+
+def list_template_versions(name=DEFAULT_TEMPLATE_NAME):
+    """Stored versions of a template, newest first"""
+    _ensure_tables()
+    result = lakebase.query("""
+        SELECT version, checksum, created_by, created_at
+        FROM use_case_plans.templates
+        WHERE name = %s
+        ORDER BY version DESC
+    """, (name,)) or []
+    return [
+        {'version': row[0], 'checksum': row[1], 'created_by': row[2], 'created_at': row[3]}
+        for row in result
+    ]
+
+
+def publish_template(stages, user_name, name=DEFAULT_TEMPLATE_NAME, description=''):
+    """Store stages as a new template version unless they match the latest one
+
+    Returns (version, created).
+    """
+    _ensure_tables()
+    document = stages_to_document(stages)
+    checksum = template_checksum(document)
+
+    latest = _latest_version(name)
+    if latest and latest[1] == checksum:
+        return latest[0], False
+
+    version = (latest[0] + 1) if latest else 1
+    lakebase.query("""
+        INSERT INTO use_case_plans.templates
+            (name, description, template_data, version, checksum, created_by)
+        VALUES (%s, %s, %s::jsonb, %s, %s, %s)
+    """, (name, description, json.dumps(document), version, checksum, user_name))
+
+    with _cache_lock:
+        _template_cache[name] = {'version': version, 'checksum': checksum, 'stages': stages}
+    return version, True
+
+
+def get_template(name=DEFAULT_TEMPLATE_NAME):
+    """Return (version, stages) for the current template
+
+    The cached copy is revalidated with one SELECT version, checksum and only
+    reloaded when either changed. An empty store is seeded from the compiled
+    template. Without a database (or on errors) the compiled template is used.
+    """
+    compiled_version, compiled_stages = load_compiled_template()
+    if not Config.validate():
+        return compiled_version, compiled_stages
+
+    with _cache_lock:
+        cached = _template_cache.get(name)
+
+    try:
+        _ensure_tables()
+        latest = _latest_version(name)
+        if latest is None:
+            version, _ = publish_template(compiled_stages, 'template_compiler', name,
+                                          f"Seeded from compiled template v{compiled_version}")
+            return version, compiled_stages
+
+        version, checksum = latest
+        if cached and cached['version'] == version and cached['checksum'] == checksum:
+            return version, cached['stages']
+
+        stages = load_template_version(version, name)
+        with _cache_lock:
+            _template_cache[name] = {'version': version, 'checksum': checksum, 'stages': stages}
+        return version, stages
+
+    except Exception as e:
+        print(f"Error loading template from store: {e}")
+        if cached:
+            return cached['version'], cached['stages']
+        return compiled_version, compiled_stages
@@ -0,0 +1,145 @@
+"""
+Per-owner weekly workload across all use cases
+Counts concurrent activities per owner per (Monday-based) week: generate_series aggregation
+in Lakebase, and an incrementally maintained sweep-line over the local store
+"""
+
+from collections import Counter
+from datetime import date, timedelta
+
+from plan_utils import build_plan_rows
+from services.lakebase import lakebase
+
+UNASSIGNED_OWNER = "Unassigned"
+
+DEFAULT_WEEKS = 52
+
+# One row per (owner, week) an activity is active in, clamped to the requested window;
+# shared owners ("Alice/Bob") count for each person, as in split_owners, and local
+# use cases are excluded so they are not counted twice
+WORKLOAD_SQL = """
+    SELECT owner, week::date, COUNT(*) AS activities
+    FROM (
+        SELECT unnest(COALESCE(
+                   NULLIF(array_remove(regexp_split_to_array(TRIM(COALESCE("Owner_Name", '')), '\\s*/\\s*'), ''), '{}'),
+                   ARRAY[%(unassigned)s]
+               )) AS owner,
+               generate_series(
+                   GREATEST(date_trunc('week', LEAST("Start_Date", "End_Date")), %(window_start)s::timestamp),
+                   LEAST(date_trunc('week', GREATEST("Start_Date", "End_Date")), %(window_end)s::timestamp),
+                   interval '1 week'
+               ) AS week
+        FROM test.use_case_maps
+        WHERE "Start_Date" IS NOT NULL AND "End_Date" IS NOT NULL
+        AND daterange(LEAST("Start_Date", "End_Date"), GREATEST("Start_Date", "End_Date"), '[]')
+            && daterange(%(window_start)s::date, %(window_end)s::date + 6, '[]')
+        AND use_case_id <> ALL(%(exclude_ids)s::text[])
+    ) active
+    GROUP BY owner, week
+"""
+
+
+def split_owners(owner):
+    """People behind an owner cell: "Alice/Bob" (as AE/SA substitution produces) is two owners"""
+    return [name.strip() for name in (owner or '').split('/') if name.strip()] or [UNASSIGNED_OWNER]
+
+
+def week_start(day):
+    """Monday of the week containing day"""
+    return day - timedelta(days=day.weekday())
+
+
+def week_range(first_week, weeks=DEFAULT_WEEKS):
+    """Mondays of the window starting at first_week"""
+    first_week = week_start(first_week)
+    return [first_week + timedelta(weeks=offset) for offset in range(weeks)]
+
+
+def use_case_workload(use_case):
+    """Counter of (owner, week) -> concurrent activities for one use case
+
+    Sweep-line over the plan's activity intervals: +1 where an activity's
+    first week starts, -1 after its last week, then a running sum per owner.
+    """
+    events = {}
+    for row in build_plan_rows(use_case):
+        first = week_start(date.fromisoformat(row['Start Date']))
+        last = week_start(date.fromisoformat(row['End Date']))
+        first, last = min(first, last), max(first, last)
+        for owner in split_owners(row['Owner']):
+            deltas = events.setdefault(owner, Counter())
+            deltas[first] += 1
+            deltas[last + timedelta(weeks=1)] -= 1
+
+    load = Counter()
+    for owner, deltas in events.items():
+        event_weeks = sorted(deltas)
+        active = 0
+        for current, following in zip(event_weeks, event_weeks[1:]):
+            active += deltas[current]
+            week = current
+            while active and week < following:
+                load[(owner, week)] += active
+                week += timedelta(weeks=1)
+    return load
+
+
+class LocalWorkload:
+    """Workload of the local store, recomputed per use case only when it changes"""
+
+    def __init__(self):
+        self.contributions = {}
+        self.stamps = {}
+        self.totals = Counter()
+
+    def sync(self, use_cases):
+        """Bring the totals in line with use_cases ({id: use case}); returns the ids recomputed"""
+        changed = []
+        for use_case_id in list(self.contributions):
+            if use_case_id not in use_cases:
+                self.totals.subtract(self.contributions.pop(use_case_id))
+                self.stamps.pop(use_case_id, None)
+                changed.append(use_case_id)
+
+        for use_case_id, use_case in use_cases.items():
+            stamp = use_case.get('updated_at')
+            if self.stamps.get(use_case_id) == stamp and use_case_id in self.contributions:
+                continue
+            if use_case_id in self.contributions:
+                self.totals.subtract(self.contributions[use_case_id])
+            contribution = use_case_workload(use_case) if use_case.get('stages') else Counter()
+            self.contributions[use_case_id] = contribution
+            self.totals.update(contribution)
+            self.stamps[use_case_id] = stamp
+            changed.append(use_case_id)
+        return changed
+
+    def window(self, weeks):
+        """(owner, week) -> activities for the given weeks"""
+        wanted = set(weeks)
+        return {key: count for key, count in self.totals.items() if count > 0 and key[1] in wanted}
+
+
+def lakebase_workload(weeks, exclude_ids=()):
+    """(owner, week) -> activities from test.use_case_maps for the given weeks"""
+    rows = lakebase.query(WORKLOAD_SQL, {
+        'unassigned': UNASSIGNED_OWNER,
+        'window_start': weeks[0],
+        'window_end': weeks[-1],
+        'exclude_ids': list(exclude_ids)
+    }) or []
+    return {(owner, week): count for owner, week, count in rows}
+
+
+def workload_matrix(counts, weeks, top_owners=None):
+    """Owners (busiest peak first) and an owners x weeks list of counts"""
+    by_owner = {}
+    week_index = {week: idx for idx, week in enumerate(weeks)}
+    for (owner, week), count in counts.items():
+        if week in week_index:
+            by_owner.setdefault(owner, [0] * len(weeks))[week_index[week]] += count
+
+    owners = sorted(by_owner, key=lambda owner: (-max(by_owner[owner]), owner))
+    if top_owners:
+        owners = owners[:top_owners]
+    return owners, [by_owner[owner] for owner in owners]
@@ -0,0 +1,144 @@
+"""
+XLSX export service for Databricks Use Case Plans app
+Writes plans in the layout of the Consolidated MAP Template workbook
+using XlsxWriter's constant-memory mode, one worksheet per plan
+"""
+
+import re
+from datetime import datetime
+
+from plan_utils import build_plan_rows
+
+try:
+    import xlsxwriter
+    XLSX_AVAILABLE = True
+except ImportError:
+    xlsxwriter = None
+    XLSX_AVAILABLE = False
+
+# Column layout of the MAP sheet in the Consolidated MAP Template (A-H)
+MAP_SHEET_COLUMNS = [
+    ("Stage", 13.0),
+    ("Outcome", 31.88),
+    ("Embedded Questions", 49.63),
+    ("Owner Name", 16.75),
+    ("Start Date", 16.13),
+    ("End Date", 15.38),
+    ("Progress", 15.38),
+    ("Notes", 45.25)
+]
+
+# Template Progress dropdown values and how app statuses map onto them
+TEMPLATE_PROGRESS_OPTIONS = ["Not Started", "In Progress", "Blocked", "Complete"]
+STATUS_TO_TEMPLATE_PROGRESS = {
+    "Not Started": "Not Started",
+    "In Progress": "In Progress",
+    "Completed": "Complete",
+    "Blocked": "Blocked",
+    "On Hold": "Blocked"
+}
+
+TEMPLATE_STAGE_OPTIONS = ["U2", "U3", "U4", "U5"]
+
+# Template header colour (dark green) and row banding
+HEADER_COLOR = "#284E3F"
+BAND_COLOR = "#F6F8F9"
+
+INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+
+def _sheet_name(use_case, used_names):
+    """Unique Excel-safe worksheet name (max 31 chars) for a plan"""
+    base = INVALID_SHEET_CHARS.sub('-', use_case.get('use_case_id') or use_case.get('name') or 'MAP')
+    base = base[:31] or 'MAP'
+    name = base
+    suffix = 2
+    while name.lower() in used_names:
+        tag = f"~{suffix}"
+        name = base[:31 - len(tag)] + tag
+        suffix += 1
+    used_names.add(name.lower())
+    return name
+
+
+def _formats(workbook):
+    """Cell formats matching the template styling"""
+    border = {'border': 1, 'border_color': HEADER_COLOR, 'valign': 'top'}
+    return {
+        'title': workbook.add_format({'bold': True, 'font_size': 12}),
+        'header': workbook.add_format({**border, 'bold': True, 'font_color': '#FFFFFF',
+                                       'bg_color': HEADER_COLOR}),
+        'text': workbook.add_format({**border, 'text_wrap': True}),
+        'text_band': workbook.add_format({**border, 'text_wrap': True, 'bg_color': BAND_COLOR}),
+        'date': workbook.add_format({**border, 'num_format': 'yyyy-mm-dd'}),
+        'date_band': workbook.add_format({**border, 'num_format': 'yyyy-mm-dd',
+                                          'bg_color': BAND_COLOR}),
+    }
+
+
+def write_map_sheet(worksheet, use_case, formats):
+    """Write one plan to a worksheet in the MAP template layout
+
+    Rows are written strictly top to bottom, as constant-memory mode requires.
+    Returns the number of activity rows written.
+    """
+    for col, (_, width) in enumerate(MAP_SHEET_COLUMNS):
+        worksheet.set_column(col, col, width)
+    worksheet.freeze_panes(2, 0)
+
+    # Row 1: plan details, plus the template's "Asset Podcast" label over the questions column
+    worksheet.write(0, 0, f"{use_case.get('name', '')} • {use_case.get('customer', '')} "
+                          f"({use_case.get('use_case_id', '')})", formats['title'])
+    worksheet.write(0, 2, "Asset Podcast", formats['title'])
+
+    # Row 2: column headers
+    for col, (header, _) in enumerate(MAP_SHEET_COLUMNS):
+        worksheet.write(1, col, header, formats['header'])
+
+    row_idx = 2
+    for row in build_plan_rows(use_case):
+        # Band alternate stages like the template's stage sections
+        band = row['ID'] in ('U3', 'U5')
+        text = formats['text_band'] if band else formats['text']
+        date = formats['date_band'] if band else formats['date']
+
+        worksheet.write_string(row_idx, 0, row['ID'], text)
+        worksheet.write_string(row_idx, 1, str(row['Activity'] or ''), text)
+        worksheet.write_string(row_idx, 2, str(row['Description'] or ''), text)
+        worksheet.write_string(row_idx, 3, str(row['Owner'] or ''), text)
+        worksheet.write_datetime(row_idx, 4, datetime.strptime(row['Start Date'], '%Y-%m-%d'), date)
+        worksheet.write_datetime(row_idx, 5, datetime.strptime(row['End Date'], '%Y-%m-%d'), date)
+        worksheet.write_string(row_idx, 6, STATUS_TO_TEMPLATE_PROGRESS.get(row['Status'], row['Status']), text)
+        worksheet.write_string(row_idx, 7, str(row['Notes'] or ''), text)
+        row_idx += 1
+
+    if row_idx > 2:
+        worksheet.data_validation(2, 0, row_idx - 1, 0, {
+            'validate': 'list', 'source': TEMPLATE_STAGE_OPTIONS, 'error_type': 'information'
+        })
+        worksheet.data_validation(2, 6, row_idx - 1, 6, {
+            'validate': 'list', 'source': TEMPLATE_PROGRESS_OPTIONS
+        })
+
+    return row_idx - 2
+
+
+def write_map_workbook(use_cases, path):
+    """Write one or more plans to an XLSX workbook with a sheet per plan"""
+    if not XLSX_AVAILABLE:
+        raise ImportError("XlsxWriter is required for XLSX export")
+
+    workbook = xlsxwriter.Workbook(str(path), {'constant_memory': True})
+    try:
+        formats = _formats(workbook)
+        used_names = set()
+        for use_case in use_cases:
+            worksheet = workbook.add_worksheet(_sheet_name(use_case, used_names))
+            write_map_sheet(worksheet, use_case, formats)
+    finally:
+        workbook.close()
+
+
+def write_xlsx(use_case, path):
+    """Write a single plan as a MAP template workbook"""
+    write_map_workbook([use_case], path)